@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Benchmark of paths graph builders: build time and memory (peak RSS increase)
+of ``graph_edges_nodes_of_qs()`` and ``compact_graph_of_qs()`` on all paths
+of the database. Each build runs in a fresh process, with its own database
+connection, so that builds do not share caches or memory.
+
+Usage: bin/python bench/core_graph.py [--repeat 3]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "geotrek.settings.default")
+
+BUILDERS = ('graph_edges_nodes_of_qs', 'compact_graph_of_qs')
+
+
+def build(name):
+    """ Build the graph with builder ``name``, print measures as JSON """
+    import django
+    django.setup()
+    from django.db import connection
+    from geotrek.core import graph as graph_lib
+    from geotrek.core.models import Path
+
+    connection.ensure_connection()
+    builder = getattr(graph_lib, name)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    graph = builder(Path.objects.all())
+    duration = time.time() - start
+    print(json.dumps({
+        'seconds': duration,
+        'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss,  # kB
+        'edges': len(graph['edges'] if isinstance(graph, dict) else graph.edge_ids),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of paths graph builders")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of builds per builder")
+    parser.add_argument('--builder', choices=BUILDERS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.builder:
+        build(args.builder)
+        return
+
+    print("builder                  edges  seconds (best)  RSS kB (best)")
+    for name in BUILDERS:
+        results = []
+        for i in range(args.repeat):
+            output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--builder', name])
+            results.append(json.loads(output.splitlines()[-1]))
+        seconds = min([result['seconds'] for result in results])
+        rss = min([result['rss'] for result in results])
+        print("%-23s  %5d  %14.3f  %13d" % (name, results[0]['edges'], seconds, rss))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Benchmark of tiles download in sync_rando: time to fetch tiles from a local
+stand-in tile server, answering each tile after a delay, according to the
+number of connections per host.
+
+Usage: bin/python bench/sync_tiles.py [--tiles 256] [--delay 0.05] [--connections 1,2,4,8]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "geotrek.settings.default")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of sync_rando tiles download")
+    parser.add_argument('--tiles', type=int, default=256, help="Number of tiles to fetch")
+    parser.add_argument('--delay', type=float, default=0.05, help="Delay of each tile answer, in seconds")
+    parser.add_argument('--connections', default='1,2,4,8', help="Connections per host to compare")
+    args = parser.parse_args()
+
+    import django
+    django.setup()
+    from geotrek.trekking.management.commands.sync_rando import TileFetcher, TileStore
+    from geotrek.trekking.tests.test_sync import TileServer
+
+    server = TileServer(delay=args.delay)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    side = 1
+    while side * side < args.tiles:
+        side += 1
+    tiles = [(16, x, y) for x in range(side) for y in range(side)][:args.tiles]
+
+    print("%d tiles, %.3fs per tile" % (len(tiles), args.delay))
+    print("connections  seconds  tiles/s  max in flight")
+    try:
+        for connections in [int(n) for n in args.connections.split(',')]:
+            root = tempfile.mkdtemp(prefix='bench_sync_tiles')
+            try:
+                store = TileStore(root, tiles_url=server.url, tiles_headers={}, ignore_errors=True,
+                                  tiles_dir=os.path.join(root, 'cache'))
+                store.fetcher = TileFetcher(server.url, max_per_host=connections)
+                server.max_in_flight = 0
+                start = time.time()
+                store.fetch(tiles)
+                duration = time.time() - start
+            finally:
+                shutil.rmtree(root)
+            rate = len(tiles) / duration
+            print("%11d  %7.2f  %7.1f  %13d" % (connections, duration, rate, server.max_in_flight))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+Benchmark of topologies save: SQL statements and time per ``Topology.save()``
+on existing topologies of the database. Saves run in a transaction which is
+rolled back at the end, database is left unchanged.
+
+Usage: bin/python bench/topology_save.py [--count 500]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "geotrek.settings.default")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of topologies save")
+    parser.add_argument('--count', type=int, default=500, help="Number of topologies to save")
+    args = parser.parse_args()
+
+    import django
+    django.setup()
+    from django.db import connection, transaction
+    from django.test.utils import CaptureQueriesContext
+    from geotrek.core.models import Topology
+
+    topologies = list(Topology.objects.existing().order_by('pk')[:args.count])
+    if not topologies:
+        print("No topology in database.")
+        return
+
+    durations = []
+    with transaction.atomic():
+        with CaptureQueriesContext(connection) as queries:
+            for topology in topologies:
+                start = time.time()
+                topology.save()
+                durations.append(time.time() - start)
+        statements = len(queries)
+        transaction.set_rollback(True)
+
+    durations.sort()
+    print("%d topologies saved" % len(topologies))
+    print("statements per save: %.2f" % (float(statements) / len(topologies)))
+    print("ms per save: mean %.2f, median %.2f, max %.2f" % (1000 * sum(durations) / len(durations),
+                                                             1000 * durations[len(durations) // 2],
+                                                             1000 * durations[-1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+In-process DEM sampling.
+
+``loaddem`` exports the clipped and projected DEM as an array of square
+tiles, stored as a ``.npy`` file. It is memory-mapped here, so that
+elevations of whole grids (see ``elevation_area()``) are interpolated at
+once with NumPy, instead of running one ``ST_Value()`` per point against
+the ``mnt`` table. It is used only while its extent and pixel size match
+the ``mnt`` table.
+"""
+import json
+import logging
+import os
+
+import numpy
+from django.conf import settings
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+DATA_FILENAME = 'dem.npy'
+META_FILENAME = 'dem.json'
+
+
+def raster_extent(origin, pixel, rows, cols):
+    """ Extent (xmin, ymin, xmax, ymax) of a raster """
+    xs = [origin[0], origin[0] + cols * pixel[0]]
+    ys = [origin[1], origin[1] + rows * pixel[1]]
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+
+def export_dem(dem_path, root, tile_size=TILE_SIZE):
+    """
+    Export first band of raster at ``dem_path`` into ``root`` directory.
+    Files are written aside, then renamed, so that running processes keep
+    on sampling the former DEM until they reload it.
+    """
+    from osgeo import gdal
+
+    ds = gdal.Open(dem_path)
+    band = ds.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    cols, rows = ds.RasterXSize, ds.RasterYSize
+    tiles_y = (rows + tile_size - 1) // tile_size
+    tiles_x = (cols + tile_size - 1) // tile_size
+
+    if not os.path.exists(root):
+        os.makedirs(root)
+    data_path = os.path.join(root, DATA_FILENAME)
+    meta_path = os.path.join(root, META_FILENAME)
+    tiles = numpy.lib.format.open_memmap(data_path + '.tmp', mode='w+', dtype=numpy.float32,
+                                         shape=(tiles_y, tiles_x, tile_size, tile_size))
+    tiles[:] = numpy.nan
+    # Read one row of tiles at a time
+    for ty in range(tiles_y):
+        height = min(tile_size, rows - ty * tile_size)
+        values = band.ReadAsArray(0, ty * tile_size, cols, height).astype(numpy.float32)
+        if nodata is not None:
+            values[values == nodata] = numpy.nan
+        for tx in range(tiles_x):
+            width = min(tile_size, cols - tx * tile_size)
+            tiles[ty, tx, :height, :width] = values[:, tx * tile_size:tx * tile_size + width]
+    tiles.flush()
+    del tiles
+
+    xorigin, xpixel, _, yorigin, _, ypixel = ds.GetGeoTransform()
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump({'origin': [xorigin, yorigin],
+                   'pixel': [xpixel, ypixel],
+                   'shape': [rows, cols],
+                   'extent': raster_extent([xorigin, yorigin], [xpixel, ypixel], rows, cols),
+                   'tile_size': tile_size}, f)
+    os.rename(data_path + '.tmp', data_path)
+    os.rename(meta_path + '.tmp', meta_path)
+
+
+class DEMSampler(object):
+    """
+    Bilinear interpolation of elevations on a DEM exported by ``export_dem()``.
+    Values are NaN outside the DEM or where it has no data.
+    """
+    def __init__(self, root):
+        with open(os.path.join(root, META_FILENAME)) as f:
+            meta = json.load(f)
+        self.origin = meta['origin']
+        self.pixel = meta['pixel']
+        self.rows, self.cols = meta['shape']
+        self.tile_size = meta['tile_size']
+        self.extent = meta.get('extent') or raster_extent(self.origin, self.pixel, self.rows, self.cols)
+        self.tiles = numpy.load(os.path.join(root, DATA_FILENAME), mmap_mode='r')
+
+    def matches_database(self):
+        """ Whether the exported DEM has the extent and pixel size of the
+        ``mnt`` table, i.e. was not replaced (restored database, DEM loaded
+        without export...) since ``loaddem`` exported it.
+        """
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1 FROM information_schema.tables WHERE table_name='mnt'")
+        if cursor.rowcount == 0:
+            return False
+        cursor.execute("""SELECT ST_XMin(extent), ST_YMin(extent), ST_XMax(extent), ST_YMax(extent), x, y
+                          FROM (SELECT ST_Extent(ST_Envelope(rast)) AS extent,
+                                       max(ST_ScaleX(rast)) AS x, max(ST_ScaleY(rast)) AS y
+                                FROM mnt) AS dem""")
+        row = cursor.fetchone()
+        if row is None or None in row:
+            return False
+        tolerance = min(abs(self.pixel[0]), abs(self.pixel[1])) / 1000.0
+        expected = list(self.extent) + list(self.pixel)
+        return all([abs(a - b) <= tolerance for a, b in zip(row, expected)])
+
+    def _values(self, rows, cols):
+        t = self.tile_size
+        return self.tiles[rows // t, cols // t, rows % t, cols % t]
+
+    def sample(self, x, y):
+        """ Elevations at coordinates ``x`` and ``y`` (arrays of same shape).
+        """
+        x = numpy.asarray(x, dtype=numpy.float64)
+        y = numpy.asarray(y, dtype=numpy.float64)
+        # Position relative to pixel centers
+        col = (x - self.origin[0]) / self.pixel[0] - 0.5
+        row = (y - self.origin[1]) / self.pixel[1] - 0.5
+        inside = (col >= -0.5) & (col <= self.cols - 0.5) & (row >= -0.5) & (row <= self.rows - 0.5)
+        col = numpy.clip(col, 0, self.cols - 1)
+        row = numpy.clip(row, 0, self.rows - 1)
+        c0 = numpy.floor(col).astype(numpy.intp)
+        r0 = numpy.floor(row).astype(numpy.intp)
+        c1 = numpy.minimum(c0 + 1, self.cols - 1)
+        r1 = numpy.minimum(r0 + 1, self.rows - 1)
+        fc = col - c0
+        fr = row - r0
+        top = self._values(r0, c0) * (1 - fc) + self._values(r0, c1) * fc
+        bottom = self._values(r1, c0) * (1 - fc) + self._values(r1, c1) * fc
+        z = top * (1 - fr) + bottom * fr
+        # Next to missing data, use nearest pixel
+        missing = numpy.isnan(z)
+        if missing.any():
+            nearest = self._values(numpy.rint(row).astype(numpy.intp), numpy.rint(col).astype(numpy.intp))
+            z = numpy.where(missing, nearest, z)
+        return numpy.where(inside, z, numpy.nan)
+
+    def grid(self, xs, ys):
+        """ Elevations on the grid of ``xs`` columns and ``ys`` lines,
+        as an array of shape (len(ys), len(xs)).
+        """
+        x, y = numpy.meshgrid(numpy.asarray(xs, dtype=numpy.float64), numpy.asarray(ys, dtype=numpy.float64))
+        return self.sample(x, y)
+
+
+_sampler = (None, None)
+
+
+def get_sampler():
+    """
+    Return the sampler of DEM exported in ``ALTIMETRIC_DEM_ROOT``, or None if
+    there is none, or if it does not match the DEM of the database (see
+    ``DEMSampler.matches_database()``). It is reloaded when ``loaddem``
+    exports a new DEM.
+    """
+    global _sampler
+    root = settings.ALTIMETRIC_DEM_ROOT
+    if not root:
+        return None
+    try:
+        mtime = os.path.getmtime(os.path.join(root, META_FILENAME))
+    except OSError:
+        return None
+    if _sampler[0] != (root, mtime):
+        try:
+            _sampler = ((root, mtime), DEMSampler(root))
+        except (IOError, ValueError) as e:
+            logger.warning("Cannot load DEM from %s: %s" % (root, e))
+            return None
+    if not _sampler[1].matches_database():
+        logger.warning("DEM exported in %s does not match database DEM, run loaddem again." % root)
+        return None
+    return _sampler[1]
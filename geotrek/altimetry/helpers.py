@@ -1,18 +1,52 @@
 import logging
+import os
+import tempfile
 
 from django.contrib.gis.geos import GEOSGeometry
 from django.utils.translation import ugettext as _
-from django.contrib.gis.geos import LineString
+from django.contrib.gis.geos import Polygon
 from django.conf import settings
 from django.db import connection
 
+import numpy
 import pygal
 from pygal.style import LightSolarizedStyle
 
+from .dem import get_sampler
+
 
 logger = logging.getLogger(__name__)
 
 
+class AltimetryProfile(object):
+    """
+    Elevation profile, as an array of (distance, lng, lat, elevation) rows.
+    """
+    def __init__(self, values):
+        self.values = numpy.asarray(values, dtype=numpy.float64).reshape(-1, 4)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    @property
+    def distances(self):
+        return self.values[:, 0]
+
+    @property
+    def coords(self):
+        return self.values[:, 1:3]
+
+    @property
+    def elevations(self):
+        return self.values[:, 3]
+
+
 class AltimetryHelper(object):
     @classmethod
     def elevation_profile(cls, geometry3d, precision=None, offset=0):
@@ -22,37 +56,33 @@ class AltimetryHelper(object):
         """
         precision = precision or settings.ALTIMETRIC_PROFILE_PRECISION
 
+        geom3dapi = geometry3d.transform(settings.API_SRID, clone=True)
         if geometry3d.geom_type == 'MultiLineString':
-            profile = []
-            for subcoords in geometry3d.coords:
-                subline = LineString(subcoords, srid=geometry3d.srid)
-                offset += subline.length
-                subprofile = AltimetryHelper.elevation_profile(subline, precision, offset)
-                profile.extend(subprofile)
-            return profile
-
-        # Add measure to 2D version of geometry3d
-        # Get distance from origin for each vertex
-        sql = """
-        WITH line2d AS (SELECT ST_force_2D('%(ewkt)s'::geometry) AS geom),
-             line_measure AS (SELECT ST_Addmeasure(geom, 0, ST_length(geom)) AS geom FROM line2d),
-             points2dm AS (SELECT (ST_DumpPoints(geom)).geom AS point FROM line_measure)
-        SELECT (%(offset)s + ST_M(point)) FROM points2dm;
-        """ % {'offset': offset, 'ewkt': geometry3d.ewkt}
-        cursor = connection.cursor()
-        cursor.execute(sql)
-        pointsm = cursor.fetchall()
+            parts = geometry3d.coords
+            partsapi = geom3dapi.coords
+        else:
+            parts = [geometry3d.coords]
+            partsapi = [geom3dapi.coords]
+        if not any(parts):
+            return AltimetryProfile([])
+        xyz = numpy.concatenate([numpy.asarray(part, dtype=numpy.float64) for part in parts])
+        xyzapi = numpy.concatenate([numpy.asarray(part, dtype=numpy.float64) for part in partsapi])
+        assert len(xyz) == len(xyzapi), 'Cannot map distance to xyz'
+
+        # Get 2D distance from origin for each vertex
+        steps = numpy.zeros(len(xyz))
+        steps[1:] = numpy.hypot(*(xyz[1:, :2] - xyz[:-1, :2]).T)
+        # Parts are joined, without counting the gap between them
+        steps[numpy.cumsum([len(part) for part in parts])[:-1]] = 0
+        distances = offset + numpy.cumsum(steps)
         # Join (offset+distance, x, y, z) together
-        geom3dapi = geometry3d.transform(settings.API_SRID, clone=True)
-        assert len(pointsm) == len(geom3dapi.coords), 'Cannot map distance to xyz'
-        dxyz = [pointsm[i] + v for i, v in enumerate(geom3dapi.coords)]
-        return dxyz
+        return AltimetryProfile(numpy.column_stack([distances, xyzapi[:, :3]]))
 
     @classmethod
     def altimetry_limits(cls, profile):
-        elevations = [int(v[3]) for v in profile]
-        min_elevation = int(min(elevations))
-        max_elevation = int(max(elevations))
+        elevations = profile.elevations.astype(int)
+        min_elevation = int(elevations.min())
+        max_elevation = int(elevations.max())
         floor_elevation = round(min_elevation, 100) - 100
         ceil_elevation = round(max_elevation, 100) + 100
         if ceil_elevation < floor_elevation + settings.ALTIMETRIC_PROFILE_MIN_YSCALE:
@@ -94,7 +124,7 @@ class AltimetryHelper(object):
         line_chart.truncate_label = 50
         line_chart.range = [floor_elevation, ceil_elevation]
         line_chart.no_data_text = _(u"Altimetry data not available")
-        line_chart.add('', [(int(v[0]), int(v[3])) for v in profile])
+        line_chart.add('', zip(profile.distances.astype(int).tolist(), profile.elevations.astype(int).tolist()))
         return line_chart.render()
 
     @classmethod
@@ -130,6 +160,11 @@ class AltimetryHelper(object):
             precision = int(width / max_resolution)
         if height / precision > 10000:
             precision = int(width / max_resolution)
+
+        sampler = get_sampler()
+        if sampler is not None:
+            return cls._elevation_area_of_sampler(sampler, xmin, ymin, xmax, ymax, precision)
+
         cursor = connection.cursor()
         cursor.execute("SELECT 1 FROM information_schema.tables WHERE table_name='mnt'")
         if cursor.rowcount == 0:
@@ -190,13 +225,41 @@ class AltimetryHelper(object):
         envelop = GEOSGeometry(envelop, srid=4326)
         envelop_native = GEOSGeometry(envelop_native, srid=settings.SRID)
 
+        return cls._elevation_area(envelop_native, envelop, center_z, min_z, max_z,
+                                   resolution_w, resolution_h, precision,
+                                   [record[7] for record in result])
+
+    @classmethod
+    def _elevation_area_of_sampler(cls, sampler, xmin, ymin, xmax, ymax, precision):
+        """ Same as the SQL query of ``elevation_area()``, with the local DEM sampler.
+        """
+        xs = range(xmin, xmax + 1, precision)
+        ys = range(ymin, ymax + 1, precision)
+        grid = sampler.grid(xs, ys).ravel()
+        # Like ``::int`` casts of PostgreSQL, round half away from zero
+        grid = numpy.sign(grid) * numpy.floor(numpy.abs(grid) + 0.5)
+        draped = grid[~numpy.isnan(grid)]
+        if len(draped) == 0:
+            min_z = max_z = center_z = None
+        else:
+            min_z, max_z, center_z = int(draped.min()), int(draped.max()), draped.mean()
+        envelop_native = Polygon.from_bbox((xs[0], ys[0], xs[-1], ys[-1]))
+        envelop_native.srid = settings.SRID
+        envelop = envelop_native.transform(4326, clone=True)
+        altitudes = [None if numpy.isnan(z) else int(z) for z in grid]
+        return cls._elevation_area(envelop_native, envelop, center_z, min_z, max_z,
+                                   len(xs), len(ys), precision, altitudes)
+
+    @classmethod
+    def _elevation_area(cls, envelop_native, envelop, center_z, min_z, max_z,
+                        resolution_w, resolution_h, precision, draped):
         altitudes = []
         row = []
-        for i, record in enumerate(result):
+        for i, altitude in enumerate(draped):
             if i > 0 and i % resolution_w == 0:
                 altitudes.append(row)
                 row = []
-            elevation = (record[7] or 0.0) - min_z
+            elevation = (altitude or 0.0) - min_z
             row.append(elevation)
         altitudes.append(row)
 
@@ -244,3 +307,20 @@ class AltimetryHelper(object):
             'altitudes': altitudes
         }
         return area
+
+
+def svg_to_png(svg, path):
+    """Render SVG chart into a PNG file at ``path``, with CairoSVG.
+    File is written aside, then renamed, so that it is never served incomplete.
+    """
+    import cairosvg
+    # A temporary file of its own, in case of concurrent renderings
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            cairosvg.svg2png(bytestring=svg, write_to=f)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand, CommandError
 from django.db import connection
 from django.conf import settings
+from geotrek.altimetry.dem import export_dem
 from optparse import make_option
 import os.path
 from subprocess import call
@@ -155,19 +156,37 @@ class Command(BaseCommand):
                 raise Exception('raster2pgsql failed with exit code %d' % ret)
         except Exception as e:
             output.close()
+            new_dem.close()
             msg = 'Caught %s: %s' % (e.__class__.__name__, e,)
             raise CommandError(msg)
-        finally:
-            new_dem.close()
         self.stdout.write('DEM successfully converted to SQL.\n')
 
-        # Step 3: Dump SQL code into database
+        # Step 3: Dump SQL code into database (within raster2pgsql BEGIN/END)
         self.stdout.write('\n-- Loading DEM into database -----------\n')
-        cur = connection.cursor()
-        output.file.seek(0)
-        for sql_line in output.file:
-            cur.execute(sql_line)
-        cur.close()
-        output.close()
+        try:
+            cur = connection.cursor()
+            output.file.seek(0)
+            for sql_line in output.file:
+                cur.execute(sql_line)
+            cur.close()
+        except Exception:
+            new_dem.close()
+            raise
+        finally:
+            output.close()
         self.stdout.write('DEM successfully loaded.\n')
+
+        # Step 4: export raster for in-process sampling, once loaded in database
+        if settings.ALTIMETRIC_DEM_ROOT:
+            try:
+                self.stdout.write('\n-- Exporting DEM for local sampling ----\n')
+                export_dem(new_dem.name, settings.ALTIMETRIC_DEM_ROOT)
+            except Exception as e:
+                msg = 'Caught %s: %s' % (e.__class__.__name__, e,)
+                raise CommandError(msg)
+            finally:
+                new_dem.close()
+            self.stdout.write('DEM successfully exported to %s.\n' % settings.ALTIMETRIC_DEM_ROOT)
+        else:
+            new_dem.close()
         return
@@ -3,6 +3,8 @@ import logging
 from django.conf import settings
 from django.core.urlresolvers import NoReverseMatch
 
+from mapentity.helpers import is_file_newer
+
 from geotrek.common.management.commands.prepare_map_images import Command as PrepareImageCommand
 
 from geotrek.altimetry.models import AltimetryMixin
@@ -15,6 +17,7 @@ class Command(PrepareImageCommand):
     help = "Generates all altimetric profiles"
 
     start_model_msg = "Generate all elevation charts model %s"
+    up_to_date_msg = '%s profile up-to-date.'
 
     def get_models(self):
         with_profiles = []
@@ -31,9 +34,17 @@ class Command(PrepareImageCommand):
                 pass
         return with_profiles
 
-    def handle_instance(self, instance):
-        rooturl = self.options.get('url', self.DEFAULT_URL)
+    def get_tasks(self, instance):
+        tasks = []
+        up_to_date = []
         for language, name in settings.MAPENTITY_CONFIG['TRANSLATED_LANGUAGES']:
-            refreshed = instance.prepare_elevation_chart(language, rooturl)
-            if not refreshed:
-                logger.info('%s profile up-to-date.' % instance.get_elevation_chart_path(language))
+            path = instance.get_elevation_chart_path(language)
+            if is_file_newer(path, instance.date_update):
+                up_to_date.append(path)
+            else:
+                tasks.append((type(instance), instance.pk, language))
+        return tasks, up_to_date
+
+    def prepare(self, instance, language):
+        rooturl = self.options.get('url', self.DEFAULT_URL)
+        instance.prepare_elevation_chart(language, rooturl)
@@ -1,12 +1,15 @@
+import hashlib
 import os
 
 from django.conf import settings
+from django.core.cache import get_cache
 from django.contrib.gis.db import models
+from django.utils import translation
 from django.utils.translation import get_language, ugettext_lazy as _
 from django.template.defaultfilters import floatformat
 
 from mapentity.helpers import is_file_newer, convertit_download, smart_urljoin
-from .helpers import AltimetryHelper
+from .helpers import AltimetryHelper, AltimetryProfile, svg_to_png
 
 
 class AltimetryMixin(models.Model):
@@ -49,17 +52,55 @@ class AltimetryMixin(models.Model):
         self.slope = fromdb.slope
         return self
 
+    def _elevation_cache_key(self):
+        return 'altimetry_profile_%s_%s' % (self._meta.model_name, self.pk)
+
+    def _elevation_cache_version(self):
+        geom_hash = hashlib.md5(bytes(self.geom_3d.ewkb)).hexdigest() if self.geom_3d else ''
+        return (self.date_update, geom_hash, settings.ALTIMETRIC_PROFILE_PRECISION)
+
+    def _get_elevation_cache(self):
+        """Profile and limits, stored in the ``altimetry`` cache under a key
+        per object, replaced when the object is updated. SVG charts are
+        stored aside, by language (see ``get_elevation_profile_svg()``).
+        """
+        cache = get_cache('altimetry')
+        key = self._elevation_cache_key()
+        version = self._elevation_cache_version()
+        cached = cache.get(key)
+        if cached is None or cached['version'] != version:
+            profile = AltimetryHelper.elevation_profile(self.geom_3d)
+            cached = {
+                'version': version,
+                'profile': profile.values,
+                'limits': AltimetryHelper.altimetry_limits(profile) if len(profile) else None,
+            }
+            cache.set(key, cached, None)
+        return key, cached
+
     def get_elevation_profile(self):
-        return AltimetryHelper.elevation_profile(self.geom_3d)
+        key, cached = self._get_elevation_cache()
+        return AltimetryProfile(cached['profile'])
 
     def get_elevation_area(self):
         return AltimetryHelper.elevation_area(self.geom)
 
     def get_elevation_limits(self):
-        return AltimetryHelper.altimetry_limits(self.get_elevation_profile())
+        key, cached = self._get_elevation_cache()
+        return cached['limits']
 
     def get_elevation_profile_svg(self):
-        return AltimetryHelper.profile_svg(self.get_elevation_profile())
+        cache = get_cache('altimetry')
+        key, cached = self._get_elevation_cache()
+        svg_key = '%s_svg_%s' % (key, get_language())
+        cached_svg = cache.get(svg_key)
+        if cached_svg is None or cached_svg['version'] != cached['version']:
+            cached_svg = {
+                'version': cached['version'],
+                'svg': AltimetryHelper.profile_svg(AltimetryProfile(cached['profile'])),
+            }
+            cache.set(svg_key, cached_svg, None)
+        return cached_svg['svg']
 
     @models.permalink
     def get_elevation_chart_url(self):
@@ -78,14 +119,23 @@ class AltimetryMixin(models.Model):
             os.mkdir(basefolder)
         return os.path.join(basefolder, '%s-%s-%s.png' % (self._meta.model_name, self.pk, language))
 
+    def get_elevation_chart_svg(self, language):
+        """SVG elevation chart, translated in ``language``.
+        """
+        with translation.override(language):
+            return self.get_elevation_profile_svg()
+
     def prepare_elevation_chart(self, language, rooturl):
-        """Converts SVG elevation URI to PNG on disk.
+        """Converts SVG elevation chart to PNG on disk.
         """
         from .views import HttpSVGResponse
         path = self.get_elevation_chart_path(language)
         # Do nothing if image is up-to-date
         if is_file_newer(path, self.date_update):
             return False
+        if settings.ALTIMETRIC_PROFILE_LOCAL_RENDERING:
+            svg_to_png(self.get_elevation_chart_svg(language), path)
+            return True
         # Download converted chart as png using convertit
         source = smart_urljoin(rooturl, self.get_elevation_chart_url())
         convertit_download(source,
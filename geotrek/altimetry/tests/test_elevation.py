@@ -1,11 +1,25 @@
+import json
+import math
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+
+import mock
+import numpy
 from django.conf import settings
+from django.core.cache import get_cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import translation
 from django.db import connections, DEFAULT_DB_ALIAS
 from django.contrib.gis.geos import MultiLineString, LineString
 
 from geotrek.core.models import Path
 from geotrek.core.factories import TopologyFactory
-from geotrek.altimetry.helpers import AltimetryHelper
+from geotrek.altimetry.dem import DATA_FILENAME, META_FILENAME, DEMSampler, get_sampler
+from geotrek.altimetry.helpers import AltimetryHelper, svg_to_png
 
 
 class ElevationTest(TestCase):
@@ -102,6 +116,15 @@ class ElevationProfileTest(TestCase):
         profile = AltimetryHelper.elevation_profile(geom)
         self.assertEqual(len(profile), 4)
 
+    def test_elevation_profile_multilinestring_distances(self):
+        geom = MultiLineString(LineString((1.5, 2.5, 8), (2.5, 2.5, 10)),
+                               LineString((2.5, 2.5, 6), (2.5, 0, 7)),
+                               srid=settings.SRID)
+        profile = AltimetryHelper.elevation_profile(geom)
+        self.assertEqual(profile.distances.tolist(), [0, 1, 1, 3.5])
+        self.assertEqual(profile.elevations.tolist(), [8, 10, 6, 7])
+        self.assertEqual(profile.coords.shape, (4, 2))
+
     def test_elevation_svg_output(self):
         geom = LineString((1.5, 2.5, 8), (2.5, 2.5, 10),
                           srid=settings.SRID)
@@ -111,6 +134,20 @@ class ElevationProfileTest(TestCase):
         self.assertIn(settings.ALTIMETRIC_PROFILE_BACKGROUND, svg)
         self.assertIn(settings.ALTIMETRIC_PROFILE_COLOR, svg)
 
+    def test_elevation_png_output(self):
+        geom = LineString((1.5, 2.5, 8), (2.5, 2.5, 10),
+                          srid=settings.SRID)
+        svg = AltimetryHelper.profile_svg(AltimetryHelper.elevation_profile(geom))
+        folder = tempfile.mkdtemp()
+        try:
+            path = os.path.join(folder, 'profile.png')
+            svg_to_png(svg, path)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(8), '\x89PNG\r\n\x1a\n')
+            self.assertEqual(os.listdir(folder), ['profile.png'])
+        finally:
+            shutil.rmtree(folder)
+
     def test_elevation_altimetry_limits(self):
         geom = LineString((1.5, 2.5, 8), (2.5, 2.5, 10),
                           srid=settings.SRID)
@@ -120,6 +157,88 @@ class ElevationProfileTest(TestCase):
         self.assertEqual(limits[1], -92)
 
 
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    'fat': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    'altimetry': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'altimetry-tests'},
+})
+class ElevationProfileCacheTest(TestCase):
+    def setUp(self):
+        self.path = Path.objects.create(geom=LineString((78, 117), (3, 17)))
+
+    def test_profile_and_svg_are_computed_once(self):
+        with mock.patch('geotrek.altimetry.helpers.AltimetryHelper.profile_svg', return_value='<svg/>') as svg:
+            with mock.patch('geotrek.altimetry.helpers.AltimetryHelper.elevation_profile',
+                            wraps=AltimetryHelper.elevation_profile) as profile:
+                self.path.get_elevation_profile()
+                self.path.get_elevation_limits()
+                self.assertEqual(self.path.get_elevation_profile_svg(), '<svg/>')
+                self.assertEqual(self.path.get_elevation_profile_svg(), '<svg/>')
+                self.assertEqual(profile.call_count, 1)
+                self.assertEqual(svg.call_count, 1)
+
+    @override_settings(ALTIMETRIC_PROFILE_LOCAL_RENDERING=False)
+    def test_chart_is_converted_by_convertit(self):
+        path = self.path.get_elevation_chart_path('en')
+        if os.path.exists(path):
+            os.remove(path)
+        self.assertTrue(self.path.prepare_elevation_chart('en', 'http://localhost'))
+        with open(path) as f:
+            self.assertEqual(f.read(), 'Mock\n')
+        self.assertFalse(self.path.prepare_elevation_chart('en', 'http://localhost'))
+        os.remove(path)
+
+    def test_svg_is_cached_by_language(self):
+        with mock.patch('geotrek.altimetry.helpers.AltimetryHelper.profile_svg',
+                        side_effect=lambda profile: '<svg lang="%s"/>' % translation.get_language()) as svg:
+            self.assertEqual(self.path.get_elevation_chart_svg('en'), '<svg lang="en"/>')
+            self.assertEqual(self.path.get_elevation_chart_svg('fr'), '<svg lang="fr"/>')
+            self.assertEqual(self.path.get_elevation_chart_svg('en'), '<svg lang="en"/>')
+            self.assertEqual(svg.call_count, 2)
+
+    def test_profile_is_computed_again_when_updated(self):
+        profile = self.path.get_elevation_profile()
+        self.path.geom = LineString((78, 117), (3, 17), (3, 50))
+        self.path.save()
+        self.assertEqual(len(self.path.get_elevation_profile()), len(profile) + 1)
+
+    def test_profile_is_replaced_when_updated(self):
+        cache = get_cache('altimetry')
+        key, cached = self.path._get_elevation_cache()
+        entries = len(cache._cache)
+        self.path.geom = LineString((78, 117), (3, 17), (3, 50))
+        self.path.save()
+        self.path.get_elevation_profile()
+        self.assertEqual(key, self.path._elevation_cache_key())
+        self.assertNotEqual(cache.get(key)['version'], cached['version'])
+        self.assertEqual(len(cache._cache), entries)
+
+
+@override_settings(ALTIMETRIC_PROFILE_LOCAL_RENDERING=False)
+class PrepareElevationChartsTest(TestCase):
+    def setUp(self):
+        self.path = Path.objects.create(geom=LineString((78, 117), (3, 17)))
+        self.paths = [self.path.get_elevation_chart_path(language)
+                      for language, name in settings.MAPENTITY_CONFIG['TRANSLATED_LANGUAGES']]
+        self.tearDown()
+
+    def tearDown(self):
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_stale_charts_only_are_generated(self):
+        output = StringIO()
+        call_command('prepare_elevation_charts', stdout=output)
+        self.assertIn('4 generated, 0 skipped, 0 failed', output.getvalue())
+        for path in self.paths:
+            self.assertTrue(os.path.exists(path))
+        os.remove(self.paths[0])
+        output = StringIO()
+        call_command('prepare_elevation_charts', stdout=output)
+        self.assertIn('1 generated, 3 skipped, 0 failed', output.getvalue())
+
+
 class ElevationAreaTest(TestCase):
     def setUp(self):
         self._fill_raster()
@@ -196,6 +315,113 @@ class ElevationAreaTest(TestCase):
         self.assertEqual(extent['altitudes']['min'], 0)
 
 
+def write_dem(root, values, origin, pixel, tile_size=2):
+    """ Write DEM files as exported by ``loaddem``, for the local sampler.
+    """
+    rows, cols = len(values), len(values[0])
+    tiles = numpy.empty(((rows + tile_size - 1) // tile_size, (cols + tile_size - 1) // tile_size,
+                         tile_size, tile_size), dtype=numpy.float32)
+    tiles[:] = numpy.nan
+    for row in range(rows):
+        for col in range(cols):
+            tiles[row // tile_size, col // tile_size, row % tile_size, col % tile_size] = values[row][col]
+    numpy.save(os.path.join(root, DATA_FILENAME), tiles)
+    with open(os.path.join(root, META_FILENAME), 'w') as f:
+        json.dump({'origin': origin, 'pixel': pixel, 'shape': [rows, cols], 'tile_size': tile_size}, f)
+
+
+def create_mnt(cols, rows, origin, pixel):
+    """ Create an empty ``mnt`` table of given shape, as ``loaddem`` would """
+    cur = connections[DEFAULT_DB_ALIAS].cursor()
+    cur.execute('CREATE TABLE mnt (rid serial primary key, rast raster)')
+    cur.execute('INSERT INTO mnt (rast) VALUES (ST_AddBand(ST_MakeEmptyRaster(%s, %s, %s, %s, %s, %s, 0, 0, %s), \'16BSI\'))',
+                [cols, rows, origin[0], origin[1], pixel[0], pixel[1], settings.SRID])
+
+
+DEM_VALUES = [[0, 0, 3, 5], [2, 2, 10, 15], [5, 15, 20, 25], [20, 25, 30, 35], [30, 35, 40, 45]]
+
+
+class DEMSamplerTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        write_dem(self.root, DEM_VALUES, origin=[0, 125], pixel=[25, -25])
+        self.sampler = DEMSampler(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_values_at_pixel_centers(self):
+        z = self.sampler.sample([12.5, 62.5, 87.5], [112.5, 87.5, 12.5])
+        self.assertEqual(list(z), [0, 10, 45])
+
+    def test_values_are_interpolated_between_pixel_centers(self):
+        self.assertAlmostEqual(float(self.sampler.sample(50, 87.5)), 6)
+        self.assertAlmostEqual(float(self.sampler.sample(50, 75)), 11.75)
+
+    def test_values_outside_dem_are_nan(self):
+        self.assertTrue(math.isnan(self.sampler.sample(200, 200)))
+        self.assertTrue(math.isnan(self.sampler.sample(-13, 50)))
+
+    def test_values_on_border_use_edge_pixels(self):
+        self.assertAlmostEqual(float(self.sampler.sample(0, 125)), 0)
+        self.assertAlmostEqual(float(self.sampler.sample(100, 0)), 45)
+
+    def test_missing_values_use_nearest_pixel(self):
+        values = [row[:] for row in DEM_VALUES]
+        values[0][1] = float('nan')
+        write_dem(self.root, values, origin=[0, 125], pixel=[25, -25])
+        sampler = DEMSampler(self.root)
+        self.assertAlmostEqual(float(sampler.sample(20, 112.5)), 0)
+        self.assertTrue(math.isnan(sampler.sample(37.5, 112.5)))
+
+    def test_grid(self):
+        grid = self.sampler.grid([12.5, 37.5, 62.5, 87.5], [12.5, 112.5])
+        self.assertEqual(grid.shape, (2, 4))
+        self.assertEqual(list(grid[0]), DEM_VALUES[-1])
+        self.assertEqual(list(grid[1]), DEM_VALUES[0])
+
+    def test_sampler_is_loaded_from_settings(self):
+        create_mnt(4, 5, origin=[0, 125], pixel=[25, -25])
+        with override_settings(ALTIMETRIC_DEM_ROOT=self.root):
+            sampler = get_sampler()
+            self.assertEqual((sampler.rows, sampler.cols), (5, 4))
+        with override_settings(ALTIMETRIC_DEM_ROOT=None):
+            self.assertIsNone(get_sampler())
+
+    def test_sampler_is_not_used_without_database_dem(self):
+        with override_settings(ALTIMETRIC_DEM_ROOT=self.root):
+            self.assertIsNone(get_sampler())
+
+    def test_sampler_is_not_used_when_database_dem_differs(self):
+        create_mnt(4, 5, origin=[0, 150], pixel=[25, -25])
+        with override_settings(ALTIMETRIC_DEM_ROOT=self.root):
+            self.assertIsNone(get_sampler())
+
+
+class ElevationAreaSamplerTest(ElevationAreaTest):
+    """ Same as ``ElevationAreaTest``, using the local DEM sampler """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        write_dem(self.root, DEM_VALUES, origin=[0, 125], pixel=[25, -25])
+        self.override = override_settings(ALTIMETRIC_DEM_ROOT=self.root)
+        self.override.enable()
+        super(ElevationAreaSamplerTest, self).setUp()
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.root)
+
+    def _fill_raster(self):
+        # Same extent as the exported DEM, values are read from the latter
+        create_mnt(4, 5, origin=[0, 125], pixel=[25, -25])
+
+    def test_area_provides_altitudes_extent(self):
+        # Values are interpolated, maximum (45) is at a pixel center, not on the grid
+        extent = self.area['extent']
+        self.assertEqual(extent['altitudes']['max'], 42)
+        self.assertEqual(extent['altitudes']['min'], 0)
+
+
 class LengthTest(TestCase):
 
     def setUp(self):
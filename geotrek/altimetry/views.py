@@ -48,10 +48,11 @@ class ElevationProfile(LastModifiedMixin, JSONResponseMixin,
         data = {}
         elevation_profile = self.object.get_elevation_profile()
         # Formatted as distance, elevation, [lng, lat]
-        for step in elevation_profile:
-            formatted = step[0], step[3], step[1:3]
-            data.setdefault('profile', []).append(formatted)
-        data['limits'] = dict(zip(['ceil', 'floor'], self.object.get_elevation_limits()))
+        if len(elevation_profile):
+            data['profile'] = zip(elevation_profile.distances.tolist(),
+                                  elevation_profile.elevations.tolist(),
+                                  elevation_profile.coords.tolist())
+        data['limits'] = dict(zip(['ceil', 'floor'], self.object.get_elevation_limits() or ()))
         return data
 
 
@@ -1,12 +1,135 @@
+import logging
+from multiprocessing import Pool
+from optparse import make_option
+import time
+
+from django.core.management.base import CommandError
+from django.db import connections
+
 from geotrek.common.mixins import NoDeleteMixin
+from mapentity.helpers import is_file_newer
 from mapentity.management.commands.prepare_map_images import Command as MapentityCommand
 
 
+logger = logging.getLogger(__name__)
+
+_worker_command = None
+
+
+def init_prepare_worker(command):
+    """ Pool initializer. Workers are forked from the command process.
+    The database connections were closed before forking, so that each
+    worker opens its own.
+    """
+    global _worker_command
+    _worker_command = command
+
+
+def prepare_worker(task):
+    return _worker_command.run_task(task)
+
+
 class Command(MapentityCommand):
-    """Override mapentity command of the same name to exclude deleted objects."""
+    """Override mapentity command of the same name to exclude deleted objects,
+    and to generate stale images only, in a pool of processes."""
+
+    option_list = MapentityCommand.option_list + (
+        make_option('--jobs', '-j', action='store', dest='jobs', type='int',
+                    default=1, help='Number of processes used to generate images'),
+    )
+
+    up_to_date_msg = '%s image up-to-date.'
 
     def get_instances(self, model):
         if issubclass(model, NoDeleteMixin):
             return model.objects.existing()
         else:
             return model.objects.all()
+
+    def get_tasks(self, instance):
+        """Return the tasks to generate stale images of instance, as
+        (model, pk, language) tuples, and the paths of up-to-date images.
+        """
+        if instance.get_geom() is None:
+            return [], []
+        path = instance.get_map_image_path()
+        if is_file_newer(path, instance.get_date_update()):
+            return [], [path]
+        return [(type(instance), instance.pk, None)], []
+
+    def prepare(self, instance, language):
+        rooturl = self.options.get('url', self.DEFAULT_URL)
+        instance.prepare_map_image(rooturl)
+
+    def run_task(self, task):
+        """Return success and duration of a task.
+        """
+        model, pk, language = task
+        start = time.time()
+        try:
+            self.prepare(model.objects.get(pk=pk), language)
+        except Exception as e:
+            logger.error("Failed to generate image of %s %s: %s" % (model._meta.model_name, pk, e))
+            return False, time.time() - start
+        return True, time.time() - start
+
+    def plan(self):
+        """Check all images up front, and return the tasks of stale ones and
+        the count of up-to-date ones.
+        """
+        tasks = []
+        skipped = 0
+        for model in self.get_models():
+            logger.info(self.start_model_msg % model)
+            for instance in self.get_instances(model):
+                stale, up_to_date = self.get_tasks(instance)
+                for path in up_to_date:
+                    logger.info(self.up_to_date_msg % path)
+                tasks.extend(stale)
+                skipped += len(up_to_date)
+        return tasks, skipped
+
+    def run_tasks(self, tasks):
+        """Yield results of ``run_task()`` for each task.
+        If several jobs were requested, tasks are spread among a pool of processes.
+        """
+        jobs = int(self.options.get('jobs') or 1)
+        if jobs <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                yield self.run_task(task)
+            return
+
+        # Workers must not share the database connection of this process
+        for connection in connections.all():
+            connection.close()
+        pool = Pool(min(jobs, len(tasks)), initializer=init_prepare_worker, initargs=(self, ))
+        try:
+            for result in pool.imap_unordered(prepare_worker, tasks):
+                yield result
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def handle_noargs(self, **options):
+        self.options = options
+        start = time.time()
+        tasks, skipped = self.plan()
+        logger.info("%d images to generate, %d up-to-date (checked in %.1fs)" % (len(tasks), skipped, time.time() - start))
+
+        generated = failed = 0
+        duration = 0.0
+        for success, elapsed in self.run_tasks(tasks):
+            if success:
+                generated += 1
+            else:
+                failed += 1
+            duration += elapsed
+
+        self.stdout.write("%d generated, %d skipped, %d failed in %.1fs (%.2fs per image)\n" % (
+            generated, skipped, failed, time.time() - start, duration / len(tasks) if tasks else 0))
+        if failed:
+            raise CommandError("%d images could not be generated" % failed)
+        logger.info("Done.")
@@ -398,8 +398,42 @@ OptionalPictogramMixin._meta.get_field('pictogram').blank = True
 
 class AddPropertyMixin(object):
     @classmethod
-    def add_property(cls, name, func, verbose_name):
+    def add_property(cls, name, func, verbose_name, prefetch=None):
+        """
+        ``prefetch``, if given, computes the property for a list of instances
+        at once, and returns a dict of values indexed by instance pk.
+        See ``prefetch_properties()``.
+        """
         if hasattr(cls, name):
             raise AttributeError("%s has already an attribute %s" % (cls, name))
-        setattr(cls, name, property(func))
+
+        def getter(self):
+            prefetched = getattr(self, '_prefetched_properties', {})
+            if name in prefetched:
+                return prefetched[name]
+            return func(self)
+
+        setattr(cls, name, property(getter))
         setattr(cls, '%s_verbose_name' % name, verbose_name)
+        if prefetch is not None:
+            setattr(cls, '_prefetch_%s' % name, staticmethod(prefetch))
+
+    @classmethod
+    def prefetch_properties(cls, objects, *names):
+        """
+        Compute the given properties for all objects with one query per
+        property, instead of one per object. Properties registered without
+        prefetch function and unknown names are ignored.
+        Return objects as a list.
+        """
+        objects = list(objects)
+        for name in names:
+            prefetch = getattr(cls, '_prefetch_%s' % name, None)
+            if prefetch is None or not objects:
+                continue
+            values = prefetch(objects)
+            for obj in objects:
+                if not hasattr(obj, '_prefetched_properties'):
+                    obj._prefetched_properties = {}
+                obj._prefetched_properties[name] = values.get(obj.pk, [])
+        return objects
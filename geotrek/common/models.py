@@ -3,12 +3,15 @@ from PIL import Image
 
 from django.conf import settings
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 
 from paperclip.models import FileType as BaseFileType, Attachment as BaseAttachment
 
 from geotrek.authent.models import StructureRelated
-from geotrek.common.mixins import PictogramMixin, OptionalPictogramMixin
+from geotrek.common.mixins import BasePublishableMixin, NoDeleteMixin, PictogramMixin, OptionalPictogramMixin
+from geotrek.common.utils import delete_documents
 
 
 class Organism(StructureRelated):
@@ -110,3 +113,44 @@ class TargetPortal(models.Model):
 
     def __unicode__(self):
         return self.name
+
+
+@receiver(post_save, dispatch_uid="delete_unpublished_documents")
+def delete_unpublished_documents(sender, instance, **kwargs):
+    """ Cached public documents of unpublished or deleted objects are never served again.
+    """
+    if not isinstance(instance, BasePublishableMixin):
+        return
+    if not instance.any_published or (isinstance(instance, NoDeleteMixin) and instance.deleted):
+        delete_documents(instance)
+
+
+@receiver(post_delete, dispatch_uid="delete_deleted_documents")
+def delete_deleted_documents(sender, instance, **kwargs):
+    if isinstance(instance, BasePublishableMixin):
+        delete_documents(instance)
+
+
+@receiver(post_save, sender=RecordSource, dispatch_uid="delete_documents_of_source")
+@receiver(post_delete, sender=RecordSource, dispatch_uid="delete_documents_of_deleted_source")
+@receiver(post_save, sender=TargetPortal, dispatch_uid="delete_documents_of_portal")
+@receiver(post_delete, sender=TargetPortal, dispatch_uid="delete_documents_of_deleted_portal")
+def delete_all_documents(sender, **kwargs):
+    """ Sources and portals have no modification date, thus changing one
+    makes all cached public documents stale.
+    """
+    delete_documents()
+
+
+def delete_all_documents_on_change(*models):
+    """ Delete all cached public documents when an object of one of models,
+    shown in documents but without modification date (e.g. themes, types
+    and their pictograms), is changed.
+    """
+    for model in models:
+        name = model._meta.model_name
+        post_save.connect(delete_all_documents, sender=model, dispatch_uid="delete_documents_of_%s" % name)
+        post_delete.connect(delete_all_documents, sender=model, dispatch_uid="delete_documents_of_deleted_%s" % name)
+
+
+delete_all_documents_on_change(Theme)
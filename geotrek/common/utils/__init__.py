@@ -1,5 +1,9 @@
 import logging
+import os
 import re
+import shutil
+from collections import defaultdict
+from datetime import datetime
 
 from django.db import connection
 from django.utils.timezone import utc
@@ -130,6 +134,67 @@ def intersecting(cls, obj, distance=None):
     return qs
 
 
+def intersecting_prefetch(cls, distance=None):
+    """
+    Build a property prefetch function (see ``add_property()``) returning,
+    for a list of objects, the ``cls`` instances intersecting each of them,
+    ordered as ``intersecting()`` does. One query per distinct distance.
+    """
+    def prefetch(objects):
+        result = dict((obj.pk, []) for obj in objects)
+        by_distance = defaultdict(list)
+        for obj in objects:
+            if obj.geom is not None:
+                by_distance[obj.distance(cls) if distance is None else distance].append(obj)
+        for obj_distance, group in by_distance.items():
+            for pk, instance in _intersecting_batch(cls, group, obj_distance):
+                result[pk].append(instance)
+        return result
+    return prefetch
+
+
+def _intersecting_batch(cls, objects, distance):
+    geom_field = objects[0]._meta.get_field('geom')
+    cls_geom_field = cls._meta.get_field('geom')
+    context = {
+        'table': geom_field.model._meta.db_table,
+        'pk': geom_field.model._meta.pk.column,
+        'geom': geom_field.column,
+        'cls_geom': '%s.%s' % (cls_geom_field.model._meta.db_table, cls_geom_field.column),
+        'cls_pk': '%s.%s' % (cls._meta.db_table, cls._meta.pk.column),
+    }
+    params = [[obj.pk for obj in objects]]
+    if distance:
+        condition = 'ST_DWithin(o.%(geom)s, %(cls_geom)s, %%s)' % context
+        params.append(distance)
+        position = '0'
+    else:
+        condition = 'ST_Intersects(o.%(geom)s, %(cls_geom)s)' % context
+        position = """CASE WHEN GeometryType(o.%(geom)s) = 'LINESTRING' THEN
+            coalesce((SELECT min(ST_Line_Locate_Point(o.%(geom)s, ST_StartPoint(d.geom)))
+                      FROM ST_Dump(ST_Intersection(o.%(geom)s, %(cls_geom)s)) d), 1)
+            ELSE 0 END""" % context
+    if geom_field.model._meta.concrete_model == cls_geom_field.model._meta.concrete_model:
+        # Prevent self intersection
+        condition += ' AND o.%(pk)s <> %(cls_pk)s' % context
+    objects_sql = 'FROM %(table)s o WHERE o.%(pk)s = ANY(%%s) AND ' % context + condition
+    intersected = "(SELECT string_agg(o.%s || ':' || %s, ',') %s)" % (context['pk'], position, objects_sql)
+
+    qs = cls.objects
+    if hasattr(qs, 'existing'):
+        qs = qs.existing()
+    qs = qs.extra(select={'intersected': intersected}, select_params=params,
+                  where=['EXISTS (SELECT 1 %s)' % objects_sql], params=params)
+    pairs = []
+    for instance in qs:
+        for item in instance.intersected.split(','):
+            pk, position = item.split(':')
+            pairs.append((float(position), int(pk), instance))
+    # Stable sort: keeps default ordering of ``cls`` between equal positions
+    pairs.sort(key=lambda pair: pair[0])
+    return [pair[1:] for pair in pairs]
+
+
 def plain_text_preserve_linebreaks(value):
     value = re.sub(ur'\s*<br\s*/?>\s*', u'##~~~~~~##', value)
     value = re.sub(ur'\s*<p>\s*', u'##~~~~~~####~~~~~~##', value)
@@ -139,3 +204,27 @@ def plain_text_preserve_linebreaks(value):
     value = re.sub(u'##~~~~~~##', u'\n', value)
     value = value.strip()
     return value
+
+
+def documents_root(obj=None):
+    """ Directory of cached public documents (see ``DocumentPublic``), of
+    all objects or of the given one.
+    """
+    root = os.path.join(settings.MEDIA_ROOT, 'documents')
+    if obj is None:
+        return root
+    return os.path.join(root, obj._meta.model_name, str(obj.pk))
+
+
+def delete_documents(obj=None):
+    """ Delete cached public documents of all objects or of the given one.
+    """
+    shutil.rmtree(documents_root(obj), ignore_errors=True)
+
+
+def file_date(path):
+    """ Modification date of file, or None if it does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    return datetime.utcfromtimestamp(os.path.getmtime(path)).replace(tzinfo=utc)
@@ -8,11 +8,11 @@ from django.db.utils import DatabaseError
 from django.http import HttpResponse
 from django.utils.translation import ugettext as _
 
-from mapentity.helpers import api_bbox
+from mapentity.helpers import api_bbox, is_file_newer
 from mapentity import views as mapentity_views
 
 from geotrek.celery_conf import app as celery_app
-from geotrek.common.utils import sql_extent
+from geotrek.common.utils import sql_extent, documents_root, file_date
 from geotrek import __version__
 
 from rest_framework import permissions as rest_permissions, viewsets
@@ -30,7 +30,7 @@ from .utils.import_celery import create_tmp_destination, discover_available_pars
 
 from .tasks import import_datas, import_datas_from_web
 from .forms import ImportDatasetForm, ImportDatasetFormWithFile
-from .models import Theme
+from .models import Theme, RecordSource, TargetPortal
 from .serializers import ThemeSerializer
 
 
@@ -64,6 +64,29 @@ class FormsetMixin(object):
         return context
 
 
+class PrefetchPropertiesMixin(object):
+    """
+    Compute exported properties for the whole list at once, instead of one
+    query per object and property (see ``AddPropertyMixin.add_property()``).
+    Only CSV and shapefile exports serialize these properties.
+    """
+    prefetch = False
+
+    def csv_view(self, request, context, **kwargs):
+        self.prefetch = True
+        return super(PrefetchPropertiesMixin, self).csv_view(request, context, **kwargs)
+
+    def shape_view(self, request, context, **kwargs):
+        self.prefetch = True
+        return super(PrefetchPropertiesMixin, self).shape_view(request, context, **kwargs)
+
+    def get_queryset(self):
+        queryset = super(PrefetchPropertiesMixin, self).get_queryset()
+        if self.prefetch:
+            return self.get_model().prefetch_properties(queryset, *self.columns)
+        return queryset
+
+
 class PublicOrReadPermMixin(object):
 
     def get_object(self, queryset=None):
@@ -83,12 +106,85 @@ class DocumentPublic(PublicOrReadPermMixin, mapentity_views.MapEntityDocumentWea
     def dispatch(self, *args, **kwargs):
         return super(mapentity_views.MapEntityDocumentBase, self).dispatch(*args, **kwargs)
 
+    def get(self, request, *args, **kwargs):
+        obj = self.get_object()
+        if self.is_document_cacheable() and self.is_document_up_to_date(obj):
+            with open(self.get_document_path(obj), 'rb') as f:
+                return HttpResponse(f.read(), content_type='application/pdf')
+        return super(DocumentPublic, self).get(request, *args, **kwargs)
+
     def get_context_data(self, **kwargs):
         context = super(DocumentPublic, self).get_context_data(**kwargs)
         modelname = self.get_model()._meta.object_name.lower()
         context['mapimage_ratio'] = settings.EXPORT_MAP_IMAGE_SIZE[modelname]
+        context.update(self.get_document_params())
         return context
 
+    def render_to_response(self, context, **response_kwargs):
+        response = super(DocumentPublic, self).render_to_response(context, **response_kwargs)
+        if not self.is_document_cacheable():
+            return response
+        # Keep rendered document in cache (see ``is_document_up_to_date()``)
+        response.render()
+        path = self.get_document_path(self.get_object())
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        tmp_path = path + '.tmp{pid}'.format(pid=os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(response.content)
+        os.rename(tmp_path, path)
+        return response
+
+    # Query parameters changing the content of documents, with the model of
+    # the object they name (added to context)
+    document_params = (('source', RecordSource), ('portal', TargetPortal))
+
+    def get_document_params(self):
+        """ Objects named by ``document_params`` in query, by parameter name.
+        Unknown names are ignored.
+        """
+        if not hasattr(self, '_document_params'):
+            self._document_params = {}
+            self._unknown_document_params = False
+            for name, model in self.document_params:
+                value = self.request.GET.get(name)
+                if not value:
+                    continue
+                try:
+                    self._document_params[name] = model.objects.get(name=value)
+                except model.DoesNotExist:
+                    self._unknown_document_params = True
+        return self._document_params
+
+    def is_document_cacheable(self):
+        """ Documents are not cached for unknown parameter values, which
+        would be rendered as if they were not given.
+        """
+        self.get_document_params()
+        return not self._unknown_document_params
+
+    def get_document_path(self, obj):
+        """ Cached document of object, per view, language, Geotrek version and
+        objects named by ``document_params``. Other query parameters are ignored.
+        """
+        basename = u'{view}-{lang}-{version}'.format(view=self.__class__.__name__.lower(),
+                                                     lang=self.request.LANGUAGE_CODE, version=__version__)
+        for name, value in sorted(self.get_document_params().items()):
+            basename += u'-{name}{pk}'.format(name=name, pk=value.pk)
+        return os.path.join(documents_root(obj), basename + '.pdf')
+
+    def get_document_date_update(self, obj):
+        """ Last modification of the object, or of the data shown in its document.
+        Information without modification date (e.g. record sources, portals,
+        themes...) deletes all cached documents when it is changed.
+        """
+        dates = [obj.date_update, file_date(obj.get_map_image_path())]
+        dates += obj.attachments.values_list('date_update', flat=True)
+        return max(date for date in dates if date is not None)
+
+    def is_document_up_to_date(self, obj):
+        return is_file_newer(self.get_document_path(obj), self.get_document_date_update(obj))
+
 #
 # Concrete views
 # ..............................
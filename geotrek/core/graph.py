@@ -1,4 +1,8 @@
+import heapq
 import math
+import struct
+import sys
+from array import array
 from collections import defaultdict
 
 
@@ -55,3 +59,447 @@ def graph_edges_nodes_of_qs(qs):
         'edges': dict(edges),
         'nodes': dict(nodes),
     }
+
+
+def path_extremities(qs):
+    """
+    Yield (id, start point, end point, length) of paths, fetching only
+    those columns (no model instances nor geometries).
+    """
+    geom = '{table}.geom'.format(table=qs.model._meta.db_table)
+    select = {
+        'start_x': 'ST_X(ST_StartPoint({geom}))'.format(geom=geom),
+        'start_y': 'ST_Y(ST_StartPoint({geom}))'.format(geom=geom),
+        'end_x': 'ST_X(ST_EndPoint({geom}))'.format(geom=geom),
+        'end_y': 'ST_Y(ST_EndPoint({geom}))'.format(geom=geom),
+    }
+    rows = qs.extra(select=select).values_list('pk', 'start_x', 'start_y', 'end_x', 'end_y', 'length')
+    for pk, start_x, start_y, end_x, end_y, length in rows.iterator():
+        yield pk, (start_x, start_y), (end_x, end_y), length
+
+
+class CompactGraph(object):
+    """
+    Graph of paths stored in flat arrays, as built by ``compact_graph_of_qs()``.
+
+    Nodes are numbered from 1 (like ``graph_edges_nodes_of_qs()``), edges
+    are indexed from 0 in ``edge_ids``, ``edge_lengths`` and ``edge_nodes``
+    (start and end nodes of edge ``i`` at ``2 * i`` and ``2 * i + 1``).
+    Removed edges are kept, with id 0.
+    Neighbours of node ``n`` are ``neighbours[offsets[n]:offsets[n + 1]]``,
+    reached through edges ``neighbour_edges[offsets[n]:offsets[n + 1]]``.
+    These adjacency arrays are built when needed, after edges changed.
+    """
+
+    def __init__(self, edge_ids, edge_lengths, edge_nodes, node_ids):
+        self.edge_ids = edge_ids
+        self.edge_lengths = edge_lengths
+        self.edge_nodes = edge_nodes
+        # Node of each (x, y) point
+        self.node_ids = node_ids
+        self._index = None
+
+    def __getstate__(self):
+        # Adjacency is not worth storing (e.g. in cache)
+        state = self.__dict__.copy()
+        state['_index'] = None
+        return state
+
+    @property
+    def nodes_count(self):
+        return len(self.node_ids)
+
+    def index(self):
+        """ Return adjacency arrays (offsets, neighbours, neighbour edges) """
+        if self._index is not None:
+            return self._index
+        nodes_count = self.nodes_count
+        edge_ids, edge_nodes = self.edge_ids, self.edge_nodes
+        # Count degrees, then fill neighbours in edges order
+        offsets = array('l', [0]) * (nodes_count + 2)
+        for i in xrange(len(edge_ids)):
+            if edge_ids[i]:
+                offsets[edge_nodes[2 * i] + 1] += 1
+                offsets[edge_nodes[2 * i + 1] + 1] += 1
+        for node in xrange(1, nodes_count + 2):
+            offsets[node] += offsets[node - 1]
+        neighbours = array('l', [0]) * offsets[nodes_count + 1]
+        neighbour_edges = array('l', [0]) * offsets[nodes_count + 1]
+        filled = array('l', offsets)
+        for i in xrange(len(edge_ids)):
+            if not edge_ids[i]:
+                continue
+            start, end = edge_nodes[2 * i], edge_nodes[2 * i + 1]
+            for node, neighbour in ((start, end), (end, start)):
+                neighbours[filled[node]] = neighbour
+                neighbour_edges[filled[node]] = i
+                filled[node] += 1
+        self._index = offsets, neighbours, neighbour_edges
+        return self._index
+
+    @property
+    def offsets(self):
+        return self.index()[0]
+
+    @property
+    def neighbours(self):
+        return self.index()[1]
+
+    @property
+    def neighbour_edges(self):
+        return self.index()[2]
+
+    def add_path(self, pk, start_point, end_point, length):
+        nodes = []
+        for point in (start_point, end_point):
+            node = self.node_ids.get(point)
+            if node is None:
+                node = self.node_ids[point] = len(self.node_ids) + 1
+            nodes.append(node)
+        self.edge_ids.append(pk)
+        self.edge_lengths.append(0.0 if length is None or math.isnan(length) else length)
+        self.edge_nodes.extend(nodes)
+        self._index = None
+        return nodes
+
+    def remove_path(self, pk):
+        try:
+            i = self.edge_ids.index(pk)
+        except ValueError:
+            return []
+        self.edge_ids[i] = 0
+        self._index = None
+        return [self.edge_nodes[2 * i], self.edge_nodes[2 * i + 1]]
+
+    def edge(self, i):
+        return {
+            'id': self.edge_ids[i],
+            'length': self.edge_lengths[i],
+            'nodes_id': [self.edge_nodes[2 * i], self.edge_nodes[2 * i + 1]],
+        }
+
+    def get_edge(self, pk):
+        """ Edge of path ``pk``, or None if there is none """
+        try:
+            return self.edge(self.edge_ids.index(pk))
+        except ValueError:
+            return None
+
+    def adjacency(self, node):
+        """ Neighbours of node, with the path linking them, or None if
+        it has no neighbour. When several paths link the same nodes,
+        the last one is kept.
+        """
+        offsets, neighbours, neighbour_edges = self.index()
+        if node > self.nodes_count:
+            return None
+        adjacency = {}
+        for j in xrange(offsets[node], offsets[node + 1]):
+            pk = self.edge_ids[neighbour_edges[j]]
+            adjacency[neighbours[j]] = max(pk, adjacency.get(neighbours[j], pk))
+        return adjacency or None
+
+    @property
+    def edges(self):
+        return dict((edge_id, self.edge(i)) for i, edge_id in enumerate(self.edge_ids) if edge_id)
+
+    @property
+    def nodes(self):
+        nodes = {}
+        for node in xrange(1, self.nodes_count + 1):
+            adjacency = self.adjacency(node)
+            if adjacency is not None:
+                nodes[node] = adjacency
+        return nodes
+
+    def as_dict(self):
+        """ Same structure as ``graph_edges_nodes_of_qs()`` """
+        return {
+            'edges': self.edges,
+            'nodes': self.nodes,
+        }
+
+
+def compact_arrays_of_qs(qs):
+    """
+    Return arrays of paths ids, lengths and nodes, and the nodes of points,
+    with same nodes numbering and edges as ``graph_edges_nodes_of_qs()``.
+    """
+    node_ids = {}
+    edge_ids = array('l')
+    edge_lengths = array('d')
+    edge_nodes = array('l')
+    for pk, start_point, end_point, length in path_extremities(qs):
+        for point in (start_point, end_point):
+            node = node_ids.get(point)
+            if node is None:
+                node = node_ids[point] = len(node_ids) + 1
+            edge_nodes.append(node)
+        edge_ids.append(pk)
+        edge_lengths.append(0.0 if length is None or math.isnan(length) else length)
+    return edge_ids, edge_lengths, edge_nodes, node_ids
+
+
+def compact_graph_of_qs(qs):
+    """
+    Build a ``CompactGraph`` of paths.
+    """
+    return CompactGraph(*compact_arrays_of_qs(qs))
+
+
+class IncrementalGraph(CompactGraph):
+    """
+    Compact paths graph, updated path by path when paths change.
+
+    ``version`` is ``"<base>-<sequence>"``: ``base`` identifies the full build
+    (nodes numbering), ``sequence`` counts paths changes applied since then.
+    Clients holding a version can be sent only the changes since then
+    (see ``changes_since()``).
+    """
+    history_size = 10000
+
+    def __init__(self, base, edge_ids=None, edge_lengths=None, edge_nodes=None, node_ids=None):
+        super(IncrementalGraph, self).__init__(edge_ids if edge_ids is not None else array('l'),
+                                               edge_lengths if edge_lengths is not None else array('d'),
+                                               edge_nodes if edge_nodes is not None else array('l'),
+                                               node_ids if node_ids is not None else {})
+        self.base = base
+        self.sequence = 0
+        # (sequence, path id, touched nodes) of latest changes
+        self.history = []
+
+    @classmethod
+    def from_qs(cls, qs, base):
+        return cls(base, *compact_arrays_of_qs(qs))
+
+    @property
+    def version(self):
+        return '{base}-{sequence}'.format(base=self.base, sequence=self.sequence)
+
+    def update_path(self, pk, extremities=None):
+        """
+        Apply a change of path ``pk``: ``extremities`` is its current
+        (start point, end point, length), or None if it was deleted.
+        """
+        nodes = set(self.remove_path(pk))
+        if extremities is not None:
+            nodes.update(self.add_path(pk, *extremities))
+        self.sequence += 1
+        self.history.append((self.sequence, pk, nodes))
+        del self.history[:-self.history_size]
+
+    def changes_since(self, version):
+        """
+        Return the changes since ``version``, with changed (or deleted,
+        set to None) edges and nodes. Return None if these changes are
+        not known (e.g. version of a previous full build).
+        """
+        try:
+            base, sequence = version.rsplit('-', 1)
+            sequence = int(sequence)
+        except ValueError:
+            return None
+        if base != self.base or sequence > self.sequence:
+            return None
+        first_known = self.history[0][0] if self.history else self.sequence + 1
+        if sequence + 1 < first_known:
+            return None
+        edges = {}
+        nodes = {}
+        for change, pk, touched in self.history:
+            if change <= sequence:
+                continue
+            edges[pk] = self.get_edge(pk)
+            for node in touched:
+                nodes[node] = self.adjacency(node)
+        return {
+            'version': self.version,
+            'since': version,
+            'edges': edges,
+            'nodes': nodes,
+        }
+
+    def as_dict(self):
+        graph = super(IncrementalGraph, self).as_dict()
+        graph['version'] = self.version
+        return graph
+
+
+def pack_graph(edges, version):
+    """
+    Pack graph edges (``edges`` of ``graph_edges_nodes_of_qs()``) into
+    little-endian typed arrays, decoded by ``Geotrek.GraphDecoder`` (``graph.js``):
+
+    * header: magic ``GTGR``, format (1), edges count and version length (uint32)
+    * edges ids (int32), sorted
+    * edges start and end nodes (int32 pairs)
+    * edges lengths (float32)
+    * version (ascii)
+    """
+    edges = sorted(edges.values(), key=lambda edge: edge['id'])
+    ids = array('i', [edge['id'] for edge in edges])
+    nodes = array('i')
+    for edge in edges:
+        nodes.extend(edge['nodes_id'])
+    lengths = array('f', [edge['length'] for edge in edges])
+    if sys.byteorder != 'little':
+        for values in (ids, nodes, lengths):
+            values.byteswap()
+    version = version.encode('ascii')
+    header = struct.pack('<4sIII', b'GTGR', 1, len(edges), len(version))
+    return header + ids.tostring() + nodes.tostring() + lengths.tostring() + version
+
+
+class PathGraph(CompactGraph):
+    """
+    Compact graph of paths, for shortest path computation on server side.
+
+    Adds to ``CompactGraph`` the coordinates of nodes (``coords``) and the
+    edge of each path (see ``path_edge()``).
+    """
+
+    def __init__(self, edge_ids=None, edge_lengths=None, edge_nodes=None, node_ids=None):
+        super(PathGraph, self).__init__(edge_ids if edge_ids is not None else array('l'),
+                                        edge_lengths if edge_lengths is not None else array('d'),
+                                        edge_nodes if edge_nodes is not None else array('l'),
+                                        node_ids if node_ids is not None else {})
+
+    @classmethod
+    def from_qs(cls, qs):
+        return cls(*compact_arrays_of_qs(qs))
+
+    def __getstate__(self):
+        state = super(PathGraph, self).__getstate__()
+        state.pop('_edge_index', None)
+        state.pop('_coords', None)
+        return state
+
+    def index(self):
+        if self._index is None:
+            super(PathGraph, self).index()
+            self._edge_index = dict((pk, i) for i, pk in enumerate(self.edge_ids) if pk)
+            self._coords = [None] * (self.nodes_count + 1)
+            for point, node in self.node_ids.items():
+                self._coords[node] = point
+        return self._index
+
+    @property
+    def coords(self):
+        self.index()
+        return self._coords
+
+    def path_edge(self, pk):
+        """ Start node, end node and length of path ``pk``, or None if there is none """
+        self.index()
+        i = self._edge_index.get(pk)
+        if i is None:
+            return None
+        return self.edge_nodes[2 * i], self.edge_nodes[2 * i + 1], self.edge_lengths[i]
+
+    def distance(self, node_a, node_b):
+        coords = self.coords
+        (xa, ya), (xb, yb) = coords[node_a], coords[node_b]
+        return math.hypot(xb - xa, yb - ya)
+
+    def shortest_path(self, sources, targets):
+        """
+        A* search, with straight-line distance to the closest target as heuristic.
+
+        ``sources`` and ``targets`` map node ids to the cost of reaching them from
+        the start point, and of reaching the end point from them.
+        Return the tuple (cost, list of (node, path id) steps from a source
+        to a target), or None if targets cannot be reached.
+        """
+        goal = -1
+        offsets, neighbours, neighbour_edges = self.index()
+        edge_lengths = self.edge_lengths
+
+        def heuristic(node):
+            return min(self.distance(node, target) for target in targets)
+
+        costs = {}
+        previous = {}
+        queue = []
+        for node, cost in sources.items():
+            costs[node] = cost
+            previous[node] = None
+            heapq.heappush(queue, (cost + heuristic(node), cost, node))
+        visited = set()
+        while queue:
+            estimate, cost, node = heapq.heappop(queue)
+            if node == goal:
+                target = previous[goal]
+                steps = []
+                while previous[target] is not None:
+                    prev_node, pk = previous[target]
+                    steps.append((target, pk))
+                    target = prev_node
+                steps.append((target, None))
+                steps.reverse()
+                return cost, steps
+            if node in visited:
+                continue
+            visited.add(node)
+            if node in targets:
+                goal_cost = cost + targets[node]
+                if goal_cost < costs.get(goal, float('inf')):
+                    costs[goal] = goal_cost
+                    previous[goal] = node
+                    heapq.heappush(queue, (goal_cost, goal_cost, goal))
+            for j in xrange(offsets[node], offsets[node + 1]):
+                neighbour, edge = neighbours[j], neighbour_edges[j]
+                next_cost = cost + edge_lengths[edge]
+                if neighbour in visited or next_cost >= costs.get(neighbour, float('inf')):
+                    continue
+                costs[neighbour] = next_cost
+                previous[neighbour] = (node, self.edge_ids[edge])
+                heapq.heappush(queue, (next_cost + heuristic(neighbour), next_cost, neighbour))
+        return None
+
+    def route(self, steps):
+        """
+        Shortest way through ``steps``, a list of (path id, position) tuples.
+        Return the serialized topology (see ``TopologyHelper.deserialize()``),
+        or None if a step cannot be reached.
+        """
+        topology = []
+        for (from_pk, from_pos), (to_pk, to_pos) in zip(steps[:-1], steps[1:]):
+            sub_topology = self.route_between(from_pk, from_pos, to_pk, to_pos)
+            if sub_topology is None:
+                return None
+            topology.append(sub_topology)
+        return topology
+
+    def route_between(self, from_pk, from_pos, to_pk, to_pos):
+        from_start, from_end, from_length = self.path_edge(from_pk)
+        to_start, to_end, to_length = self.path_edge(to_pk)
+        sources = {}
+        for node, cost in ((from_start, from_pos * from_length), (from_end, (1 - from_pos) * from_length)):
+            sources[node] = min(cost, sources.get(node, cost))
+        targets = {}
+        for node, cost in ((to_start, to_pos * to_length), (to_end, (1 - to_pos) * to_length)):
+            targets[node] = min(cost, targets.get(node, cost))
+
+        found = self.shortest_path(sources, targets)
+        if from_pk == to_pk:
+            direct_cost = abs(to_pos - from_pos) * from_length
+            if found is None or direct_cost <= found[0]:
+                return {'offset': 0, 'positions': {0: [from_pos, to_pos]}, 'paths': [from_pk]}
+        if found is None:
+            return None
+
+        cost, steps = found
+        # Leave first path by its closest extremity (loops start and end on the same node)
+        first_node = steps[0][0]
+        leave_by_start = first_node == from_start and (first_node != from_end or from_pos <= 0.5)
+        paths = [from_pk]
+        positions = {0: [from_pos, 0.0 if leave_by_start else 1.0]}
+        for (prev_node, prev_pk), (node, pk) in zip(steps[:-1], steps[1:]):
+            start, end, length = self.path_edge(pk)
+            positions[len(paths)] = [0.0, 1.0] if prev_node == start else [1.0, 0.0]
+            paths.append(pk)
+        last_node = steps[-1][0]
+        enter_by_start = last_node == to_start and (last_node != to_end or to_pos <= 0.5)
+        positions[len(paths)] = [0.0 if enter_by_start else 1.0, to_pos]
+        paths.append(to_pk)
+        return {'offset': 0, 'positions': positions, 'paths': paths}
@@ -1,12 +1,13 @@
 import json
 import logging
+from collections import OrderedDict
 
 from django.conf import settings
 from django.db import connection
 from django.contrib.gis.geos import Point
 from django.db.models.query import QuerySet
 
-from geotrek.common.utils import sqlfunction, uniquify
+from geotrek.common.utils import sqlfunction
 
 
 logger = logging.getLogger(__name__)
@@ -92,6 +93,7 @@ class TopologyHelper(object):
         PathAggregation.objects.filter(topo_object=topology).delete()
 
         try:
+            aggregations = []
             counter = 0
             for j, subtopology in enumerate(objdict):
                 last_topo = j == len(objdict) - 1
@@ -103,8 +105,8 @@ class TopologyHelper(object):
                     # Javascript hash keys are parsed as a string
                     idx = str(i)
                     start_position, end_position = positions.get(idx, (0.0, 1.0))
-                    path = Path.objects.get(pk=path)
-                    topology.add_path(path, start=start_position, end=end_position, order=counter, reload=False)
+                    path = int(path)
+                    aggregations.append((path, start_position, end_position, counter))
                     if not last_topo and last_path:
                         counter += 1
                         # Intermediary marker.
@@ -126,11 +128,15 @@ class TopologyHelper(object):
                         elif len(paths) == 1:
                             pos = end_position
                         assert pos >= 0, "Invalid position (%s, %s)." % (start_position, end_position)
-                        topology.add_path(path, start=pos, end=pos, order=counter, reload=False)
+                        aggregations.append((path, pos, pos, counter))
                     counter += 1
-        except (AssertionError, ValueError, KeyError, Path.DoesNotExist) as e:
+            # Check all paths at once
+            pks = set(path for path, start, end, order in aggregations)
+            if Path.objects.filter(pk__in=pks).count() != len(pks):
+                raise Path.DoesNotExist("Path matching query does not exist.")
+        except (AssertionError, ValueError, KeyError, TypeError, Path.DoesNotExist) as e:
             raise ValueError("Invalid serialized topology : %s" % e)
-        topology.save()
+        topology.add_paths(aggregations)
         return topology
 
     @classmethod
@@ -202,58 +208,68 @@ class TopologyHelper(object):
 
     @classmethod
     def overlapping(cls, klass, queryset):
-        from .models import Path, Topology, PathAggregation
+        """
+        Return a queryset of ``klass`` topologies overlapping a topology, a
+        list of topologies or a queryset of topologies, fetched in one query.
+        They are sorted by their first position along the given topologies.
+        """
+        from .models import Topology, PathAggregation
 
         all_objects = klass.objects.existing()
-        is_generic = klass.KIND == Topology.KIND
-        single_input = isinstance(queryset, QuerySet)
+        batched = isinstance(queryset, (list, tuple))
 
-        if single_input:
-            topology_pks = [str(pk) for pk in queryset.values_list('pk', flat=True)]
+        if isinstance(queryset, QuerySet):
+            sql, params = queryset.order_by().values('pk').query.sql_with_params()
+            topologies = sql, list(params)
         else:
-            topology_pks = [str(queryset.pk)]
-
-        if len(topology_pks) == 0:
-            return all_objects.filter(pk__in=[])
-
-        sql = """
-        WITH topologies AS (SELECT id FROM %(topology_table)s WHERE id IN (%(topology_list)s)),
-        -- Concerned aggregations
-             aggregations AS (SELECT * FROM %(aggregations_table)s a, topologies t
-                              WHERE a.evenement = t.id),
-        -- Concerned paths along with (start, end)
-             paths_aggr AS (SELECT a.pk_debut AS start, a.pk_fin AS end, p.id, a.ordre AS order
-                            FROM %(paths_table)s p, aggregations a
-                            WHERE a.troncon = p.id
-                            ORDER BY a.ordre)
-        -- Retrieve primary keys
-        SELECT t.id
-        FROM %(topology_table)s t, %(aggregations_table)s a, paths_aggr pa
-        WHERE a.troncon = pa.id AND a.evenement = t.id
-          AND least(a.pk_debut, a.pk_fin) <= greatest(pa.start, pa.end)
-          AND greatest(a.pk_debut, a.pk_fin) >= least(pa.start, pa.end)
-          AND %(extra_condition)s
-        ORDER BY (pa.order + CASE WHEN pa.start > pa.end THEN (1 - a.pk_debut) ELSE a.pk_debut END);
+            if isinstance(queryset, Topology):
+                queryset = [queryset]
+            pks = [getattr(topology, 'pk', topology) for topology in queryset]
+            if len(pks) == 0:
+                return all_objects.filter(pk__in=[])
+            topologies = 'SELECT unnest(%s::integer[])', [pks]
+
+        # Aggregations of topologies (a) overlapping aggregations of given topologies (pa)
+        overlaps = """
+            FROM %(aggregations_table)s a, %(aggregations_table)s pa
+            WHERE a.troncon = pa.troncon AND pa.evenement IN (%(topologies)s)
+              AND least(a.pk_debut, a.pk_fin) <= greatest(pa.pk_debut, pa.pk_fin)
+              AND greatest(a.pk_debut, a.pk_fin) >= least(pa.pk_debut, pa.pk_fin)
         """ % {
-            'topology_table': Topology._meta.db_table,
             'aggregations_table': PathAggregation._meta.db_table,
-            'paths_table': Path._meta.db_table,
-            'topology_list': ','.join(topology_pks),
-            'extra_condition': 'true' if is_generic else "kind = '%s'" % klass.KIND
+            'topologies': topologies[0],
         }
+        where = '%s.id IN (SELECT a.evenement %s)' % (Topology._meta.db_table, overlaps)
+        position = 'pa.ordre + CASE WHEN pa.pk_debut > pa.pk_fin THEN 1 - a.pk_debut ELSE a.pk_debut END'
+        ordering = '(SELECT min(%s) %s AND a.evenement = %s.id)' % (position, overlaps, Topology._meta.db_table)
+        select = OrderedDict([('ordering', ordering)])
+        select_params = list(topologies[1])
+        if batched:
+            # Position along each of the given topologies, as "pk:position,...",
+            # used by group_overlapping() to dispatch results.
+            select['overlapped'] = """(SELECT string_agg(t.evenement || ':' || t.position, ',')
+                                       FROM (SELECT pa.evenement, min(%s) AS position
+                                             %s AND a.evenement = %s.id
+                                             GROUP BY pa.evenement) t)""" % (position, overlaps, Topology._meta.db_table)
+            select_params += topologies[1]
+        return all_objects.extra(select=select, select_params=select_params,
+                                 where=[where], params=topologies[1], order_by=('ordering', 'pk'))
 
-        cursor = connection.cursor()
-        cursor.execute(sql)
-        result = cursor.fetchall()
-        pk_list = uniquify([row[0] for row in result])
-
-        # Return a QuerySet and preserve pk list order
-        # http://stackoverflow.com/a/1310188/141895
-        ordering = 'CASE %s END' % ' '.join(['WHEN %s.id=%s THEN %s' % (Topology._meta.db_table, id_, i)
-                                             for i, id_ in enumerate(pk_list)])
-        queryset = all_objects.filter(pk__in=pk_list).extra(
-            select={'ordering': ordering}, order_by=('ordering',))
-        return queryset
+    @classmethod
+    def group_overlapping(cls, overlapping, topologies):
+        """
+        Dispatch ``overlapping``, the result of ``overlapping()`` called with
+        the list ``topologies``, into a dict of lists indexed by topology pk.
+        Lists are ordered as if ``overlapping()`` was called for each topology.
+        """
+        result = dict((topology.pk, []) for topology in topologies)
+        for obj in overlapping:
+            for item in (obj.overlapped or '').split(','):
+                pk, position = item.split(':')
+                result[int(pk)].append((float(position), obj.pk, obj))
+        for pk, objects in result.items():
+            result[pk] = [item[2] for item in sorted(objects)]
+        return result
 
 
 class PathHelper(object):
@@ -0,0 +1,335 @@
+import binascii
+import csv
+import os.path
+import tempfile
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from geotrek.authent.models import default_structure
+from geotrek.core.models import Path, Topology
+
+
+# (land layer table, id column, edges table, edges foreign key, topology kind)
+LAND_LAYERS = (
+    ('l_commune', 'insee', 'f_t_commune', 'commune', 'CITYEDGE'),
+    ('l_secteur', 'id', 'f_t_secteur', 'secteur', 'DISTRICTEDGE'),
+    ('l_zonage_reglementaire', 'id', 'f_t_zonage', 'zone', 'RESTRICTEDAREAEDGE'),
+)
+
+
+class Command(BaseCommand):
+    args = '<path_layer>'
+    help = 'Load a layer with line geometries as paths, in bulk.\n'
+    help += 'Paths are snapped, split, draped and linked to land layers with '
+    help += 'set-based queries, instead of triggers for each path.\n'
+    can_import_settings = True
+
+    option_list = BaseCommand.option_list + (
+        make_option('--name-field',
+                    dest='name_field',
+                    default='name',
+                    help='Field of the layer containing paths names (default: name).'),
+        make_option('--srid',
+                    dest='srid',
+                    type='int',
+                    default=None,
+                    help='SRID of the layer, if not defined in file.'),
+        make_option('--dry-run',
+                    dest='dry_run',
+                    action='store_true',
+                    default=False,
+                    help='Validate, snap and split paths and report, but do not load anything.'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            from osgeo import ogr  # NOQA
+        except ImportError:
+            msg = 'GDAL Python bindings are not available. Can not proceed.'
+            raise CommandError(msg)
+
+        # Validate arguments
+        if len(args) != 1:
+            raise CommandError('Filename missing. See help')
+
+        filename = args[0]
+
+        if not os.path.exists(filename):
+            raise CommandError('File does not exists at: %s' % filename)
+
+        datasource = ogr.Open(filename)
+        if datasource is None:
+            raise CommandError('File format is not recognized by GDAL.')
+        layer = datasource.GetLayer()
+
+        self.verbosity = int(options['verbosity'])
+        srid = options['srid'] or self.layer_srid(layer)
+        if srid is None:
+            raise CommandError('Layer SRID is unknown, use --srid option.')
+
+        self.cursor = connection.cursor()
+        with tempfile.TemporaryFile() as rows:
+            count = self.write_rows(layer, options['name_field'], rows)
+            self.report('%s objects found' % count)
+            rows.seek(0)
+            with transaction.atomic():
+                with Topology.deferred_geometry():
+                    self.load(rows, srid, options['dry_run'])
+                if options['dry_run']:
+                    transaction.set_rollback(True)
+
+    def layer_srid(self, layer):
+        spatial_ref = layer.GetSpatialRef()
+        if spatial_ref is None:
+            return None
+        spatial_ref.AutoIdentifyEPSG()
+        code = spatial_ref.GetAuthorityCode(None)
+        return int(code) if code else None
+
+    def write_rows(self, layer, name_field, rows):
+        """
+        Write layer features as CSV (name, WKB geometry) for COPY.
+        """
+        writer = csv.writer(rows)
+        count = 0
+        for feature in layer:
+            geometry = feature.GetGeometryRef()
+            if geometry is None:
+                continue
+            index = feature.GetFieldIndex(name_field)
+            name = feature.GetFieldAsString(index) if index >= 0 else ''
+            writer.writerow([name, binascii.hexlify(geometry.ExportToWkb())])
+            count += 1
+        return count
+
+    def report(self, message, level=1):
+        if self.verbosity >= level:
+            self.stdout.write(message)
+
+    def step(self, label, sql, params=None):
+        """
+        Run a set-based step and report its duration and number of rows.
+        """
+        start = time.time()
+        self.cursor.execute(sql, params)
+        self.report('%s: %s rows (%.1fs)' % (label, self.cursor.rowcount, time.time() - start))
+        return self.cursor.rowcount
+
+    def load(self, rows, srid, dry_run):
+        params = {
+            'srid': srid,
+            'SRID': settings.SRID,
+            'distance': settings.PATH_SNAPPING_DISTANCE,
+            'step': settings.ALTIMETRIC_PROFILE_STEP,
+        }
+        self.copy(rows)
+        self.validate(params)
+        self.snap(params)
+        self.split(params)
+        if dry_run:
+            self.report('Dry run: nothing loaded')
+        else:
+            self.insert(params)
+            self.drape(params)
+            if 'geotrek.zoning' in settings.INSTALLED_APPS:
+                self.link_land_layers(params)
+            self.insert_crossing(params)
+        self.cursor.execute("DROP TABLE %s" % ', '.join(self.temporary_tables(dry_run)))
+
+    def temporary_tables(self, dry_run):
+        tables = ['tmp_troncon_import', 'tmp_troncon_staging', 'tmp_troncon_extremities',
+                  'tmp_troncon_snap', 'tmp_troncon_segments']
+        if not dry_run:
+            tables.append('tmp_troncon_loaded')
+        return tables
+
+    def copy(self, rows):
+        self.cursor.execute("""
+            CREATE TEMP TABLE tmp_troncon_import (id serial, nom text, geom geometry) ON COMMIT DROP
+        """)
+        start = time.time()
+        self.cursor.copy_expert("COPY tmp_troncon_import (nom, geom) FROM STDIN WITH CSV", rows)
+        self.report('Copy: %.1fs' % (time.time() - start))
+
+    def validate(self, params):
+        self.step('Prepare', """
+            CREATE TEMP TABLE tmp_troncon_staging ON COMMIT DROP AS
+            SELECT row_number() OVER () AS id, feature, nom, geom, NULL::text AS error
+            FROM (SELECT id AS feature, nom, (ST_Dump(ST_Transform(ST_SetSRID(ST_Force_2D(geom), %(srid)s), %(SRID)s))).geom AS geom
+                  FROM tmp_troncon_import) AS sub
+        """, params)
+        self.cursor.execute("CREATE INDEX tmp_troncon_staging_geom_idx ON tmp_troncon_staging USING gist(geom)")
+        self.cursor.execute("ANALYZE tmp_troncon_staging")
+        self.step('Validate geometries', """
+            UPDATE tmp_troncon_staging SET error = CASE
+                WHEN GeometryType(geom) != 'LINESTRING' THEN 'not a line'
+                WHEN NOT ST_IsValid(geom) THEN 'invalid'
+                WHEN NOT ST_IsSimple(geom) THEN 'not simple'
+                WHEN ST_Length(geom) = 0 THEN 'empty' END
+        """)
+        self.step('Validate overlaps', """
+            UPDATE tmp_troncon_staging s SET error = 'overlaps an existing path'
+            WHERE error IS NULL AND EXISTS (
+                SELECT * FROM l_t_troncon t
+                WHERE t.geom && s.geom
+                  AND GeometryType(ST_Intersection(t.geom, s.geom)) IN ('LINESTRING', 'MULTILINESTRING'))
+        """)
+
+    def report_errors(self):
+        self.cursor.execute("""
+            SELECT error, count(*), array_agg(DISTINCT feature) FROM tmp_troncon_staging
+            WHERE error IS NOT NULL GROUP BY error ORDER BY error
+        """)
+        for error, count, ids in self.cursor.fetchall():
+            self.report('%s lines skipped: %s' % (count, error))
+            self.report('    features: %s' % ', '.join(str(i) for i in sorted(ids)), level=2)
+
+    def snap(self, params):
+        """
+        Snap lines extremities to the closest line (existing path or loaded
+        line) closer than PATH_SNAPPING_DISTANCE, preferably on one of its
+        vertices, like troncons_snap_extremities() trigger does.
+        """
+        self.cursor.execute("""
+            CREATE TEMP TABLE tmp_troncon_extremities ON COMMIT DROP AS
+            SELECT id, 0 AS idx, ST_StartPoint(geom) AS point FROM tmp_troncon_staging WHERE error IS NULL
+            UNION ALL
+            SELECT id, ST_NPoints(geom) - 1, ST_EndPoint(geom) FROM tmp_troncon_staging WHERE error IS NULL
+        """)
+        self.cursor.execute("""
+            CREATE TEMP TABLE tmp_troncon_snap ON COMMIT DROP AS
+            SELECT DISTINCT ON (x.id, x.idx) x.id, x.idx, x.point, o.geom AS other,
+                   ST_ClosestPoint(o.geom, x.point) AS snapped
+            FROM tmp_troncon_extremities x,
+                 (SELECT id AS staging, geom FROM tmp_troncon_staging WHERE error IS NULL
+                  UNION ALL
+                  SELECT NULL, geom FROM l_t_troncon) AS o
+            WHERE ST_DWithin(o.geom, x.point, %(distance)s)
+              AND ST_Distance(o.geom, x.point) < %(distance)s
+              AND o.staging IS DISTINCT FROM x.id
+            ORDER BY x.id, x.idx, ST_Distance(o.geom, x.point)
+        """, params)
+        self.cursor.execute("""
+            UPDATE tmp_troncon_snap s SET snapped = v.vertex
+            FROM (SELECT DISTINCT ON (id, idx) id, idx, vertex
+                  FROM (SELECT id, idx, snapped, (ST_DumpPoints(other)).geom AS vertex FROM tmp_troncon_snap) AS sub
+                  WHERE ST_Distance(snapped, vertex) < %(distance)s
+                  ORDER BY id, idx, ST_Distance(snapped, vertex)) AS v
+            WHERE v.id = s.id AND v.idx = s.idx
+        """, params)
+        # A line may have both extremities snapped: one update for each
+        count = 0
+        for condition in ('x.idx = 0', 'x.idx > 0'):
+            self.cursor.execute("""
+                UPDATE tmp_troncon_staging s SET geom = ST_SetPoint(s.geom, x.idx, x.snapped)
+                FROM tmp_troncon_snap x
+                WHERE x.id = s.id AND NOT ST_Equals(x.point, x.snapped) AND %s
+            """ % condition)
+            count += self.cursor.rowcount
+        self.report('Snap: %s extremities' % count)
+        self.step('Validate snapped geometries', """
+            UPDATE tmp_troncon_staging SET error = 'invalid once snapped'
+            WHERE error IS NULL AND (NOT ST_IsSimple(geom) OR ST_Length(geom) = 0)
+        """)
+        self.report_errors()
+
+    def split(self, params):
+        """
+        Node loaded lines at their intersections, and find segments that cross
+        existing paths: they will be loaded through triggers, which split
+        existing paths and their topologies.
+        """
+        self.step('Split', """
+            CREATE TEMP TABLE tmp_troncon_segments ON COMMIT DROP AS
+            SELECT DISTINCT ON (n.id) n.id, s.nom, n.geom, false AS crossing
+            FROM (SELECT row_number() OVER () AS id, geom
+                  FROM (SELECT (ST_Dump(ST_Node(ST_Collect(geom)))).geom AS geom
+                        FROM tmp_troncon_staging WHERE error IS NULL) AS noded) AS n,
+                 tmp_troncon_staging s
+            WHERE s.error IS NULL
+              AND ST_DWithin(s.geom, ST_Line_Interpolate_Point(n.geom, 0.5), 0.001)
+            ORDER BY n.id, ST_Distance(s.geom, ST_Line_Interpolate_Point(n.geom, 0.5))
+        """)
+        # Touching existing paths only by extremities of both does not split them
+        self.step('Find segments crossing existing paths', """
+            UPDATE tmp_troncon_segments s SET crossing = true
+            WHERE EXISTS (
+                SELECT * FROM l_t_troncon t
+                WHERE ST_Intersects(t.geom, s.geom)
+                  AND NOT ST_Covers(ST_Intersection(ST_Collect(ST_StartPoint(t.geom), ST_EndPoint(t.geom)),
+                                                    ST_Collect(ST_StartPoint(s.geom), ST_EndPoint(s.geom))),
+                                    ST_Intersection(t.geom, s.geom)))
+        """)
+
+    def insert(self, params):
+        params['structure'] = default_structure().pk
+        params['valid'] = Path._meta.get_field('valid').default
+        self.cursor.execute("SELECT set_config('geotrek.bulk_paths', 'on', true)")
+        self.cursor.execute("CREATE TEMP TABLE tmp_troncon_loaded (id integer) ON COMMIT DROP")
+        self.step('Insert paths', """
+            WITH loaded AS (
+                INSERT INTO l_t_troncon (structure, valide, nom, geom)
+                SELECT %(structure)s, %(valid)s, left(nom, 20), geom
+                FROM tmp_troncon_segments WHERE NOT crossing ORDER BY id
+                RETURNING id
+            )
+            INSERT INTO tmp_troncon_loaded SELECT id FROM loaded
+        """, params)
+        self.cursor.execute("SELECT set_config('geotrek.bulk_paths', 'off', true)")
+
+    def drape(self, params):
+        # OFFSET 0 prevents ft_elevation_infos() from being called for each column
+        self.step('Drape paths', """
+            UPDATE l_t_troncon t SET geom_3d = (e.infos).draped,
+                                     longueur = ST_3DLength((e.infos).draped),
+                                     pente = (e.infos).slope,
+                                     altitude_minimum = (e.infos).min_elevation,
+                                     altitude_maximum = (e.infos).max_elevation,
+                                     denivelee_positive = (e.infos).positive_gain,
+                                     denivelee_negative = (e.infos).negative_gain
+            FROM (SELECT id, ft_elevation_infos(geom, %(step)s) AS infos
+                  FROM l_t_troncon WHERE id IN (SELECT id FROM tmp_troncon_loaded)
+                  OFFSET 0) AS e
+            WHERE e.id = t.id
+        """, params)
+
+    def link_land_layers(self, params):
+        """
+        Create city, district and restricted area edges of loaded paths, like
+        lien_auto_troncon_couches_sig_iu() trigger does. Their geometries are
+        computed once at commit (deferred mode).
+        """
+        for table, id_column, edges_table, edges_column, kind in LAND_LAYERS:
+            self.cursor.execute("""
+                CREATE TEMP TABLE tmp_troncon_edges ON COMMIT DROP AS
+                SELECT nextval(pg_get_serial_sequence('e_t_evenement', 'id')) AS evenement, id, zone, geom,
+                       ST_Line_Locate_Point(tgeom, COALESCE(ST_StartPoint(geom), geom)) AS pk_a,
+                       ST_Line_Locate_Point(tgeom, COALESCE(ST_EndPoint(geom), geom)) AS pk_b
+                FROM (SELECT t.id, t.geom AS tgeom, z.{id_column} AS zone,
+                             (ST_Dump(ST_Multi(ST_Intersection(z.geom, t.geom)))).geom AS geom
+                      FROM l_t_troncon t, {table} z
+                      WHERE t.id IN (SELECT id FROM tmp_troncon_loaded) AND ST_Intersects(z.geom, t.geom)) AS sub
+            """.format(table=table, id_column=id_column))
+            self.cursor.execute("""
+                INSERT INTO e_t_evenement (id, date_insert, date_update, kind, decallage, longueur, geom, supprime)
+                SELECT evenement, now(), now(), %s, 0, 0, geom, FALSE FROM tmp_troncon_edges
+            """, [kind])
+            self.cursor.execute("""
+                INSERT INTO e_r_evenement_troncon (troncon, evenement, pk_debut, pk_fin)
+                SELECT id, evenement, least(pk_a, pk_b), greatest(pk_a, pk_b) FROM tmp_troncon_edges
+            """)
+            self.step('Link to %s' % table, """
+                INSERT INTO {edges_table} (evenement, {edges_column}) SELECT evenement, zone FROM tmp_troncon_edges
+            """.format(edges_table=edges_table, edges_column=edges_column))
+            self.cursor.execute("DROP TABLE tmp_troncon_edges")
+
+    def insert_crossing(self, params):
+        self.step('Insert paths crossing existing paths', """
+            INSERT INTO l_t_troncon (structure, valide, nom, geom)
+            SELECT %(structure)s, %(valid)s, left(nom, 20), geom
+            FROM tmp_troncon_segments WHERE crossing ORDER BY id
+        """, params)
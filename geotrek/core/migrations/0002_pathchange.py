@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PathChange',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('path', models.IntegerField(verbose_name='Path', db_column=b'troncon')),
+                ('operation', models.CharField(max_length=1, verbose_name='Operation', choices=[(b'I', 'Insert'), (b'U', 'Update'), (b'D', 'Delete')])),
+                ('date', models.DateTimeField(auto_now_add=True, verbose_name='Date', db_column=b'date')),
+            ],
+            options={
+                'ordering': ['id'],
+                'db_table': 'l_t_troncon_journal',
+                'verbose_name': 'Path change',
+                'verbose_name_plural': 'Path changes',
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_pathchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyTopology',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('topology', models.IntegerField(verbose_name='Topology', db_column=b'evenement', db_index=True)),
+                ('asynchronous', models.BooleanField(default=False, verbose_name='Asynchronous', db_column=b'asynchrone')),
+                ('date', models.DateTimeField(auto_now_add=True, verbose_name='Date', db_column=b'date')),
+            ],
+            options={
+                'ordering': ['id'],
+                'db_table': 'e_t_evenement_recalcul',
+                'verbose_name': 'Dirty topology',
+                'verbose_name_plural': 'Dirty topologies',
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_dirtytopology'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pathchange',
+            name='transaction',
+            field=models.BigIntegerField(null=True, editable=False, db_column=b'txid', db_index=True, verbose_name='Transaction'),
+        ),
+    ]
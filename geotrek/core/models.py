@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import logging
 import functools
+from contextlib import contextmanager
 
 from django.contrib.gis.db import models
 from django.conf import settings
@@ -17,7 +18,8 @@ from geotrek.common.utils.postgresql import debug_pg_notices
 from geotrek.altimetry.models import AltimetryMixin
 
 from .helpers import PathHelper, TopologyHelper
-from django.db import connections, DEFAULT_DB_ALIAS
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models.sql import UpdateQuery
 
 
 logger = logging.getLogger(__name__)
@@ -120,6 +122,23 @@ class Path(AddPropertyMixin, MapEntityMixin, AltimetryMixin,
             point = point.transform(settings.SRID, clone=True)
         return cls.objects.all().exclude(visible=False).distance(point).order_by('distance')[0]
 
+    @staticmethod
+    def topologies_prefetch(klass, *related):
+        """ Build a property prefetch function (see ``add_property()``) returning
+        ``klass`` topologies on each path of a list, ordered by pk.
+        """
+        def prefetch(paths):
+            pairs = PathAggregation.objects.filter(path__in=paths, topo_object__in=klass.objects.existing())\
+                                           .order_by('path', 'topo_object').distinct()\
+                                           .values_list('path', 'topo_object')
+            pairs = list(pairs)
+            objects = klass.objects.select_related(*related).in_bulk(set(pk for path, pk in pairs))
+            result = dict((path.pk, []) for path in paths)
+            for path, pk in pairs:
+                result[path].append(objects[pk])
+            return result
+        return prefetch
+
     def is_overlap(self):
         return not PathHelper.disjoint(self.geom, self.pk)
 
@@ -157,14 +176,16 @@ class Path(AddPropertyMixin, MapEntityMixin, AltimetryMixin,
 
     @debug_pg_notices
     def save(self, *args, **kwargs):
-        # If the path was reversed, we have to invert related topologies
-        if self.is_reversed:
-            for aggr in self.aggregations.all():
-                aggr.start_position = 1 - aggr.start_position
-                aggr.end_position = 1 - aggr.end_position
-                aggr.save()
-            self._is_reversed = False
-        super(Path, self).save(*args, **kwargs)
+        # Topologies of a path (and of paths split by it) are computed once
+        with Topology.deferred_geometry(immediate=True):
+            # If the path was reversed, we have to invert related topologies
+            if self.is_reversed:
+                for aggr in self.aggregations.all():
+                    aggr.start_position = 1 - aggr.start_position
+                    aggr.end_position = 1 - aggr.end_position
+                    aggr.save()
+                self._is_reversed = False
+            super(Path, self).save(*args, **kwargs)
         self.reload()
 
     @property
@@ -229,11 +250,12 @@ class Path(AddPropertyMixin, MapEntityMixin, AltimetryMixin,
         """
         if (self.pk and path_to_merge) and (self.pk != path_to_merge.pk):
             conn = connections[DEFAULT_DB_ALIAS]
-            cursor = conn.cursor()
-            sql = "SELECT ft_merge_path({}, {});".format(self.pk, path_to_merge.pk)
-            cursor.execute(sql)
+            with Topology.deferred_geometry(immediate=True):
+                cursor = conn.cursor()
+                sql = "SELECT ft_merge_path({}, {});".format(self.pk, path_to_merge.pk)
+                cursor.execute(sql)
 
-            result = cursor.fetchall()[0][0]
+                result = cursor.fetchall()[0][0]
 
             if result:
                 # reload object after unification
@@ -261,6 +283,9 @@ class Topology(AddPropertyMixin, AltimetryMixin, TimeStampedModelMixin, NoDelete
     """ Fake srid attribute, that prevents transform() calls when using Django map widgets. """
     srid = settings.API_SRID
 
+    # Columns possibly modified by triggers, read back after each save
+    COMPUTED_FIELDS = ['geom', 'offset', 'deleted', 'date_insert', 'date_update'] + AltimetryMixin.COLUMNS + ['geom_3d']
+
     class Meta:
         db_table = 'e_t_evenement'
         verbose_name = _(u"Topology")
@@ -270,6 +295,17 @@ class Topology(AddPropertyMixin, AltimetryMixin, TimeStampedModelMixin, NoDelete
         super(Topology, self).__init__(*args, **kwargs)
         if not self.pk:
             self.kind = self.__class__.KIND
+        self._update_excluded = None
+        self._loaded()
+
+    def _loaded(self):
+        """ Remember values of geom and offset as found in database, to know
+        whether they were changed from Django. Geometry is compared by identity,
+        since it is only assigned, never modified in place by Geotrek.
+        Deferred fields are not fetched.
+        """
+        self._loaded_geom = self.__dict__.get('geom')
+        self._loaded_offset = self.__dict__.get('offset')
 
     @property
     def length_2d(self):
@@ -319,12 +355,86 @@ class Topology(AddPropertyMixin, AltimetryMixin, TimeStampedModelMixin, NoDelete
             self.reload()
         return aggr
 
+    def add_paths(self, aggregations, reload=True):
+        """
+        Bulk version of ``add_path()``, for a list of (path id, start, end, order).
+        Aggregations are inserted in one statement, and the topology geometry
+        is not computed for each of them, but once afterwards (or at commit
+        in deferred mode, see ``deferred_geometry()``).
+        """
+        if not aggregations:
+            return
+        values = ", ".join(["(%s, %s, %s, %s, %s)"] * len(aggregations))
+        sql = "INSERT INTO e_r_evenement_troncon (evenement, troncon, pk_debut, pk_fin, ordre) VALUES %s" % values
+        params = []
+        for path, start, end, order in aggregations:
+            params.extend([self.pk, path, start, end, order])
+        with transaction.atomic():
+            cursor = connections[DEFAULT_DB_ALIAS].cursor()
+            cursor.execute("SET LOCAL geotrek.bulk_aggregations = 'on'")
+            cursor.execute(sql, params)
+            cursor.execute("SET LOCAL geotrek.bulk_aggregations = 'off'")
+            cursor.execute("SELECT update_geometry_of_evenement(%s) WHERE NOT defer_geometry_of_evenements(ARRAY[%s])",
+                           [self.pk, self.pk])
+        if reload:
+            self.reload()
+
+    @classmethod
+    @contextmanager
+    def deferred_geometry(cls, asynchronous=False, immediate=False):
+        """
+        Within this block, paths and aggregations changes mark the related
+        topologies as dirty instead of computing their geometry for each
+        trigger firing. Each dirty topology is then computed once, at
+        transaction commit (at the end of the block if ``immediate``), or
+        later by ``update_dirty_geometries()`` if ``asynchronous``. In that
+        case, the Celery job is triggered once the block is committed; when
+        nested in another transaction, the caller has to trigger it after
+        commit (see ``geotrek.core.tasks``).
+        When nested in another ``deferred_geometry()`` block, the outer one
+        decides when topologies are computed.
+        """
+        connection = connections[DEFAULT_DB_ALIAS]
+        with transaction.atomic():
+            cursor = connection.cursor()
+            cursor.execute("SELECT ft_setting('geotrek.deferred_geometry')")
+            if cursor.fetchone()[0] is not None:
+                yield
+                return
+            cursor.execute("SELECT set_config('geotrek.deferred_geometry', %s, true)",
+                           ['queue' if asynchronous else 'commit'])
+            yield
+            cursor.execute("SELECT set_config('geotrek.deferred_geometry', '', true)")
+            if immediate and not asynchronous:
+                cursor.execute("SET CONSTRAINTS e_t_evenement_recalcul_i_tgr IMMEDIATE")
+                cursor.execute("SET CONSTRAINTS e_t_evenement_recalcul_i_tgr DEFERRED")
+        if asynchronous and not connection.in_atomic_block:
+            from geotrek.core.tasks import update_dirty_topologies
+            update_dirty_topologies.delay()
+
+    @classmethod
+    def update_dirty_geometries(cls):
+        """
+        Compute geometry of topologies marked as dirty in asynchronous
+        deferred mode. Returns the number of topologies updated.
+        """
+        cursor = connections[DEFAULT_DB_ALIAS].cursor()
+        cursor.execute("SELECT update_geometry_of_dirty_evenements()")
+        return cursor.fetchone()[0]
+
     @classmethod
     def overlapping(cls, topologies):
         """ Return a Topology queryset overlapping specified topologies.
         """
         return TopologyHelper.overlapping(cls, topologies)
 
+    @staticmethod
+    def overlapping_prefetch(func):
+        """ Build a property prefetch function (see ``add_property()``) from
+        ``func``, which returns objects overlapping a list of topologies.
+        """
+        return lambda topologies: TopologyHelper.group_overlapping(func(topologies), topologies)
+
     def mutate(self, other, delete=True):
         """
         Take alls attributes of the other topology specified and
@@ -357,8 +467,8 @@ class Topology(AddPropertyMixin, AltimetryMixin, TimeStampedModelMixin, NoDelete
         Reload into instance all computed attributes in triggers.
         """
         if self.pk:
-            # Update computed values
-            fromdb = self.__class__.objects.get(pk=self.pk)
+            # Update computed values, only reading them from topologies table
+            fromdb = Topology.objects.only(*self.COMPUTED_FIELDS).get(pk=self.pk)
             self.geom = fromdb.geom
             # /!\ offset may be set by a trigger OR in
             # the django code, reload() will override
@@ -367,15 +477,29 @@ class Topology(AddPropertyMixin, AltimetryMixin, TimeStampedModelMixin, NoDelete
             AltimetryMixin.reload(self, fromdb)
             TimeStampedModelMixin.reload(self, fromdb)
             NoDeleteMixin.reload(self, fromdb)
+            self._loaded()
 
         return self
 
     @debug_pg_notices
     def save(self, *args, **kwargs):
-        # HACK: these fields are readonly from the Django point of view
-        # but they can be changed at DB level. Since Django write all fields
-        # to DB anyway, it is important to update it before writting
-        if self.pk and settings.TREKKING_TOPOLOGY_ENABLED:
+        if not (self.pk and settings.TREKKING_TOPOLOGY_ENABLED):
+            if not self.deleted and self.geom is None:
+                # We cannot have NULL geometry. So we use an empty one,
+                # it will be computed or overwritten by triggers.
+                self.geom = fromstr('POINT (0 0)')
+
+        geom_changed = self.geom is not self._loaded_geom
+        if self.pk and not (geom_changed and settings.TREKKING_TOPOLOGY_ENABLED):
+            # Computed values were not changed from Django: do not write them,
+            # and read them back along the update (see ``_do_update()``)
+            self._update_excluded = set(AltimetryMixin.COLUMNS + ['geom_3d'])
+            if not geom_changed:
+                self._update_excluded.add('geom')
+        elif self.pk:
+            # HACK: these fields are readonly from the Django point of view
+            # but they can be changed at DB level. Since Django write all fields
+            # to DB anyway, it is important to update it before writting
             existing = self.__class__.objects.get(pk=self.pk)
             self.length = existing.length
             # In the case of points, the geom can be set by Django. Don't override.
@@ -383,11 +507,6 @@ class Topology(AddPropertyMixin, AltimetryMixin, TimeStampedModelMixin, NoDelete
             geom_already_in_db = not self.ispoint() and existing.geom is not None
             if (point_geom_not_set or geom_already_in_db):
                 self.geom = existing.geom
-        else:
-            if not self.deleted and self.geom is None:
-                # We cannot have NULL geometry. So we use an empty one,
-                # it will be computed or overwritten by triggers.
-                self.geom = fromstr('POINT (0 0)')
 
         if not self.kind:
             if self.KIND == "TOPOLOGYMIXIN":
@@ -398,9 +517,60 @@ class Topology(AddPropertyMixin, AltimetryMixin, TimeStampedModelMixin, NoDelete
         shortmodelname = self._meta.object_name.lower().replace('edge', '')
         self.offset = settings.TOPOLOGY_STATIC_OFFSETS.get(shortmodelname, self.offset)
 
+        # Writing offset fires the trigger computing geometry, after update
+        update_fields = kwargs.get('update_fields')
+        offset_written = self._update_excluded is None or self.offset != self._loaded_offset or \
+            (update_fields is not None and 'offset' in update_fields)
+        if not offset_written:
+            self._update_excluded.add('offset')
+
         # Save into db
-        super(Topology, self).save(*args, **kwargs)
-        self.reload()
+        try:
+            super(Topology, self).save(*args, **kwargs)
+        finally:
+            self._update_excluded = None
+        if offset_written:
+            self.reload()
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        """
+        Update topologies table with a single ``UPDATE ... RETURNING`` query,
+        which leaves computed columns untouched and returns their values.
+
+        ``Model._do_update()`` is private Django API: this override relies on
+        its Django 1.8 signature, on ``values`` being ``(field, model, value)``
+        triples, and on being called by ``_save_table()`` for each table of
+        the inheritance chain. Check it when upgrading Django; ``TopologySaveTest``
+        fails if the override is no longer used.
+        """
+        if base_qs.model is not Topology or self._update_excluded is None:
+            return super(Topology, self)._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        excluded = self._update_excluded - set(update_fields or [])
+        values = [value for value in values if value[0].name not in excluded]
+        if not values and update_fields is not None:
+            return True
+        fields = [Topology._meta.get_field(name) for name in self.COMPUTED_FIELDS]
+        returning = ', '.join(field.column for field in fields)
+        connection = connections[using]
+        if values:
+            query = base_qs.filter(pk=pk_val).query.clone(UpdateQuery)
+            query.add_update_fields(values)
+            sql, params = query.get_compiler(using).as_sql()
+            sql = '%s RETURNING %s' % (sql, returning)
+        else:
+            sql = 'SELECT %s FROM %s WHERE id = %%s' % (returning, Topology._meta.db_table)
+            params = [pk_val]
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+        if row is None:
+            return False
+        for field, value in zip(fields, row):
+            if hasattr(field, 'from_db_value'):
+                value = field.from_db_value(value, None, connection, None)
+            setattr(self, field.attname, value)
+        self._loaded()
+        return True
 
     def serialize(self, **kwargs):
         return TopologyHelper.serialize(self, **kwargs)
@@ -467,6 +637,50 @@ class PathAggregation(models.Model):
         ordering = ['order', ]
 
 
+class PathChange(models.Model):
+    """
+    Journal of paths inserts, updates and deletes, written by trigger (see
+    ``40_troncons.sql``). Used to update the cached paths graph incrementally.
+    """
+    INSERT = 'I'
+    UPDATE = 'U'
+    DELETE = 'D'
+    OPERATION_CHOICES = (
+        (INSERT, _(u"Insert")),
+        (UPDATE, _(u"Update")),
+        (DELETE, _(u"Delete")),
+    )
+    # Not a foreign key: deleted paths are journaled too
+    path = models.IntegerField(db_column='troncon', verbose_name=_(u"Path"))
+    operation = models.CharField(max_length=1, choices=OPERATION_CHOICES, verbose_name=_(u"Operation"))
+    date = models.DateTimeField(auto_now_add=True, db_column='date', verbose_name=_(u"Date"))
+    transaction = models.BigIntegerField(null=True, editable=False, db_column='txid', db_index=True,
+                                         verbose_name=_(u"Transaction"))
+
+    class Meta:
+        db_table = 'l_t_troncon_journal'
+        verbose_name = _(u"Path change")
+        verbose_name_plural = _(u"Path changes")
+        ordering = ['id']
+
+
+class DirtyTopology(models.Model):
+    """
+    Queue of topologies whose geometry has to be computed, written by triggers
+    in deferred mode (see ``Topology.deferred_geometry()``).
+    """
+    # Not a foreign key: topologies may be deleted meanwhile
+    topology = models.IntegerField(db_column='evenement', db_index=True, verbose_name=_(u"Topology"))
+    asynchronous = models.BooleanField(default=False, db_column='asynchrone', verbose_name=_(u"Asynchronous"))
+    date = models.DateTimeField(auto_now_add=True, db_column='date', verbose_name=_(u"Date"))
+
+    class Meta:
+        db_table = 'e_t_evenement_recalcul'
+        verbose_name = _(u"Dirty topology")
+        verbose_name_plural = _(u"Dirty topologies")
+        ordering = ['id']
+
+
 class PathSource(StructureRelated):
 
     source = models.CharField(verbose_name=_(u"Source"), max_length=50)
@@ -579,4 +793,5 @@ class Trail(MapEntityMixin, Topology, StructureRelated):
 
 
 Path.add_property('trails', lambda self: Trail.path_trails(self), _(u"Trails"))
-Topology.add_property('trails', lambda self: Trail.overlapping(self), _(u"Trails"))
+Topology.add_property('trails', lambda self: Trail.overlapping(self), _(u"Trails"),
+                      prefetch=Topology.overlapping_prefetch(Trail.overlapping))
@@ -131,3 +131,30 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+
+
+-------------------------------------------------------------------------------
+-- Read a session setting (e.g. SET LOCAL geotrek.bulk_aggregations = 'on'),
+-- NULL (or false for boolean ones) if not set in this transaction
+-------------------------------------------------------------------------------
+
+-- current_setting() raises when the setting was never set in the session,
+-- unless missing_ok is given (PostgreSQL >= 9.6). Older servers read
+-- pg_settings instead, which lists custom settings once they are set.
+DO LANGUAGE plpgsql $$
+BEGIN
+    IF current_setting('server_version_num')::integer >= 90600 THEN
+        EXECUTE 'CREATE OR REPLACE FUNCTION geotrek.ft_setting(setting text) RETURNS text AS $f$
+                     SELECT nullif(current_setting($1, true), '''');
+                 $f$ LANGUAGE sql STABLE';
+    ELSE
+        EXECUTE 'CREATE OR REPLACE FUNCTION geotrek.ft_setting(setting text) RETURNS text AS $f$
+                     SELECT nullif(setting, '''') FROM pg_settings WHERE name = $1;
+                 $f$ LANGUAGE sql STABLE';
+    END IF;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION geotrek.ft_setting_enabled(setting text) RETURNS boolean AS $$
+    SELECT coalesce(geotrek.ft_setting($1) = 'on', false);
+$$ LANGUAGE sql STABLE;
@@ -153,6 +153,76 @@ END;
 $$ LANGUAGE plpgsql;
 
 
+-------------------------------------------------------------------------------
+-- Deferred computation of geometries
+-- When geotrek.deferred_geometry is set to 'commit' or 'queue' in the current
+-- transaction (see Topology.deferred_geometry()), triggers on paths and
+-- aggregations mark topologies as dirty instead of computing their geometry.
+-- Each dirty topology is then computed once, at commit ('commit') or by
+-- update_geometry_of_dirty_evenements(), called from a Celery job ('queue').
+-------------------------------------------------------------------------------
+
+ALTER TABLE e_t_evenement_recalcul ALTER COLUMN asynchrone SET DEFAULT false;
+ALTER TABLE e_t_evenement_recalcul ALTER COLUMN date SET DEFAULT now();
+
+CREATE OR REPLACE FUNCTION geotrek.defer_geometry_of_evenements(eids integer[]) RETURNS boolean AS $$
+DECLARE
+    mode text;
+BEGIN
+    mode := ft_setting('geotrek.deferred_geometry');
+    IF mode IS NULL OR mode NOT IN ('commit', 'queue') THEN
+        RETURN false;
+    END IF;
+
+    -- Topologies already queued for this commit (or already queued at all
+    -- when queuing for later) do not need another row
+    INSERT INTO e_t_evenement_recalcul (evenement, asynchrone)
+    SELECT DISTINCT eid, mode = 'queue'
+    FROM unnest(eids) AS eid
+    WHERE NOT EXISTS (
+        SELECT * FROM e_t_evenement_recalcul r
+        WHERE r.evenement = eid AND (NOT r.asynchrone OR mode = 'queue')
+    );
+
+    RETURN true;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION geotrek.update_geometry_of_dirty_evenements() RETURNS integer AS $$
+DECLARE
+    eid integer;
+    t_count integer;
+BEGIN
+    t_count := 0;
+    FOR eid IN WITH dirty AS (DELETE FROM e_t_evenement_recalcul RETURNING evenement)
+               SELECT DISTINCT e.id FROM dirty, e_t_evenement e WHERE e.id = dirty.evenement
+    LOOP
+        PERFORM update_geometry_of_evenement(eid);
+        t_count := t_count + 1;
+    END LOOP;
+    RETURN t_count;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS e_t_evenement_recalcul_i_tgr ON e_t_evenement_recalcul;
+
+CREATE OR REPLACE FUNCTION geotrek.evenement_recalcul_i() RETURNS trigger AS $$
+BEGIN
+    -- Rows of the same topology are all removed by the first one processed
+    DELETE FROM e_t_evenement_recalcul WHERE evenement = NEW.evenement;
+    IF FOUND THEN
+        PERFORM update_geometry_of_evenement(NEW.evenement);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE CONSTRAINT TRIGGER e_t_evenement_recalcul_i_tgr
+AFTER INSERT ON e_t_evenement_recalcul
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW WHEN (NOT NEW.asynchrone) EXECUTE PROCEDURE evenement_recalcul_i();
+
+
 -------------------------------------------------------------------------------
 -- Update geometry when offset change
 -------------------------------------------------------------------------------
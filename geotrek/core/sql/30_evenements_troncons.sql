@@ -50,6 +50,11 @@ DECLARE
     eid integer;
     eids integer[];
 BEGIN
+    -- Geometry of bulk inserted aggregations is computed once afterwards (see Topology.add_paths())
+    IF TG_OP = 'INSERT' AND ft_setting_enabled('geotrek.bulk_aggregations') THEN
+        RETURN NULL;
+    END IF;
+
     IF TG_OP = 'INSERT' THEN
         eids := array_append(eids, NEW.evenement);
     ELSE
@@ -61,6 +66,10 @@ BEGIN
         END IF;
     END IF;
 
+    IF defer_geometry_of_evenements(eids) THEN
+        RETURN NULL;
+    END IF;
+
     FOREACH eid IN ARRAY eids LOOP
         PERFORM update_geometry_of_evenement(eid);
     END LOOP;
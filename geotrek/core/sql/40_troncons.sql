@@ -92,20 +92,25 @@ DROP TRIGGER IF EXISTS l_t_troncon_90_evenements_geom_u_tgr ON l_t_troncon;
 CREATE OR REPLACE FUNCTION geotrek.update_evenement_geom_when_troncon_changes() RETURNS trigger AS $$
 DECLARE
     eid integer;
+    eids integer[];
     egeom geometry;
     linear_offset float;
     side_offset float;
 BEGIN
     -- Geometry of linear topologies are always updated
     -- Geometry of point topologies are updated if offset = 0
-    FOR eid IN SELECT e.id
-               FROM e_r_evenement_troncon et, e_t_evenement e
-               WHERE et.troncon = NEW.id AND et.evenement = e.id
-               GROUP BY e.id, e.decallage
-               HAVING BOOL_OR(et.pk_debut != et.pk_fin) OR e.decallage = 0.0
-    LOOP
-        PERFORM update_geometry_of_evenement(eid);
-    END LOOP;
+    SELECT coalesce(array_agg(t.id), '{}') INTO eids
+    FROM (SELECT e.id
+          FROM e_r_evenement_troncon et, e_t_evenement e
+          WHERE et.troncon = NEW.id AND et.evenement = e.id
+          GROUP BY e.id, e.decallage
+          HAVING BOOL_OR(et.pk_debut != et.pk_fin) OR e.decallage = 0.0) AS t;
+
+    IF NOT defer_geometry_of_evenements(eids) THEN
+        FOREACH eid IN ARRAY eids LOOP
+            PERFORM update_geometry_of_evenement(eid);
+        END LOOP;
+    END IF;
 
     -- Special case of point geometries with offset != 0
     FOR eid, egeom IN SELECT e.id, e.geom
@@ -152,6 +157,10 @@ CREATE OR REPLACE FUNCTION geotrek.elevation_troncon_iu() RETURNS trigger AS $$
 DECLARE
     elevation elevation_infos;
 BEGIN
+    -- Paths bulk loaded are draped all at once (see loadpaths command)
+    IF ft_setting_enabled('geotrek.bulk_paths') THEN
+        RETURN NEW;
+    END IF;
 
     SELECT * FROM ft_elevation_infos(NEW.geom, {{ALTIMETRIC_PROFILE_STEP}}) INTO elevation;
     -- Update path geometry
@@ -217,3 +226,41 @@ $$ LANGUAGE plpgsql;
 CREATE TRIGGER l_t_troncon_latest_updated_d_tgr
 AFTER DELETE ON l_t_troncon
 FOR EACH ROW EXECUTE PROCEDURE troncon_latest_updated_d();
+
+
+---------------------------------------------------------------------
+-- Journal of paths changes (see PathChange model), to update the
+-- cached paths graph incrementally
+---------------------------------------------------------------------
+
+-- Changes are read again until all transactions which may have journaled
+-- them are over, by comparing their transaction id with the oldest running one
+ALTER TABLE l_t_troncon_journal ALTER COLUMN date SET DEFAULT clock_timestamp();
+ALTER TABLE l_t_troncon_journal ALTER COLUMN txid SET DEFAULT txid_current();
+
+DROP TRIGGER IF EXISTS l_t_troncon_journal_iud_tgr ON l_t_troncon;
+
+CREATE OR REPLACE FUNCTION geotrek.troncons_journal_iud() RETURNS trigger AS $$
+DECLARE
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO l_t_troncon_journal (troncon, operation) VALUES (OLD.id, 'D');
+        RETURN NULL;
+    END IF;
+    -- Graph only depends on extremities, length and visibility
+    IF TG_OP = 'UPDATE' THEN
+        IF ST_AsBinary(ST_StartPoint(OLD.geom)) = ST_AsBinary(ST_StartPoint(NEW.geom)) AND
+           ST_AsBinary(ST_EndPoint(OLD.geom)) = ST_AsBinary(ST_EndPoint(NEW.geom)) AND
+           OLD.longueur IS NOT DISTINCT FROM NEW.longueur AND
+           OLD.visible = NEW.visible THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    INSERT INTO l_t_troncon_journal (troncon, operation) VALUES (NEW.id, left(TG_OP, 1));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER l_t_troncon_journal_iud_tgr
+AFTER INSERT OR UPDATE OR DELETE ON l_t_troncon
+FOR EACH ROW EXECUTE PROCEDURE troncons_journal_iud();
@@ -12,6 +12,11 @@ DECLARE
 
     DISTANCE float8;
 BEGIN
+    -- Paths bulk loaded are snapped all at once (see loadpaths command)
+    IF ft_setting_enabled('geotrek.bulk_paths') THEN
+        RETURN NEW;
+    END IF;
+
     DISTANCE := {{PATH_SNAPPING_DISTANCE}};
 
     linestart := ST_StartPoint(NEW.geom);
@@ -108,6 +113,10 @@ DECLARE
     intersections_on_new float8[];
     intersections_on_current float8[];
 BEGIN
+    -- Paths bulk loaded are noded all at once (see loadpaths command)
+    IF ft_setting_enabled('geotrek.bulk_paths') THEN
+        RETURN NULL;
+    END IF;
 
     -- Copy original geometry
     newgeom := NEW.geom;
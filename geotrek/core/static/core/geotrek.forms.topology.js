@@ -120,9 +120,9 @@ MapEntity.GeometryField.TopologyField = MapEntity.GeometryField.extend({
 
         // Path layer is ready, load graph !
         this._pathsLayer.fire('data:loading');
-        var url = window.SETTINGS.urls.path_graph + '?_u=' + (new Date().getTime());
-        $.getJSON(url, this._onGraphLoaded.bind(this))
-         .error(graphError.bind(this));
+        // Packed graph, revalidated with its ETag
+        var url = window.SETTINGS.urls.path_graph + '?format=binary';
+        Geotrek.GraphDecoder.load(url, this._onGraphLoaded.bind(this), graphError.bind(this));
 
         function graphError(jqXHR, textStatus, errorThrown) {
             this._pathsLayer.fire('data:loaded');
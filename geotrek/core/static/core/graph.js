@@ -0,0 +1,73 @@
+var Geotrek = Geotrek || {};
+
+/*
+ * Paths graph packed in typed arrays (see ``pack_graph()`` in core/graph.py):
+ *
+ *   header: magic "GTGR", format, edges count, version length (uint32)
+ *   edges ids (int32), edges start and end nodes (int32 pairs),
+ *   edges lengths (float32), version (ascii)
+ *
+ * Values are little-endian, like typed arrays on every platform we support.
+ */
+Geotrek.GraphDecoder = (function() {
+
+    var HEADER_SIZE = 16,
+        FORMAT = 1;
+
+    function decode(buffer) {
+        var header = new DataView(buffer, 0, HEADER_SIZE),
+            magic = String.fromCharCode(header.getUint8(0), header.getUint8(1),
+                                        header.getUint8(2), header.getUint8(3));
+        if (magic != 'GTGR' || header.getUint32(4, true) != FORMAT)
+            throw new Error('Unsupported graph format');
+
+        var count = header.getUint32(8, true),
+            version_length = header.getUint32(12, true),
+            ids = new Int32Array(buffer, HEADER_SIZE, count),
+            nodes = new Int32Array(buffer, HEADER_SIZE + 4 * count, 2 * count),
+            lengths = new Float32Array(buffer, HEADER_SIZE + 12 * count, count),
+            version = new Uint8Array(buffer, HEADER_SIZE + 16 * count, version_length);
+
+        // Same structure as JSON graph. Edges are sorted by id, thus when
+        // several edges link the same nodes, the last one wins (like on server).
+        var graph = {
+            'version': String.fromCharCode.apply(null, version),
+            'nodes': {},
+            'edges': {}
+        };
+        for (var i = 0; i < count; i++) {
+            var edge_id = ids[i],
+                start = nodes[2 * i],
+                end = nodes[2 * i + 1];
+            graph.edges[edge_id] = {'id': edge_id, 'length': lengths[i], 'nodes_id': [start, end]};
+            (graph.nodes[start] = graph.nodes[start] || {})[end] = edge_id;
+            (graph.nodes[end] = graph.nodes[end] || {})[start] = edge_id;
+        }
+        return graph;
+    }
+
+    function load(url, success, error) {
+        var xhr = new XMLHttpRequest();
+        xhr.open('GET', url);
+        xhr.responseType = 'arraybuffer';
+        xhr.onload = function () {
+            if (xhr.status != 200)
+                return error(xhr, xhr.statusText);
+            try {
+                success(decode(xhr.response));
+            }
+            catch (e) {
+                error(xhr, 'parsererror', e);
+            }
+        };
+        xhr.onerror = function () {
+            error(xhr, 'error');
+        };
+        xhr.send();
+    }
+
+    return {
+        'decode': decode,
+        'load': load
+    };
+})();
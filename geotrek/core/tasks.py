@@ -0,0 +1,13 @@
+from __future__ import absolute_import
+
+from celery import shared_task
+
+from geotrek.core.models import Topology
+
+
+@shared_task(name='geotrek.core.update-dirty-topologies')
+def update_dirty_topologies():
+    """
+    Compute geometry of topologies queued by ``Topology.deferred_geometry(asynchronous=True)``.
+    """
+    return Topology.update_dirty_geometries()
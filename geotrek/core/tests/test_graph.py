@@ -1,13 +1,21 @@
+import datetime
 import json
+import struct
+import zlib
 
 from django.test import TestCase
 from django.contrib.auth.models import User
 from django.contrib.gis.geos import LineString
+from django.core.cache import get_cache
 from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+from django.utils import timezone
 
 from geotrek.core.factories import PathFactory
-from geotrek.core.graph import graph_edges_nodes_of_qs
-from geotrek.core.models import Path
+from geotrek.core.graph import (compact_graph_of_qs, graph_edges_nodes_of_qs, pack_graph,
+                                IncrementalGraph, PathGraph)
+from geotrek.core.models import Path, PathChange
+from geotrek.core.views import GRAPH_LOCK, get_path_graph
 
 
 class SimpleGraph(TestCase):
@@ -55,11 +63,15 @@ class SimpleGraph(TestCase):
         computed_graph = graph_edges_nodes_of_qs(Path.objects.order_by('id'))
         self.assertDictEqual(computed_graph, graph)
 
+        computed_graph = compact_graph_of_qs(Path.objects.order_by('id')).as_dict()
+        self.assertDictEqual(computed_graph, graph)
+
     def test_json_graph_empty(self):
 
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 200)
         graph = json.loads(response.content)
+        del graph['version']
         self.assertDictEqual({'edges': {}, 'nodes': {}}, graph)
 
     def test_json_graph_simple(self):
@@ -67,6 +79,7 @@ class SimpleGraph(TestCase):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 200)
         graph = json.loads(response.content)
+        del graph['version']
         self.assertDictEqual({'edges': {str(path.pk): {u'id': path.pk, u'length': 1.4142135623731, u'nodes_id': [1, 2]}},
                               'nodes': {u'1': {u'2': path.pk}, u'2': {u'1': path.pk}}}, graph)
 
@@ -80,3 +93,288 @@ class SimpleGraph(TestCase):
         expires = response['Expires']
         self.assertNotEqual(expires, None)
         self.assertEqual(expires, last_modified)
+
+
+class CompactGraphTest(TestCase):
+    def test_same_graph_as_models_graph(self):
+        PathFactory(geom=LineString((0, 0), (1, 0)))
+        PathFactory(geom=LineString((1, 0), (1, 1)))
+        PathFactory(geom=LineString((1, 1), (0, 0)))
+        PathFactory(geom=LineString((1, 1), (2, 2), (1, 1)))
+        PathFactory(geom=LineString((5, 5), (6, 6)))
+        qs = Path.objects.order_by('id')
+        self.assertDictEqual(compact_graph_of_qs(qs).as_dict(), graph_edges_nodes_of_qs(qs))
+
+    def test_neighbours(self):
+        path_1 = PathFactory(geom=LineString((0, 0), (1, 0)))
+        path_2 = PathFactory(geom=LineString((1, 0), (1, 1)))
+        graph = compact_graph_of_qs(Path.objects.order_by('id'))
+        self.assertEqual(list(graph.edge_ids), [path_1.pk, path_2.pk])
+        self.assertEqual(list(graph.offsets), [0, 0, 1, 3, 4])
+        self.assertEqual(list(graph.neighbours), [2, 1, 3, 2])
+        self.assertEqual(list(graph.neighbour_edges), [0, 0, 1, 1])
+
+
+class CompactGraphSizeTest(TestCase):
+    def test_grid_graph(self):
+        size = 5
+        for i in range(size):
+            for j in range(size):
+                PathFactory(geom=LineString((i * 10, j * 10), (i * 10 + 10, j * 10)))
+                PathFactory(geom=LineString((i * 10, j * 10), (i * 10, j * 10 + 10)))
+        qs = Path.objects.order_by('id')
+        graph = compact_graph_of_qs(qs)
+        self.assertDictEqual(graph.as_dict(), graph_edges_nodes_of_qs(qs))
+        # All corners of the grid but the top right one
+        nodes_count = (size + 1) ** 2 - 1
+        edges_count = 2 * size * size
+        self.assertEqual(graph.nodes_count, nodes_count)
+        self.assertEqual(len(graph.edge_ids), edges_count)
+        self.assertEqual(len(graph.edge_lengths), edges_count)
+        self.assertEqual(len(graph.edge_nodes), 2 * edges_count)
+        self.assertEqual(len(graph.offsets), nodes_count + 2)
+        self.assertEqual(len(graph.neighbours), 2 * edges_count)
+        self.assertEqual(len(graph.neighbour_edges), 2 * edges_count)
+
+
+class IncrementalGraphTest(TestCase):
+    def setUp(self):
+        self.graph = IncrementalGraph('base')
+        self.graph.add_path(1, (0, 0), (1, 0), 1)
+        self.graph.add_path(2, (1, 0), (1, 1), 1)
+
+    def test_update_path(self):
+        self.graph.update_path(2, ((1, 0), (2, 0), 1))
+        self.assertEqual(self.graph.version, 'base-1')
+        self.assertEqual(self.graph.nodes, {1: {2: 1}, 2: {1: 1, 4: 2}, 4: {2: 2}})
+        self.assertEqual(self.graph.edges[2], {'id': 2, 'length': 1, 'nodes_id': [2, 4]})
+
+    def test_delete_path(self):
+        self.graph.update_path(2)
+        self.assertEqual(self.graph.nodes, {1: {2: 1}, 2: {1: 1}})
+        self.assertNotIn(2, self.graph.edges)
+
+    def test_delete_path_linking_same_nodes(self):
+        self.graph.add_path(3, (0, 0), (1, 0), 2)
+        self.assertEqual(self.graph.nodes[1], {2: 3})
+        self.graph.update_path(3)
+        self.assertEqual(self.graph.nodes[1], {2: 1})
+
+    def test_changes_since(self):
+        version = self.graph.version
+        self.graph.update_path(2, ((1, 0), (2, 0), 1))
+        self.graph.update_path(1)
+        self.assertEqual(self.graph.changes_since(version), {
+            'version': 'base-2',
+            'since': 'base-0',
+            'edges': {1: None, 2: {'id': 2, 'length': 1, 'nodes_id': [2, 4]}},
+            'nodes': {1: None, 2: {4: 2}, 3: None, 4: {2: 2}},
+        })
+        self.assertEqual(self.graph.changes_since('base-1')['edges'], {1: None})
+        self.assertEqual(self.graph.changes_since('base-2')['edges'], {})
+
+    def test_unknown_changes(self):
+        self.assertIsNone(self.graph.changes_since('other-0'))
+        self.assertIsNone(self.graph.changes_since('base-1'))
+        self.assertIsNone(self.graph.changes_since('foo'))
+        self.graph.history_size = 1
+        self.graph.update_path(1)
+        self.graph.update_path(2)
+        self.assertIsNone(self.graph.changes_since('base-0'))
+        self.assertIsNotNone(self.graph.changes_since('base-1'))
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'fat': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'path_graph_test'},
+})
+class IncrementalGraphJsonTest(TestCase):
+    def setUp(self):
+        get_cache('fat').clear()
+        user = User.objects.create_user('homer', 'h@s.com', 'dooh')
+        self.assertTrue(self.client.login(username=user.username, password='dooh'))
+        self.url = reverse('core:path_json_graph')
+        self.path = PathFactory(geom=LineString((0, 0), (1, 0)))
+
+    def get_graph(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_path_changes_are_journaled(self):
+        path = PathFactory(geom=LineString((1, 0), (1, 1)))
+        path.name = 'Name only'
+        path.save()
+        path.geom = LineString((1, 0), (2, 0))
+        path.save()
+        path.delete()
+        changes = PathChange.objects.filter(path=path.pk).values_list('operation', flat=True)
+        self.assertEqual(list(changes), ['I', 'U', 'D'])
+
+    def test_graph_is_updated_with_changes(self):
+        version = self.get_graph()['version']
+        other = PathFactory(geom=LineString((1, 0), (1, 1)))
+        graph = self.get_graph()
+        self.assertNotEqual(graph['version'], version)
+        self.assertEqual(sorted(graph['edges'].keys()), sorted([str(self.path.pk), str(other.pk)]))
+        self.assertEqual(graph['nodes']['2'], {'1': self.path.pk, '3': other.pk})
+
+    def test_changes_since_version(self):
+        version = self.get_graph()['version']
+        self.path.geom = LineString((0, 0), (2, 0))
+        self.path.save()
+        changes = self.get_graph(since=version)
+        self.assertEqual(changes['since'], version)
+        self.assertEqual(changes['edges'][str(self.path.pk)]['nodes_id'], [1, 3])
+        self.assertEqual(changes['nodes'], {'1': {'3': self.path.pk}, '2': None, '3': {'1': self.path.pk}})
+
+    def test_changes_are_applied_whatever_their_date(self):
+        self.get_graph()
+        other = PathFactory(geom=LineString((1, 0), (1, 1)))
+        # Journaled at start of a long transaction
+        PathChange.objects.filter(path=other.pk).update(date=timezone.now() - datetime.timedelta(hours=2))
+        self.assertIn(str(other.pk), self.get_graph()['edges'])
+
+    def test_cached_graph_is_compact(self):
+        self.get_graph()
+        graph = get_cache('fat').get('path_graph')
+        self.assertEqual(list(graph.edge_ids), [self.path.pk])
+        self.assertEqual(list(graph.edge_nodes), [1, 2])
+
+    def test_graph_is_not_stored_while_locked(self):
+        version = self.get_graph()['version']
+        get_cache('fat').add(GRAPH_LOCK, True)
+        other = PathFactory(geom=LineString((1, 0), (1, 1)))
+        self.assertIn(str(other.pk), self.get_graph()['edges'])
+        self.assertEqual(get_cache('fat').get('path_graph_json')[0], version)
+        get_cache('fat').delete(GRAPH_LOCK)
+        self.assertIn(str(other.pk), self.get_graph()['edges'])
+        self.assertNotEqual(get_cache('fat').get('path_graph_json')[0], version)
+
+    def test_whole_graph_for_unknown_version(self):
+        graph = self.get_graph(since='unknown-0')
+        self.assertNotIn('since', graph)
+        self.assertIn(str(self.path.pk), graph['edges'])
+
+    def test_binary_graph(self):
+        response = self.client.get(self.url, {'format': 'binary'}, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        packed = zlib.decompress(response.content, 16 + zlib.MAX_WBITS)
+        version = self.get_graph()['version']
+        self.assertEqual(packed, pack_graph({self.path.pk: {'id': self.path.pk, 'length': self.path.length,
+                                                            'nodes_id': [1, 2]}}, version))
+        self.assertEqual(struct.unpack('<4sIII', packed[:16]), (b'GTGR', 1, 1, len(version)))
+
+        self.assertNotIn('no-store', response['Cache-Control'])
+        etag = response['ETag']
+        response = self.client.get(self.url, {'format': 'binary'}, HTTP_ACCEPT_ENCODING='gzip',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        PathFactory(geom=LineString((1, 0), (1, 1)))
+        response = self.client.get(self.url, {'format': 'binary'}, HTTP_ACCEPT_ENCODING='gzip',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_binary_graph_without_gzip(self):
+        response = self.client.get(self.url, {'format': 'binary'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content[:4], b'GTGR')
+
+
+class PathGraphTest(TestCase):
+    def setUp(self):
+        # Square A B C D, with a long diagonal A C
+        self.graph = PathGraph()
+        self.graph.add_path(1, (0, 0), (10, 0), 10)
+        self.graph.add_path(2, (10, 0), (10, 10), 10)
+        self.graph.add_path(3, (10, 10), (0, 10), 10)
+        self.graph.add_path(4, (0, 10), (0, 0), 10)
+        self.graph.add_path(5, (0, 0), (10, 10), 100)
+
+    def test_route_through_paths(self):
+        self.assertEqual(self.graph.route([(1, 0.2), (2, 0.5)]),
+                         [{'offset': 0, 'positions': {0: [0.2, 1.0], 1: [0.0, 0.5]}, 'paths': [1, 2]}])
+
+    def test_route_follows_paths_backwards(self):
+        self.assertEqual(self.graph.route([(1, 0.2), (3, 0.4)]),
+                         [{'offset': 0, 'positions': {0: [0.2, 0.0], 1: [1.0, 0.0], 2: [1.0, 0.4]},
+                           'paths': [1, 4, 3]}])
+
+    def test_route_on_same_path(self):
+        self.assertEqual(self.graph.route([(5, 0.2), (5, 0.3)]),
+                         [{'offset': 0, 'positions': {0: [0.2, 0.3]}, 'paths': [5]}])
+
+    def test_route_around_long_path(self):
+        self.assertEqual(self.graph.route([(5, 0.05), (5, 0.95)]),
+                         [{'offset': 0, 'positions': {0: [0.05, 0.0], 1: [0.0, 1.0], 2: [0.0, 1.0], 3: [1.0, 0.95]},
+                           'paths': [5, 1, 2, 5]}])
+
+    def test_route_with_intermediary_step(self):
+        topology = self.graph.route([(1, 0.5), (2, 0.5), (3, 0.5)])
+        self.assertEqual(len(topology), 2)
+        self.assertEqual(topology[0]['paths'], [1, 2])
+        self.assertEqual(topology[1]['paths'], [2, 3])
+
+    def test_no_route(self):
+        self.graph.add_path(6, (50, 50), (60, 60), 10)
+        self.assertIsNone(self.graph.route([(1, 0.5), (6, 0.5)]))
+
+    def test_graph_of_paths_is_compact(self):
+        path_1 = PathFactory(geom=LineString((0, 0), (10, 0)))
+        path_2 = PathFactory(geom=LineString((10, 0), (10, 10)))
+        graph = PathGraph.from_qs(Path.objects.filter(pk__in=[path_1.pk, path_2.pk]).order_by('pk'))
+        self.assertEqual(list(graph.edge_ids), [path_1.pk, path_2.pk])
+        self.assertEqual(graph.coords[1:], [(0, 0), (10, 0), (10, 10)])
+        self.assertEqual(graph.route([(path_1.pk, 0.5), (path_2.pk, 0.5)])[0]['paths'], [path_1.pk, path_2.pk])
+
+
+class RouteJsonTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('homer', 'h@s.com', 'dooh')
+        self.assertTrue(self.client.login(username=user.username, password='dooh'))
+        self.url = reverse('core:path_json_route')
+        self.path_1 = PathFactory(geom=LineString((0, 0), (10, 0)))
+        self.path_2 = PathFactory(geom=LineString((10, 0), (10, 10)))
+
+    def get_route(self, steps):
+        return self.client.get(self.url, {'steps': json.dumps(steps)})
+
+    def test_route(self):
+        response = self.get_route([{'path': self.path_1.pk, 'position': 0.5},
+                                   {'path': self.path_2.pk, 'position': 0.5}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content),
+                         [{'offset': 0, 'positions': {'0': [0.5, 1.0], '1': [0.0, 0.5]},
+                           'paths': [self.path_1.pk, self.path_2.pk]}])
+
+    def test_graph_is_kept_until_paths_change(self):
+        graph = get_path_graph()
+        self.assertIs(get_path_graph(), graph)
+        path_3 = PathFactory(geom=LineString((10, 10), (20, 10)))
+        graph = get_path_graph()
+        self.assertIsNotNone(graph.path_edge(path_3.pk))
+
+    def test_graph_is_built_again_when_a_path_is_deleted(self):
+        self.assertIsNotNone(get_path_graph().path_edge(self.path_2.pk))
+        self.path_2.delete()
+        self.assertIsNone(get_path_graph().path_edge(self.path_2.pk))
+        response = self.get_route([{'path': self.path_1.pk, 'position': 0.5},
+                                   {'path': self.path_2.pk, 'position': 0.5}])
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_steps(self):
+        self.assertEqual(self.get_route([{'path': self.path_1.pk, 'position': 0.5}]).status_code, 400)
+        self.assertEqual(self.get_route([{'path': self.path_1.pk, 'position': 2},
+                                         {'path': self.path_2.pk, 'position': 0.5}]).status_code, 400)
+        self.assertEqual(self.get_route([{'path': self.path_1.pk, 'position': 0.5},
+                                         {'path': 0, 'position': 0.5}]).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'steps': 'foo'}).status_code, 400)
+
+    def test_no_route(self):
+        path_3 = PathFactory(geom=LineString((50, 50), (60, 60)))
+        response = self.get_route([{'path': self.path_1.pk, 'position': 0.5},
+                                   {'path': path_3.pk, 'position': 0.5}])
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,81 @@
+import json
+import os
+import tempfile
+from StringIO import StringIO
+
+from django.conf import settings
+from django.contrib.gis.geos import LineString, MultiPolygon, Polygon
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from geotrek.core.factories import PathFactory
+from geotrek.core.models import Path
+from geotrek.zoning.factories import CityFactory
+from geotrek.zoning.models import CityEdge
+
+
+class LoadPathsTest(TestCase):
+    def load(self, *lines, **options):
+        features = [{
+            'type': 'Feature',
+            'properties': {'name': name},
+            'geometry': {'type': 'LineString', 'coordinates': coords},
+        } for name, coords in lines]
+        fd, filename = tempfile.mkstemp(suffix='.geojson')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': features}, f)
+        output = StringIO()
+        try:
+            call_command('loadpaths', filename, srid=settings.SRID, stdout=output, **options)
+        finally:
+            os.remove(filename)
+        return output.getvalue()
+
+    def test_command_fails_if_filename_missing(self):
+        self.assertRaises(CommandError, call_command, 'loadpaths', 'toto.geojson')
+
+    def test_dry_run_does_not_load_paths(self):
+        output = self.load(('a', [[0, 0], [10, 0]]), ('b', [[5, -5], [5, 5]]), dry_run=True, verbosity=1)
+        self.assertIn('2 objects found', output)
+        self.assertIn('Split: 4 rows', output)
+        self.assertIn('Dry run: nothing loaded', output)
+        self.assertEqual(Path.objects.count(), 0)
+
+    def test_crossing_lines_are_split(self):
+        self.load(('a', [[0, 0], [10, 0]]), ('b', [[5, -5], [5, 5]]), verbosity=0)
+        paths = Path.objects.all()
+        self.assertEqual(sorted(p.name for p in paths), ['a', 'a', 'b', 'b'])
+        for path in paths:
+            self.assertAlmostEqual(path.length, 5)
+            self.assertIsNotNone(path.geom_3d)
+
+    def test_extremities_are_snapped(self):
+        PathFactory.create(geom=LineString((0, 0), (10, 0)))
+        output = self.load(('a', [[10.5, 0], [20, 0]]), verbosity=1)
+        self.assertIn('Snap: 1 extremities', output)
+        path = Path.objects.get(name='a')
+        self.assertEqual(path.geom.coords, ((10, 0), (20, 0)))
+
+    def test_existing_paths_are_split(self):
+        PathFactory.create(name='existing', geom=LineString((0, 0), (10, 0)))
+        self.load(('a', [[5, -5], [5, 5]]), verbosity=0)
+        self.assertEqual(Path.objects.filter(name='existing').count(), 2)
+        self.assertEqual(Path.objects.filter(name='a').count(), 2)
+
+    def test_overlapping_lines_are_skipped(self):
+        PathFactory.create(geom=LineString((0, 0), (10, 0)))
+        output = self.load(('a', [[5, 0], [15, 0]]), ('b', [[20, 0], [30, 0]]), verbosity=1)
+        self.assertIn('1 lines skipped: overlaps an existing path', output)
+        self.assertFalse(Path.objects.filter(name='a').exists())
+        self.assertTrue(Path.objects.filter(name='b').exists())
+
+    def test_paths_are_linked_to_cities(self):
+        city = CityFactory.create(geom=MultiPolygon(Polygon.from_bbox((-10, -10, 5, 10)), srid=settings.SRID))
+        self.load(('a', [[0, 0], [10, 0]]), verbosity=0)
+        path = Path.objects.get(name='a')
+        edge = CityEdge.objects.get(city=city)
+        aggregation = edge.aggregations.get()
+        self.assertEqual(aggregation.path, path)
+        self.assertAlmostEqual(aggregation.start_position, 0.0)
+        self.assertAlmostEqual(aggregation.end_position, 0.5)
@@ -1,15 +1,17 @@
 import json
 import math
 
-from django.test import TestCase
+import mock
+from django.test import TestCase, TransactionTestCase
 from django.conf import settings
-from django.db import connections, DEFAULT_DB_ALIAS
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
 from django.contrib.gis.geos import Point, LineString
+from django.test.utils import CaptureQueriesContext
 
 from geotrek.common.utils import dbnow, almostequal
 from geotrek.core.factories import (PathFactory, PathAggregationFactory,
                                     TopologyFactory)
-from geotrek.core.models import Path, Topology, PathAggregation
+from geotrek.core.models import Path, Topology, PathAggregation, DirtyTopology
 from geotrek.core.helpers import TopologyHelper
 
 
@@ -882,6 +884,42 @@ class TopologyDerialization(TestCase):
         self.assertTrue(almostequal(start_before, start_after), '%s != %s' % (start_before, start_after))
         self.assertTrue(almostequal(end_before, end_after), '%s != %s' % (end_before, end_after))
 
+    def test_deserialize_line_geometry(self):
+        p1 = PathFactory.create(geom=LineString((0, 0), (2, 0)))
+        p2 = PathFactory.create(geom=LineString((2, 0), (2, 2)))
+        topology = Topology.deserialize('[{"paths": [%s, %s], "positions": {"0": [0.5, 1.0], "1": [0.0, 0.5]}, "offset": 0}]'
+                                        % (p1.pk, p2.pk))
+        self.assertEqual(topology.geom.coords, ((1, 0), (2, 0), (2, 1)))
+        self.assertEqual(topology.length, 2)
+        self.assertFalse(topology.deleted)
+
+    def test_deserialize_with_intermediary_marker(self):
+        p1 = PathFactory.create(geom=LineString((0, 0), (2, 0)))
+        p2 = PathFactory.create(geom=LineString((2, 0), (2, 2)))
+        topology = Topology.deserialize([{"paths": [p1.pk], "positions": {"0": [0.0, 1.0]}},
+                                         {"paths": [p2.pk], "positions": {"0": [0.0, 1.0]}}])
+        aggregations = [(a.path.pk, a.start_position, a.end_position, a.order) for a in topology.aggregations.all()]
+        self.assertEqual(aggregations, [(p1.pk, 0.0, 1.0, 0), (p1.pk, 1.0, 1.0, 1), (p2.pk, 0.0, 1.0, 2)])
+        self.assertEqual(topology.geom.coords, ((0, 0), (2, 0), (2, 2)))
+
+    def test_deserialize_unknown_path(self):
+        path = PathFactory.create()
+        with self.assertRaises(ValueError):
+            Topology.deserialize('[{"paths": [%s, %s], "offset": 0}]' % (path.pk, path.pk + 1))
+        self.assertFalse(PathAggregation.objects.filter(path=path).exists())
+
+    def test_deserialize_queries_do_not_depend_on_paths_count(self):
+        paths = [PathFactory.create(geom=LineString((i, 0), (i + 1, 0))) for i in range(10)]
+
+        def count_queries(paths):
+            serialized = [{"paths": [p.pk for p in paths], "offset": 0}]
+            with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as context:
+                topology = Topology.deserialize(serialized)
+            self.assertEqual(topology.aggregations.count(), len(paths))
+            return len(context.captured_queries)
+
+        self.assertEqual(count_queries(paths[:2]), count_queries(paths))
+
 
 class TopologyOverlappingTest(TestCase):
 
@@ -937,3 +975,184 @@ class TopologyOverlappingTest(TestCase):
         from geotrek.trekking.models import Trek
         overlaps = Topology.overlapping(Trek.objects.all())
         self.assertEqual(list(overlaps), [])
+
+    def test_overlapping_is_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(len(Topology.overlapping(self.topo1)), 5)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(Topology.overlapping(Topology.objects.filter(pk=self.topo1.pk))), 5)
+
+    def test_overlapping_of_several_topologies(self):
+        overlaps = Topology.overlapping([self.topo2, self.point1])
+        self.assertEqual(list(overlaps), [self.topo2,
+                                          self.point1, self.point3, self.point2, self.topo1])
+        overlaps = Topology.overlapping(Topology.objects.filter(pk__in=[self.point1.pk, self.point2.pk]))
+        self.assertEqual(list(overlaps), [self.topo2, self.point1, self.point2, self.topo1])
+
+    def test_overlapping_of_empty_list(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(list(Topology.overlapping([])), [])
+
+    def test_overlapping_can_be_restricted_to_model(self):
+        from geotrek.trekking.factories import TrekFactory
+        from geotrek.trekking.models import Trek
+        trek = TrekFactory.create(no_path=True)
+        trek.add_path(self.path2, start=0.5, end=0.7)
+        self.assertEqual(list(Trek.overlapping(self.topo2)), [trek])
+
+
+class TopologyDeferredGeometryTest(TestCase):
+
+    def setUp(self):
+        self.path1 = PathFactory.create(geom=LineString((0, 0), (10, 0)))
+        self.path2 = PathFactory.create(geom=LineString((10, 0), (20, 0)))
+        self.topology = TopologyFactory.create(no_path=True)
+        self.topology.add_path(self.path1)
+        self.topology.add_path(self.path2, order=1)
+        self.initial = self.geom()
+
+    def move_paths(self):
+        self.path1.geom = LineString((0, 0), (5, 5), (10, 0))
+        self.path1.save()
+        self.path2.geom = LineString((10, 0), (15, 5), (20, 0))
+        self.path2.save()
+
+    def commit(self):
+        cursor = connections[DEFAULT_DB_ALIAS].cursor()
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        cursor.execute("SET CONSTRAINTS ALL DEFERRED")
+
+    def geom(self):
+        return Topology.objects.get(pk=self.topology.pk).geom.coords
+
+    def test_geometry_is_computed_immediately_by_default(self):
+        self.move_paths()
+        self.assertEqual(self.geom(), ((0, 0), (5, 5), (10, 0), (15, 5), (20, 0)))
+        self.assertFalse(DirtyTopology.objects.exists())
+
+    def test_geometry_is_computed_once_at_commit(self):
+        with Topology.deferred_geometry():
+            self.move_paths()
+            self.assertEqual(self.geom(), self.initial)
+        self.assertEqual(list(DirtyTopology.objects.values_list('topology', 'asynchronous')),
+                         [(self.topology.pk, False)])
+        self.commit()
+        self.assertEqual(self.geom(), ((0, 0), (5, 5), (10, 0), (15, 5), (20, 0)))
+        self.assertFalse(DirtyTopology.objects.exists())
+
+    def test_geometry_is_computed_by_asynchronous_job(self):
+        with Topology.deferred_geometry(asynchronous=True):
+            self.move_paths()
+        self.commit()
+        self.assertEqual(self.geom(), self.initial)
+        self.assertEqual(list(DirtyTopology.objects.values_list('topology', 'asynchronous')),
+                         [(self.topology.pk, True)])
+        self.assertEqual(Topology.update_dirty_geometries(), 1)
+        self.assertEqual(self.geom(), ((0, 0), (5, 5), (10, 0), (15, 5), (20, 0)))
+        self.assertFalse(DirtyTopology.objects.exists())
+
+    def update_geometry_calls(self):
+        cursor = connections[DEFAULT_DB_ALIAS].cursor()
+        cursor.execute("SELECT coalesce(sum(calls), 0) FROM pg_stat_xact_user_functions "
+                       "WHERE funcname = 'update_geometry_of_evenement'")
+        return cursor.fetchone()[0]
+
+    def test_path_split_computes_topologies_once(self):
+        cursor = connections[DEFAULT_DB_ALIAS].cursor()
+        cursor.execute("SET LOCAL track_functions = 'pl'")
+        calls = self.update_geometry_calls()
+        # Splits both paths of the topology
+        PathFactory.create(geom=LineString((5, -5), (5, 5), (15, 5), (15, -5)))
+        self.assertEqual(Path.objects.count(), 7)
+        self.assertEqual(self.update_geometry_calls() - calls, 1)
+        self.assertEqual(Topology.objects.get(pk=self.topology.pk).length, 20)
+        self.assertFalse(DirtyTopology.objects.exists())
+
+    def test_aggregations_changes_are_deferred(self):
+        path3 = PathFactory.create(geom=LineString((20, 0), (30, 0)))
+        with Topology.deferred_geometry():
+            self.topology.add_path(path3, order=2, reload=False)
+            self.assertEqual(Topology.objects.get(pk=self.topology.pk).length, 20)
+        self.commit()
+        self.assertEqual(Topology.objects.get(pk=self.topology.pk).length, 30)
+
+
+class TopologyDeferredGeometryJobTest(TransactionTestCase):
+
+    def setUp(self):
+        self.path = PathFactory.create(geom=LineString((0, 0), (10, 0)))
+
+    def move_path(self):
+        self.path.geom = LineString((0, 0), (5, 5), (10, 0))
+        self.path.save()
+
+    @mock.patch('geotrek.core.tasks.update_dirty_topologies.delay')
+    def test_job_is_triggered_after_commit(self, delay):
+        with Topology.deferred_geometry(asynchronous=True):
+            self.move_path()
+            self.assertFalse(delay.called)
+        delay.assert_called_once_with()
+
+    @mock.patch('geotrek.core.tasks.update_dirty_topologies.delay')
+    def test_job_is_not_triggered_before_outer_commit(self, delay):
+        with transaction.atomic():
+            with Topology.deferred_geometry(asynchronous=True):
+                self.move_path()
+        self.assertFalse(delay.called)
+
+    @mock.patch('geotrek.core.tasks.update_dirty_topologies.delay')
+    def test_job_is_not_triggered_when_computed_at_commit(self, delay):
+        with Topology.deferred_geometry():
+            self.move_path()
+        self.assertFalse(delay.called)
+
+
+class TopologySaveTest(TestCase):
+    def setUp(self):
+        self.path = PathFactory.create(geom=LineString((0, 0), (10, 0)))
+        self.topology = TopologyFactory.create(no_path=True)
+        self.topology.add_path(self.path, start=0.2, end=0.8)
+
+    def test_save_is_a_single_statement(self):
+        with self.assertNumQueries(1):
+            self.topology.save()
+
+    def test_save_keeps_computed_values(self):
+        geom, length = self.topology.geom, self.topology.length
+        self.topology.length = 0
+        self.topology.geom_3d = None
+        self.topology.save()
+        self.assertEqual(self.topology.geom, geom)
+        self.assertEqual(self.topology.length, length)
+        self.assertIsNotNone(self.topology.geom_3d)
+        self.assertEqual(Topology.objects.get(pk=self.topology.pk).length, length)
+
+    def test_save_reads_values_computed_in_database(self):
+        self.path.geom = LineString((0, 0), (20, 0))
+        self.path.save()
+        self.topology.save()
+        self.assertAlmostEqual(self.topology.geom.length, 12)
+        self.assertAlmostEqual(self.topology.length, 12)
+
+    def test_offset_change_computes_geometry(self):
+        self.topology.offset = 1
+        self.topology.save()
+        self.assertAlmostEqual(abs(self.topology.geom.coords[0][1]), 1)
+        self.assertEqual(self.topology.geom, Topology.objects.get(pk=self.topology.pk).geom)
+
+    def test_save_with_update_fields(self):
+        self.topology.deleted = True
+        self.topology.save(update_fields=['deleted'])
+        self.assertTrue(Topology.objects.get(pk=self.topology.pk).deleted)
+
+
+class TopologySaveStatementsTest(TestCase):
+    def setUp(self):
+        path = PathFactory.create(geom=LineString((0, 0), (10, 0)))
+        self.topology = TopologyFactory.create(no_path=True)
+        self.topology.add_path(path, start=0.2, end=0.8)
+
+    def test_repeated_saves_are_single_statements(self):
+        with self.assertNumQueries(3):
+            for i in range(3):
+                self.topology.save()
@@ -81,6 +81,15 @@ class PathViewsTest(CommonTest):
         self.modelfactory.create(name=u"ãéè")
         super(CommonTest, self).test_basic_format()
 
+    def test_only_csv_and_shapefile_exports_prefetch_properties(self):
+        self.login()
+        self.modelfactory.create()
+        with mock.patch.object(Path, 'prefetch_properties', side_effect=lambda queryset, *names: queryset) as prefetch:
+            for fmt in ('csv', 'shp', 'gpx'):
+                response = self.client.get(self.model.get_format_list_url() + '?format=' + fmt)
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual(prefetch.call_count, 2)
+
     def test_path_form_is_not_valid_if_no_geometry_provided(self):
         self.login()
         data = self.get_good_data()
@@ -1,17 +1,24 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
 import json
 import logging
+import uuid
+import zlib
+from datetime import timedelta
 
 from django.contrib.auth.decorators import permission_required
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import last_modified as cache_last_modified
-from django.views.decorators.cache import never_cache as force_cache_validation
+from django.utils.cache import add_never_cache_headers, patch_cache_control
 from django.views.generic import View
 from django.utils.translation import ugettext as _
 from django.core.cache import get_cache
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import Count, Max
+from django.utils import timezone
 from django.shortcuts import redirect
 from mapentity import registry
 from mapentity.views import (MapEntityLayer, MapEntityList, MapEntityJsonList,
@@ -21,13 +28,14 @@ from mapentity.views import (MapEntityLayer, MapEntityList, MapEntityJsonList,
 
 from geotrek.authent.decorators import same_structure_required
 from geotrek.common.utils import classproperty
+from geotrek.common.views import PrefetchPropertiesMixin
 from geotrek.core.models import AltimetryMixin
 
-from .models import Path, Trail, Topology
+from .models import Path, PathChange, Trail, Topology
 from .forms import PathForm, TrailForm
 from .filters import PathFilterSet, TrailFilterSet
 from . import graph as graph_lib
-from django.http.response import HttpResponse
+from django.http.response import HttpResponse, HttpResponseNotModified
 from django.contrib import messages
 
 
@@ -112,7 +120,7 @@ class PathJsonList(MapEntityJsonList, PathList):
     pass
 
 
-class PathFormatList(MapEntityFormat, PathList):
+class PathFormatList(PrefetchPropertiesMixin, MapEntityFormat, PathList):
     columns = [
         'id', 'valid', 'visible', 'name', 'comments', 'departure', 'arrival',
         'comfort', 'source', 'stake', 'usages', 'networks',
@@ -143,6 +151,10 @@ class PathCreate(MapEntityCreate):
     model = Path
     form_class = PathForm
 
+    def form_valid(self, form):
+        with Topology.deferred_geometry(immediate=True):
+            return super(PathCreate, self).form_valid(form)
+
 
 class PathUpdate(MapEntityUpdate):
     model = Path
@@ -152,6 +164,10 @@ class PathUpdate(MapEntityUpdate):
     def dispatch(self, *args, **kwargs):
         return super(PathUpdate, self).dispatch(*args, **kwargs)
 
+    def form_valid(self, form):
+        with Topology.deferred_geometry(immediate=True):
+            return super(PathUpdate, self).form_valid(form)
+
 
 class PathDelete(MapEntityDelete):
     model = Path
@@ -161,29 +177,203 @@ class PathDelete(MapEntityDelete):
         return super(PathDelete, self).dispatch(*args, **kwargs)
 
 
-@login_required
-@cache_last_modified(lambda x: Path.latest_updated())
-@force_cache_validation
-def get_graph_json(request):
+GRAPH_CHANGES_RETENTION = timedelta(days=1)
+GRAPH_LOCK = 'path_graph_lock'
+GRAPH_LOCK_TIMEOUT = timedelta(minutes=5)
+
+
+def get_transactions_xmin():
+    """ Id of the oldest transaction still running: journal entries of older
+    transactions are all visible (or were rolled back).
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+    return cursor.fetchone()[0]
+
+
+def get_graph_changes(xmin, applied):
+    """ Journal entries of transactions not over when ``xmin`` was read, thus
+    possibly committed since then (i.e. out of id order), skipping those
+    already applied.
+    """
+    changes = PathChange.objects.filter(transaction__gte=xmin).exclude(pk__in=applied)
+    return list(changes.values_list('pk', 'path', 'transaction'))
+
+
+def get_cached_graph():
+    """
+    Return the version, the ``IncrementalGraph`` and the JSON of the cached
+    paths graph. Graph is built once, then updated with the paths changes
+    journaled since (see ``PathChange``). It is only loaded from cache when
+    paths changed, and is None otherwise.
+
+    A single process at a time updates the cached graph (see ``GRAPH_LOCK``),
+    others compute their own up-to-date graph without storing it.
+    """
     cache = get_cache('fat')
-    key = 'path_graph_json'
+    cached = cache.get('path_graph_json')
+    if cached:
+        version, xmin, applied, json_graph = cached
+        if not get_graph_changes(xmin, applied):
+            return version, None, json_graph
+
+    locked = cache.add(GRAPH_LOCK, True, GRAPH_LOCK_TIMEOUT.total_seconds())
+    try:
+        if locked:
+            # Read again, another process may have stored a newer graph meanwhile
+            cached = cache.get('path_graph_json')
+        return update_cached_graph(cache, cached, store=locked)
+    finally:
+        if locked:
+            cache.delete(GRAPH_LOCK)
+
+
+def update_cached_graph(cache, cached, store):
+    graph = None
+    # Read before journal, so that entries of transactions over meanwhile are read again
+    new_xmin = get_transactions_xmin()
+    if cached:
+        version, xmin, applied, json_graph = cached
+        changes = get_graph_changes(xmin, applied)
+        if not changes:
+            return version, None, json_graph
+        graph = cache.get('path_graph')
+        if graph and graph.version == version:
+            pks = []
+            for change, pk, txid in changes:
+                if pk not in pks:
+                    pks.append(pk)
+            extremities = dict((pk, (start_point, end_point, length)) for pk, start_point, end_point, length
+                               in graph_lib.path_extremities(Path.objects.filter(pk__in=pks)))
+            for pk in pks:
+                graph.update_path(pk, extremities.get(pk))
+            applied.update((change, txid) for change, pk, txid in changes)
+        else:
+            graph = None
+
+    if graph is None:
+        # Changes journaled before building are part of the graph
+        applied = dict((change, txid) for change, pk, txid in get_graph_changes(new_xmin, []))
+        graph = graph_lib.IncrementalGraph.from_qs(Path.objects.all(), base=uuid.uuid4().hex[:8])
+
+    json_graph = json.dumps(graph.as_dict())
+    if store:
+        applied = dict((change, txid) for change, txid in applied.items() if txid >= new_xmin)
+        PathChange.objects.filter(transaction__lt=new_xmin, date__lt=timezone.now() - GRAPH_CHANGES_RETENTION).delete()
+        cache.set('path_graph', graph)
+        cache.set('path_graph_json', (graph.version, new_xmin, applied, json_graph))
+    return graph.version, graph, json_graph
+
+
+def get_graph_binary(version, graph, json_graph):
+    """
+    Return the ETag and gzipped content of the packed paths graph
+    (see ``pack_graph()``), cached for each graph version.
+    """
+    cache = get_cache('fat')
+    cached = cache.get('path_graph_binary')
+    if cached and cached[0] == version:
+        return cached[1], cached[2]
+    edges = graph.edges if graph else json.loads(json_graph)['edges']
+    packed = graph_lib.pack_graph(edges, version)
+    etag = '"{}"'.format(hashlib.sha1(packed).hexdigest())
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    compressed = compressor.compress(packed) + compressor.flush()
+    cache.set('path_graph_binary', (version, etag, compressed))
+    return etag, compressed
+
+
+def graph_binary_response(request, version, graph, json_graph):
+    etag, content = get_graph_binary(version, graph, json_graph)
+    gzipped = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    if gzipped:
+        etag = etag[:-1] + '-gzip"'
+    else:
+        content = zlib.decompress(content, 16 + zlib.MAX_WBITS)
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type='application/octet-stream')
+        if gzipped:
+            response['Content-Encoding'] = 'gzip'
+    response['ETag'] = etag
+    response['Vary'] = 'Accept-Encoding'
+    return response
 
-    result = cache.get(key)
-    latest = Path.latest_updated()
 
-    if result and latest:
-        cache_latest, json_graph = result
-        # Not empty and still valid
-        if cache_latest and cache_latest >= latest:
-            return HttpJSONResponse(json_graph)
+@login_required
+@cache_last_modified(lambda x: Path.latest_updated())
+def get_graph_json(request):
+    """
+    Paths graph, with its ``version``. With ``?since=<version>``, return only the
+    edges and nodes changed since then (set to null if deleted), or the whole graph
+    if changes since this version are not known.
+    With ``?format=binary``, return the packed graph (see ``pack_graph()``).
+    """
+    version, graph, json_graph = get_cached_graph()
+    if request.GET.get('format') == 'binary':
+        response = graph_binary_response(request, version, graph, json_graph)
+        # Kept by browsers, but revalidated with its ETag
+        patch_cache_control(response, no_cache=True, max_age=0)
+        return response
+    response = HttpJSONResponse(json_graph)
+    since = request.GET.get('since')
+    if since:
+        if graph is None:
+            graph = get_cache('fat').get('path_graph')
+        changes = graph.changes_since(since) if graph else None
+        if changes is not None:
+            response = HttpJSONResponse(json.dumps(changes))
+    # Force cache validation
+    add_never_cache_headers(response)
+    return response
+
+
+_path_graph = (None, None)
+
+
+def get_path_graph():
+    """ Shortest path graph, kept in memory of each worker until paths change.
+    Changes (including deletions) are detected with the paths journal
+    (see ``PathChange``): its rows count changes with entries committed in
+    any order, and with purges.
+    """
+    global _path_graph
+    journal = PathChange.objects.aggregate(Count('pk'), Max('pk'))
+    state = (journal['pk__count'], journal['pk__max'])
+    cache_state, graph = _path_graph
+    if graph is None or cache_state != state:
+        graph = graph_lib.PathGraph.from_qs(Path.objects.all())
+        _path_graph = (state, graph)
+    return graph
 
-    # cache does not exist or is not up to date
-    # rebuild the graph and cache the json
-    graph = graph_lib.graph_edges_nodes_of_qs(Path.objects.all())
-    json_graph = json.dumps(graph)
 
-    cache.set(key, (latest, json_graph))
-    return HttpJSONResponse(json_graph)
+@login_required
+def get_route_json(request):
+    """
+    Shortest way through steps, given as a JSON list of path ids and positions on them,
+    e.g. ``?steps=[{"path": 12, "position": 0.3}, {"path": 45, "position": 0.8}]``.
+    Return the serialized topology (see ``TopologyHelper.deserialize()``).
+    """
+    try:
+        steps = [(int(step['path']), float(step['position']))
+                 for step in json.loads(request.GET.get('steps', ''))]
+    except (ValueError, TypeError, KeyError) as e:
+        return HttpJSONResponse(json.dumps({'error': unicode(e)}), status=400)
+    if len(steps) < 2:
+        return HttpJSONResponse(json.dumps({'error': _(u"At least two steps are required")}), status=400)
+    if not all(0.0 <= position <= 1.0 for pk, position in steps):
+        return HttpJSONResponse(json.dumps({'error': _(u"Positions must be between 0 and 1")}), status=400)
+
+    graph = get_path_graph()
+    unknown = [pk for pk, position in steps if graph.path_edge(pk) is None]
+    if unknown:
+        return HttpJSONResponse(json.dumps({'error': _(u"Unknown paths %s") % unknown}), status=400)
+
+    topology = graph.route(steps)
+    if topology is None:
+        return HttpJSONResponse(json.dumps({'error': _(u"No route found")}), status=404)
+    return HttpJSONResponse(json.dumps(topology))
 
 
 class TrailLayer(MapEntityLayer):
@@ -201,7 +391,7 @@ class TrailJsonList(MapEntityJsonList, TrailList):
     pass
 
 
-class TrailFormatList(MapEntityFormat, TrailList):
+class TrailFormatList(PrefetchPropertiesMixin, MapEntityFormat, TrailList):
     columns = [
         'id', 'name', 'comments', 'departure', 'arrival',
         'structure', 'date_insert', 'date_update',
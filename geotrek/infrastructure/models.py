@@ -148,7 +148,8 @@ class Infrastructure(BaseInfrastructure):
 
 
 Path.add_property('infrastructures', lambda self: Infrastructure.path_infrastructures(self), _(u"Infrastructures"))
-Topology.add_property('infrastructures', lambda self: Infrastructure.topology_infrastructures(self), _(u"Infrastructures"))
+Topology.add_property('infrastructures', lambda self: Infrastructure.topology_infrastructures(self), _(u"Infrastructures"),
+                      prefetch=Topology.overlapping_prefetch(Infrastructure.topology_infrastructures))
 
 
 class SignageGISManager(gismodels.GeoManager):
@@ -183,4 +184,5 @@ class Signage(BaseInfrastructure):
 
 
 Path.add_property('signages', lambda self: Signage.path_signages(self), _(u"Signages"))
-Topology.add_property('signages', lambda self: Signage.topology_signages(self), _(u"Signages"))
+Topology.add_property('signages', lambda self: Signage.topology_signages(self), _(u"Signages"),
+                      prefetch=Topology.overlapping_prefetch(Signage.topology_signages))
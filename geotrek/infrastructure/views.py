@@ -2,6 +2,7 @@ from mapentity.views import (MapEntityLayer, MapEntityList, MapEntityJsonList, M
                              MapEntityDetail, MapEntityDocument, MapEntityCreate, MapEntityUpdate, MapEntityDelete)
 
 from geotrek.authent.decorators import same_structure_required
+from geotrek.common.views import PrefetchPropertiesMixin
 from geotrek.core.models import AltimetryMixin
 from geotrek.core.views import CreateFromTopologyMixin
 
@@ -25,7 +26,7 @@ class InfrastructureJsonList(MapEntityJsonList, InfrastructureList):
     pass
 
 
-class InfrastructureFormatList(MapEntityFormat, InfrastructureList):
+class InfrastructureFormatList(PrefetchPropertiesMixin, MapEntityFormat, InfrastructureList):
     columns = [
         'id', 'name', 'type', 'condition', 'description',
         'implantation_year', 'structure', 'date_insert',
@@ -83,7 +84,7 @@ class SignageJsonList(MapEntityJsonList, SignageList):
     pass
 
 
-class SignageFormatList(MapEntityFormat, SignageList):
+class SignageFormatList(PrefetchPropertiesMixin, MapEntityFormat, SignageList):
     columns = [
         'id', 'name', 'type', 'condition', 'description',
         'implantation_year', 'structure', 'date_insert',
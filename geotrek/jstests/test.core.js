@@ -396,3 +396,52 @@ describe('Topology helper', function() {
         done();
     });
 });
+
+
+describe('Graph decoder', function() {
+
+    function packGraph(edges, version) {
+        // Same layout as pack_graph() (see core/graph.py)
+        var count = edges.length,
+            buffer = new ArrayBuffer(16 + 16 * count + version.length),
+            header = new DataView(buffer);
+        'GTGR'.split('').forEach(function (c, i) { header.setUint8(i, c.charCodeAt(0)); });
+        header.setUint32(4, 1, true);
+        header.setUint32(8, count, true);
+        header.setUint32(12, version.length, true);
+        edges.forEach(function (edge, i) {
+            header.setInt32(16 + 4 * i, edge.id, true);
+            header.setInt32(16 + 4 * count + 8 * i, edge.nodes_id[0], true);
+            header.setInt32(16 + 4 * count + 8 * i + 4, edge.nodes_id[1], true);
+            header.setFloat32(16 + 12 * count + 4 * i, edge.length, true);
+        });
+        version.split('').forEach(function (c, i) { header.setUint8(16 + 16 * count + i, c.charCodeAt(0)); });
+        return buffer;
+    }
+
+    it('It should decode packed graph', function(done) {
+        var buffer = packGraph([{id: 1, length: 5, nodes_id: [1, 2]},
+                                {id: 2, length: 10, nodes_id: [2, 3]}], 'abc-1');
+        assert.deepEqual(Geotrek.GraphDecoder.decode(buffer), {
+            version: 'abc-1',
+            nodes: {1: {2: 1}, 2: {1: 1, 3: 2}, 3: {2: 2}},
+            edges: {
+                1: {id: 1, length: 5, nodes_id: [1, 2]},
+                2: {id: 2, length: 10, nodes_id: [2, 3]}
+            }
+        });
+        done();
+    });
+
+    it('It should keep last edge linking same nodes', function(done) {
+        var buffer = packGraph([{id: 1, length: 5, nodes_id: [1, 2]},
+                                {id: 4, length: 2, nodes_id: [2, 1]}], 'abc-1');
+        assert.deepEqual(Geotrek.GraphDecoder.decode(buffer).nodes, {1: {2: 4}, 2: {1: 4}});
+        done();
+    });
+
+    it('It should refuse unknown format', function(done) {
+        assert.throws(function () { Geotrek.GraphDecoder.decode(new ArrayBuffer(16)); });
+        done();
+    });
+});
@@ -69,8 +69,8 @@ class PhysicalEdge(MapEntityMixin, Topology):
 
 
 Path.add_property('physical_edges', PhysicalEdge.path_physicals, _(u"Physical edges"))
-Topology.add_property('physical_edges', PhysicalEdge.topology_physicals, _(u"Physical edges"))
-Intervention.add_property('physical_edges', lambda self: self.topology.physical_edges if self.topology else [], _(u"Physical edges"))
+Topology.add_property('physical_edges', PhysicalEdge.topology_physicals, _(u"Physical edges"), prefetch=Topology.overlapping_prefetch(PhysicalEdge.topology_physicals))
+Intervention.add_property('physical_edges', lambda self: self.topology.physical_edges if self.topology else [], _(u"Physical edges"), prefetch=Intervention.topology_prefetch('physical_edges'))
 Project.add_property('physical_edges', lambda self: self.edges_by_attr('physical_edges'), _(u"Physical edges"))
 
 
@@ -136,8 +136,8 @@ class LandEdge(MapEntityMixin, Topology):
 
 
 Path.add_property('land_edges', LandEdge.path_lands, _(u"Land edges"))
-Topology.add_property('land_edges', LandEdge.topology_lands, _(u"Land edges"))
-Intervention.add_property('land_edges', lambda self: self.topology.land_edges if self.topology else [], _(u"Land edges"))
+Topology.add_property('land_edges', LandEdge.topology_lands, _(u"Land edges"), prefetch=Topology.overlapping_prefetch(LandEdge.topology_lands))
+Intervention.add_property('land_edges', lambda self: self.topology.land_edges if self.topology else [], _(u"Land edges"), prefetch=Intervention.topology_prefetch('land_edges'))
 Project.add_property('land_edges', lambda self: self.edges_by_attr('land_edges'), _(u"Land edges"))
 
 
@@ -187,8 +187,8 @@ class CompetenceEdge(MapEntityMixin, Topology):
 
 
 Path.add_property('competence_edges', CompetenceEdge.path_competences, _(u"Competence edges"))
-Topology.add_property('competence_edges', CompetenceEdge.topology_competences, _(u"Competence edges"))
-Intervention.add_property('competence_edges', lambda self: self.topology.competence_edges if self.topology else [], _(u"Competence edges"))
+Topology.add_property('competence_edges', CompetenceEdge.topology_competences, _(u"Competence edges"), prefetch=Topology.overlapping_prefetch(lambda topologies: CompetenceEdge.overlapping(topologies).select_related('organization')))
+Intervention.add_property('competence_edges', lambda self: self.topology.competence_edges if self.topology else [], _(u"Competence edges"), prefetch=Intervention.topology_prefetch('competence_edges'))
 Project.add_property('competence_edges', lambda self: self.edges_by_attr('competence_edges'), _(u"Competence edges"))
 
 
@@ -238,8 +238,8 @@ class WorkManagementEdge(MapEntityMixin, Topology):
 
 
 Path.add_property('work_edges', WorkManagementEdge.path_works, _(u"Work management edges"))
-Topology.add_property('work_edges', WorkManagementEdge.topology_works, _(u"Work management edges"))
-Intervention.add_property('work_edges', lambda self: self.topology.work_edges if self.topology else [], _(u"Work management edges"))
+Topology.add_property('work_edges', WorkManagementEdge.topology_works, _(u"Work management edges"), prefetch=Topology.overlapping_prefetch(WorkManagementEdge.topology_works))
+Intervention.add_property('work_edges', lambda self: self.topology.work_edges if self.topology else [], _(u"Work management edges"), prefetch=Intervention.topology_prefetch('work_edges'))
 Project.add_property('work_edges', lambda self: self.edges_by_attr('work_edges'), _(u"Work management edges"))
 
 
@@ -289,6 +289,6 @@ class SignageManagementEdge(MapEntityMixin, Topology):
 
 
 Path.add_property('signage_edges', SignageManagementEdge.path_signages, _(u"Signage management edges"))
-Topology.add_property('signage_edges', SignageManagementEdge.topology_signages, _(u"Signage management edges"))
-Intervention.add_property('signage_edges', lambda self: self.topology.signage_edges if self.topology else [], _(u"Signage management edges"))
+Topology.add_property('signage_edges', SignageManagementEdge.topology_signages, _(u"Signage management edges"), prefetch=Topology.overlapping_prefetch(SignageManagementEdge.topology_signages))
+Intervention.add_property('signage_edges', lambda self: self.topology.signage_edges if self.topology else [], _(u"Signage management edges"), prefetch=Intervention.topology_prefetch('signage_edges'))
 Project.add_property('signage_edges', lambda self: self.edges_by_attr('signage_edges'), _(u"Signage management edges"))
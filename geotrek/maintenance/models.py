@@ -5,6 +5,7 @@ from datetime import datetime
 from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.gis.db import models
+from django.db.models.query import prefetch_related_objects
 from django.contrib.gis.geos import GeometryCollection
 
 from mapentity.models import MapEntityMixin
@@ -264,6 +265,19 @@ class Intervention(AddPropertyMixin, MapEntityMixin, AltimetryMixin,
     def __unicode__(self):
         return u"%s (%s)" % (self.name, self.date)
 
+    @staticmethod
+    def topology_prefetch(name):
+        """ Build a property prefetch function (see ``add_property()``) for
+        properties delegated to the intervention topology.
+        """
+        def prefetch(interventions):
+            prefetch_related_objects(interventions, ['topology'])
+            topologies = [intervention.topology for intervention in interventions if intervention.topology]
+            Topology.prefetch_properties(topologies, name)
+            return dict((intervention.pk, getattr(intervention.topology, name))
+                        for intervention in interventions if intervention.topology)
+        return prefetch
+
     @classmethod
     def path_interventions(cls, path):
         return cls.objects.existing().filter(topology__aggregations__path=path)
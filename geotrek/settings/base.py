@@ -298,7 +298,12 @@ CACHES = {
     # The fat backend is used to store big chunk of data (>1 Mo)
     'fat': {
         'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
-    }
+    },
+    # The altimetry backend stores elevation profiles and charts, one entry
+    # per object and language, without expiry
+    'altimetry': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
 }
 
 # A sample logging configuration. The only tangible logging
@@ -426,8 +431,10 @@ ALTIMETRIC_PROFILE_WIDTH = 800
 ALTIMETRIC_PROFILE_FONTSIZE = 25
 ALTIMETRIC_PROFILE_FONT = 'ubuntu'
 ALTIMETRIC_PROFILE_MIN_YSCALE = 1200  # Minimum y scale (in meters)
+ALTIMETRIC_PROFILE_LOCAL_RENDERING = True  # Render PNG charts with CairoSVG instead of Convertit
 ALTIMETRIC_AREA_MAX_RESOLUTION = 150  # Maximum number of points (by width/height)
 ALTIMETRIC_AREA_MARGIN = 0.15
+ALTIMETRIC_DEM_ROOT = None  # Directory of DEM exported by loaddem for local sampling (None to sample in database)
 
 
 # Let this be defined at instance-level
@@ -448,6 +455,7 @@ LEAFLET_CONFIG = {
                            'trekking/parking_location.js']},
         'topofields': {'js': ['core/geotrek.forms.snap.js',
                               'core/geotrek.forms.topology.js',
+                              'core/graph.js',
                               'core/dijkstra.js',
                               'core/multipath.js',
                               'core/topology_helper.js']}
@@ -575,6 +583,9 @@ MOBILE_TILES_RADIUS_SMALL = 0.005  # ~500 m
 MOBILE_TILES_GLOBAL_ZOOMS = range(13)
 MOBILE_TILES_LOW_ZOOMS = range(13, 15)
 MOBILE_TILES_HIGH_ZOOMS = range(15, 17)
+MOBILE_TILES_MAX_CONNECTIONS_PER_HOST = 4
+MOBILE_TILES_RETRIES = 3
+MOBILE_TILES_RETRY_BACKOFF = 1  # seconds, doubled at each retry
 
 djcelery.setup_loader()
 
@@ -44,6 +44,7 @@ MEDIA_URL = '%s%s' % (ROOT_URL, envini.get('mediaurl', section="django", default
 MEDIA_ROOT = envini.get('mediaroot', section="django", default=os.path.join(DEPLOY_ROOT, 'var', 'media'))
 STATIC_ROOT = envini.get('staticroot', section="django", default=os.path.join(DEPLOY_ROOT, 'var', 'static'))
 CACHE_ROOT = envini.get('cacheroot', section="django", default=os.path.join(DEPLOY_ROOT, 'var', 'cache'))
+ALTIMETRIC_DEM_ROOT = envini.get('demroot', section="django", default=os.path.join(DEPLOY_ROOT, 'var', 'dem'))
 UPLOAD_DIR = envini.get('uploaddir', section="django", default=UPLOAD_DIR)
 MAPENTITY_CONFIG['TEMP_DIR'] = envini.get('tmproot', section="django", default=os.path.join(DEPLOY_ROOT, 'var', 'tmp'))
 SYNC_RANDO_ROOT = envini.get('syncrandoroot', section="django", default=os.path.join(DEPLOY_ROOT, 'data'))
@@ -62,6 +63,10 @@ CACHES['default']['TIMEOUT'] = envini.getint('cachetimeout', 3600 * 24)
 CACHES['fat']['BACKEND'] = 'django.core.cache.backends.filebased.FileBasedCache'
 CACHES['fat']['LOCATION'] = CACHE_ROOT
 CACHES['fat']['TIMEOUT'] = envini.getint('cachetimeout', 3600 * 24)
+CACHES['altimetry']['BACKEND'] = 'django.core.cache.backends.filebased.FileBasedCache'
+CACHES['altimetry']['LOCATION'] = os.path.join(CACHE_ROOT, 'altimetry')
+CACHES['altimetry']['TIMEOUT'] = None
+CACHES['altimetry']['OPTIONS'] = {'MAX_ENTRIES': envini.getint('altimetrycacheentries', 50000)}
 
 
 LANGUAGE_CODE = envini.get('language', LANGUAGE_CODE, env=False)
@@ -22,6 +22,9 @@ MAPENTITY_CONFIG['TRANSLATED_LANGUAGES'] = (
 
 MAILALERTSUBJECT = "Acknowledgment of feedback email"
 
+# Tests sampling a DEM export their own
+ALTIMETRIC_DEM_ROOT = None
+
 
 class DisableMigrations(object):
     def __contains__(self, item):
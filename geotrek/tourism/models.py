@@ -21,7 +21,7 @@ from geotrek.common.mixins import (NoDeleteMixin, TimeStampedModelMixin,
                                    PictogramMixin, OptionalPictogramMixin,
                                    PublishableMixin, PicturesMixin,
                                    AddPropertyMixin)
-from geotrek.common.models import Theme
+from geotrek.common.models import Theme, delete_all_documents_on_change
 from geotrek.common.utils import intersecting
 
 from extended_choices import Choices
@@ -505,3 +505,7 @@ TouristicContent.add_property('touristic_events', lambda self: intersecting(Tour
 TouristicContent.add_property('published_touristic_events', lambda self: intersecting(TouristicEvent, self).filter(published=True), _(u"Published touristic events"))
 TouristicEvent.add_property('touristic_events', lambda self: intersecting(TouristicEvent, self), _(u"Touristic events"))
 TouristicEvent.add_property('published_touristic_events', lambda self: intersecting(TouristicEvent, self).filter(published=True), _(u"Published touristic events"))
+
+# No modification date (see ``DocumentPublic.get_document_date_update()``)
+delete_all_documents_on_change(InformationDeskType, InformationDesk, TouristicContentCategory,
+                               TouristicContentType, TouristicEventType)
@@ -17,8 +17,7 @@ from rest_framework.views import APIView
 from rest_framework_gis.serializers import GeoFeatureModelSerializer
 
 from geotrek.authent.decorators import same_structure_required
-from geotrek.common.models import RecordSource, TargetPortal
-from geotrek.common.views import DocumentPublic
+from geotrek.common.views import DocumentPublic, PrefetchPropertiesMixin
 from geotrek.tourism.serializers import TouristicContentCategorySerializer
 from geotrek.trekking.models import Trek
 from geotrek.trekking.serializers import POISerializer
@@ -50,7 +49,7 @@ class TouristicContentList(MapEntityList):
         return TouristicContentCategory.objects.filter(pk__in=used)
 
 
-class TouristicContentFormatList(MapEntityFormat, TouristicContentList):
+class TouristicContentFormatList(PrefetchPropertiesMixin, MapEntityFormat, TouristicContentList):
     columns = [
         'id', 'eid', 'name', 'category', 'type1', 'type2', 'description_teaser',
         'description', 'themes', 'contact', 'email', 'website', 'practical_info',
@@ -117,20 +116,6 @@ class TouristicContentDocumentPublic(DocumentPublic):
         context['headerimage_ratio'] = settings.EXPORT_HEADER_IMAGE_SIZE['touristiccontent']
 
         context['object'] = context['content'] = content
-        source = self.request.GET.get('source')
-        if source:
-            try:
-                context['source'] = RecordSource.objects.get(name=source)
-            except RecordSource.DoesNotExist:
-                pass
-        portal = self.request.GET.get('portal', None)
-
-        if portal:
-            try:
-                context['portal'] = TargetPortal.objects.get(name=portal)
-            except TargetPortal.DoesNotExist:
-                pass
-
         return context
 
 
@@ -145,7 +130,7 @@ class TouristicEventList(MapEntityList):
     columns = ['id', 'name', 'type', 'begin_date', 'end_date']
 
 
-class TouristicEventFormatList(MapEntityFormat, TouristicEventList):
+class TouristicEventFormatList(PrefetchPropertiesMixin, MapEntityFormat, TouristicEventList):
     columns = [
         'id', 'eid', 'name', 'type', 'description_teaser', 'description', 'themes',
         'begin_date', 'end_date', 'duration', 'meeting_point', 'meeting_time',
@@ -201,20 +186,6 @@ class TouristicEventDocumentPublic(DocumentPublic):
 
         context['headerimage_ratio'] = settings.EXPORT_HEADER_IMAGE_SIZE['touristicevent']
         context['object'] = context['event'] = event
-        source = self.request.GET.get('source')
-        if source:
-            try:
-                context['source'] = RecordSource.objects.get(name=source)
-            except RecordSource.DoesNotExist:
-                pass
-
-        portal = self.request.GET.get('portal')
-        if portal:
-            try:
-                context['portal'] = TargetPortal.objects.get(name=portal)
-            except TargetPortal.DoesNotExist:
-                pass
-
         return context
 
 
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.utils import translation
+
+from geotrek.trekking.models import Trek
+
+
+class Command(BaseCommand):
+    help = "Fill the elevation profiles cache of published treks"
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        treks = Trek.objects.existing().order_by('pk')
+        count = 0
+        for trek in treks:
+            if not trek.is_public():
+                continue
+            languages = set(trek.published_langs)
+            for parent in trek.parents:
+                languages.update(parent.published_langs)
+            for language in languages:
+                with translation.override(language):
+                    trek.get_elevation_profile_svg()
+            count += 1
+            if verbosity >= 2:
+                self.stdout.write(u"Elevation profile of trek %s cached" % trek.pk)
+        if verbosity >= 1:
+            self.stdout.write(u"%d elevation profiles cached" % count)
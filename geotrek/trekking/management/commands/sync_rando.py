@@ -1,27 +1,46 @@
 # -*- encoding: UTF-8 -
 
+from contextlib import contextmanager
+from functools import wraps
+import fcntl
+import hashlib
+import heapq
+import json
 import logging
+from multiprocessing import Pool, current_process
+from multiprocessing.pool import ThreadPool
 from optparse import make_option
 import os
 import re
 import sys
 import shutil
+import tempfile
+import threading
+import time
 from time import sleep
-from zipfile import ZipFile
+from urlparse import urlparse
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
 
+from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
 from django.db.models import Q
-from django.http import StreamingHttpResponse
+from django.http import Http404, StreamingHttpResponse
 from django.test.client import RequestFactory
 from django.utils import translation, timezone
 from django.utils.translation import ugettext as _
 from landez import TilesManager
 from landez.sources import DownloadError
+import requests
+from rest_framework.mixins import ListModelMixin
+from geotrek import __version__
 from geotrek.common.models import FileType  # NOQA
+from geotrek.altimetry.dem import META_FILENAME as DEM_META_FILENAME
 from geotrek.altimetry.views import ElevationProfile, ElevationArea, serve_elevation_chart
 from geotrek.common import models as common_models
+from geotrek.common.mixins import PictogramMixin
 from geotrek.common.views import ThemeViewSet
 from geotrek.core.views import ParametersView
 from geotrek.feedback.views import CategoryList as FeedbackCategoryList
@@ -40,22 +59,244 @@ from geotrek.tourism import urls  # NOQA
 
 logger = logging.getLogger(__name__)
 
+# ioctl cloning a file (Linux)
+FICLONE = 0x40049409
+
+# Command instance inherited by forked pool workers (see ``init_sync_worker``)
+_worker_command = None
+
+
+def init_sync_worker(command):
+    """ Pool initializer. Workers are forked from the command process.
+    The database connections were closed before forking, so that each
+    worker opens its own.
+    """
+    global _worker_command
+    # Keep a reference on the inherited global zip file, so that it is never
+    # finalized (i.e. closed and written) by a worker.
+    command.parent_zipfile = getattr(command, 'zipfile', None)
+    _worker_command = command
+
+
+def sync_worker(args):
+    """ Run a per-object sync method in a pool worker (see ``Command.sync_unit``).
+    """
+    method, lang, model, pk = args
+    obj = model.objects.get(pk=pk)
+    if lang is not None:
+        translation.activate(lang)
+    return _worker_command.sync_unit(method, lang, obj)
+
+
+class ZipRecorder(object):
+    """ Stands for the global zip file while syncing an object: entries are
+    recorded and written afterwards (by the parent process when run in pool
+    workers), in objects order.
+    """
+    def __init__(self):
+        self.entries = []
+
+    def write(self, filename, arcname=None):
+        self.entries.append((filename, arcname))
+
+
+class SyncReport(object):
+    """ Timings of sync methods, count and size of generated files per
+    extension, and slowest objects. Written as JSON at the end of the sync.
+    """
+    slowest_count = 10
+
+    def __init__(self):
+        self.methods = {}
+        self.files = {}
+        self.slowest = []
+
+    @contextmanager
+    def timer(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            stats = self.methods.setdefault(name, {'calls': 0, 'time': 0.0})
+            stats['calls'] += 1
+            stats['time'] += time.time() - start
+
+    def add_file(self, name, size):
+        extension = os.path.splitext(name)[1].lstrip('.').lower() or 'other'
+        stats = self.files.setdefault(extension, {'files': 0, 'bytes': 0})
+        stats['files'] += 1
+        stats['bytes'] += size
+
+    def add_object(self, key, duration):
+        heapq.heappush(self.slowest, (duration, key))
+        if len(self.slowest) > self.slowest_count:
+            heapq.heappop(self.slowest)
+
+    def update(self, report):
+        """ Merge a report, for instance of an object synced by a pool worker.
+        """
+        for name, other in report.methods.items():
+            stats = self.methods.setdefault(name, {'calls': 0, 'time': 0.0})
+            stats['calls'] += other['calls']
+            stats['time'] += other['time']
+        for extension, other in report.files.items():
+            stats = self.files.setdefault(extension, {'files': 0, 'bytes': 0})
+            stats['files'] += other['files']
+            stats['bytes'] += other['bytes']
+        for duration, key in report.slowest:
+            self.add_object(key, duration)
+
+    def as_dict(self):
+        return {
+            'methods': self.methods,
+            'files': self.files,
+            'slowest': [{'object': key, 'time': duration} for duration, key in sorted(self.slowest, reverse=True)],
+        }
 
-class ZipTilesBuilder(object):
-    def __init__(self, filepath, close_zip, **builder_args):
-        builder_args['tile_format'] = self.format_from_url(builder_args['tiles_url'])
-        self.close_zip = close_zip
-        self.zipfile = ZipFile(filepath, 'w')
-        self.tm = TilesManager(**builder_args)
-
-        if not isinstance(settings.MOBILE_TILES_URL, str) and len(settings.MOBILE_TILES_URL) > 1:
-            for url in settings.MOBILE_TILES_URL[1:]:
-                args = builder_args
-                args['tiles_url'] = url
-                args['tile_format'] = self.format_from_url(args['tiles_url'])
-                self.tm.add_layer(TilesManager(**args), opacity=1)
 
-        self.tiles = set()
+def reflink(src, dst):
+    """ Clone src file into dst on file systems supporting copy-on-write (e.g. btrfs, XFS).
+    Returns whether it succeeded.
+    """
+    try:
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    except (IOError, OSError):
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+    return True
+
+
+def timed(method):
+    """ Record time spent in a ``Command`` method into its report.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.report.timer(method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class SyncZipFile(ZipFile):
+    """ Zip file choosing compression per entry: already compressed formats
+    are stored, others are deflated.
+    """
+    stored_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.pdf', '.zip', '.gz', '.mp3', '.mp4')
+
+    def __init__(self, file, mode='r'):
+        ZipFile.__init__(self, file, mode, ZIP_DEFLATED, allowZip64=True)
+
+    @property
+    def bytes_in(self):
+        return sum([zinfo.file_size for zinfo in self.filelist])
+
+    @property
+    def bytes_out(self):
+        return sum([zinfo.compress_size for zinfo in self.filelist])
+
+    def get_compress_type(self, name):
+        if os.path.splitext(name)[1].lower() in self.stored_extensions:
+            return ZIP_STORED
+        return ZIP_DEFLATED
+
+    def write(self, filename, arcname=None, compress_type=None):
+        if compress_type is None:
+            compress_type = self.get_compress_type(arcname or filename)
+        ZipFile.write(self, filename, arcname, compress_type)
+
+    def writestr(self, zinfo_or_arcname, bytes, compress_type=None):
+        if compress_type is None:
+            name = getattr(zinfo_or_arcname, 'filename', zinfo_or_arcname)
+            compress_type = self.get_compress_type(name)
+        ZipFile.writestr(self, zinfo_or_arcname, bytes, compress_type)
+
+
+class TileFetcher(object):
+    """ Downloads tiles concurrently from a ``{z}/{x}/{y}`` tiles URL.
+
+    Each thread keeps its own HTTP session (keep-alive connections), the
+    number of requests in flight per host is bounded, and failed requests
+    are retried with an exponential backoff.
+    """
+    subdomains = 'abc'
+
+    def __init__(self, tiles_url, headers=None, max_per_host=None, retries=None, backoff=None):
+        self.tiles_url = tiles_url
+        self.headers = headers or {}
+        self.max_per_host = max_per_host or settings.MOBILE_TILES_MAX_CONNECTIONS_PER_HOST
+        self.retries = settings.MOBILE_TILES_RETRIES if retries is None else retries
+        self.backoff = settings.MOBILE_TILES_RETRY_BACKOFF if backoff is None else backoff
+        self.hosts = set([urlparse(self.url((0, x, 0))).netloc for x in range(len(self.subdomains))])
+        self.semaphores = dict([(host, threading.BoundedSemaphore(self.max_per_host)) for host in self.hosts])
+        self.local = threading.local()
+
+    @property
+    def threads(self):
+        return self.max_per_host * len(self.hosts)
+
+    def url(self, tile):
+        z, x, y = tile
+        # Spread tiles among subdomains, if any
+        subdomain = self.subdomains[(x + y) % len(self.subdomains)]
+        return self.tiles_url.format(z=z, x=x, y=y, s=subdomain)
+
+    @property
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+            self.local.session.headers.update(self.headers)
+        return self.local.session
+
+    def fetch(self, tile):
+        """ Returns tile data, or raises ``DownloadError``.
+        """
+        url = self.url(tile)
+        semaphore = self.semaphores[urlparse(url).netloc]
+        for attempt in range(self.retries + 1):
+            if attempt:
+                sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                with semaphore:
+                    response = self.session.get(url, timeout=30)
+            except requests.RequestException as e:
+                error = unicode(e)
+                continue
+            if response.status_code == 200:
+                return response.content
+            error = u"HTTP {status}".format(status=response.status_code)
+            # Retry only server errors and rate limiting
+            if response.status_code < 500 and response.status_code != 429:
+                break
+        raise DownloadError(u"Cannot download {url}: {error}".format(url=url, error=error))
+
+
+class TileStore(object):
+    """ Local store of the tiles downloaded during a sync, shared by all tiles
+    zip files (and pool workers).
+
+    Tiles are stored once per content (``objects/<sha1>``), and hard linked from
+    their ``<source>/<z>/<x>/<y>`` path, the source identifying tiles URLs.
+    """
+    def __init__(self, root, **builder_args):
+        self.root = root
+        tiles_urls = settings.MOBILE_TILES_URL
+        if isinstance(tiles_urls, str):
+            tiles_urls = [tiles_urls]
+        builder_args['tiles_url'] = tiles_urls[0]
+        builder_args['tile_format'] = self.format_from_url(tiles_urls[0])
+        self.tm = TilesManager(**builder_args)
+        for url in tiles_urls[1:]:
+            args = dict(builder_args, tiles_url=url, tile_format=self.format_from_url(url))
+            self.tm.add_layer(TilesManager(**args), opacity=1)
+        self.source = hashlib.sha1(u"|".join(tiles_urls).encode('utf-8')).hexdigest()
+        self.extension = settings.MOBILE_TILES_EXTENSION or self.tm._tile_extension
+        # Layers are merged by landez, thus fetched serially
+        self.fetcher = None
+        if len(tiles_urls) == 1 and '{z}' in tiles_urls[0]:
+            self.fetcher = TileFetcher(tiles_urls[0], builder_args.get('tiles_headers'))
+        # Tiles which failed to download, not to be requested again
+        self.failed = set()
 
     def format_from_url(self, url):
         """
@@ -68,18 +309,121 @@ class ZipTilesBuilder(object):
             return m.group(1)
         return url.rsplit('.')[-1]
 
+    def tileslist(self, bbox, zoomlevels):
+        return self.tm.tileslist(bbox, zoomlevels)
+
+    def name(self, tile):
+        return '{0}/{1}/{2}{ext}'.format(*tile, ext=self.extension)
+
+    def path(self, tile):
+        return os.path.join(self.root, self.source, self.name(tile))
+
+    def add(self, tile, data):
+        """ Store tile data, once per content.
+        """
+        digest = hashlib.sha1(data).hexdigest()
+        objectpath = os.path.join(self.root, 'objects', digest)
+        if not os.path.exists(objectpath):
+            if not os.path.exists(os.path.dirname(objectpath)):
+                os.makedirs(os.path.dirname(objectpath))
+            # Write then rename, so that concurrent readers never see partial tiles
+            tmppath = '{0}.{1}'.format(objectpath, os.getpid())
+            with open(tmppath, 'wb') as f:
+                f.write(data)
+            os.rename(tmppath, objectpath)
+        path = self.path(tile)
+        if not os.path.exists(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:  # Created meanwhile by another worker
+                pass
+        try:
+            os.link(objectpath, path)
+        except OSError:
+            if not os.path.exists(path):
+                shutil.copyfile(objectpath, path)
+
+    def fetch(self, tiles, progress=None):
+        """ Download tiles which are not in the store yet.
+        Tiles are downloaded concurrently, and stored by the calling thread only.
+        ``progress`` is called with the number of tiles done and to do.
+        """
+        tiles = [tile for tile in tiles if tile not in self.failed and not os.path.exists(self.path(tile))]
+        if not tiles:
+            return
+        if self.fetcher is None or len(tiles) == 1:
+            results = (self.fetch_tile(tile) for tile in tiles)
+            pool = None
+        else:
+            pool = ThreadPool(min(self.fetcher.threads, len(tiles)))
+            results = pool.imap_unordered(self.fetch_tile, tiles)
+        try:
+            for i, (tile, data) in enumerate(results):
+                if data is None:
+                    self.failed.add(tile)
+                else:
+                    self.add(tile, data)
+                if progress:
+                    progress(i + 1, len(tiles))
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def fetch_tile(self, tile):
+        """ Returns tile data from the landez cache (``var/tiles``), or download it.
+        """
+        try:
+            if self.fetcher is None:
+                return tile, self.tm.tile(tile)
+            data = self.tm.cache.read(tile)
+            if data is None:
+                data = self.fetcher.fetch(tile)
+                self.tm.cache.save(data, tile)
+            return tile, data
+        except DownloadError:
+            logger.warning("Failed to download tile %s" % self.name(tile))
+            return tile, None
+
+
+class TilesCoverage(object):
+    """ Merges bboxes into the minimal set of tiles covering them.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.tiles = set()
+
+    def add(self, bbox, zoomlevels):
+        self.tiles.update(self.store.tileslist(bbox, zoomlevels))
+
+    def update(self, coverage):
+        self.tiles |= coverage.tiles
+
+    def __iter__(self):
+        # Sorted by zoom level and position, thus zip files are deterministic
+        return iter(sorted(self.tiles))
+
+    def __len__(self):
+        return len(self.tiles)
+
+
+class ZipTilesBuilder(object):
+    def __init__(self, filepath, close_zip, store):
+        self.close_zip = close_zip
+        self.zipfile = SyncZipFile(filepath, 'w')
+        self.store = store
+        self.coverage = TilesCoverage(store)
+
     def add_coverage(self, bbox, zoomlevels):
-        self.tiles |= set(self.tm.tileslist(bbox, zoomlevels))
+        self.coverage.add(bbox, zoomlevels)
 
     def run(self):
-        for tile in self.tiles:
-            name = '{0}/{1}/{2}{ext}'.format(*tile, ext=settings.MOBILE_TILES_EXTENSION or self.tm._tile_extension)
-            try:
-                data = self.tm.tile(tile)
-            except DownloadError:
-                logger.warning("Failed to download tile %s" % name)
-            else:
-                self.zipfile.writestr(name, data)
+        # Tiles already in the store (e.g. fetched for another zip file) are not downloaded again
+        self.store.fetch(self.coverage)
+        for tile in self.coverage:
+            path = self.store.path(tile)
+            if os.path.exists(path):
+                self.zipfile.write(path, self.store.name(tile))
         self.close_zip(self.zipfile)
 
 
@@ -105,13 +449,57 @@ class Command(BaseCommand):
                     default=False, help='include touristic events by trek in global.zip'),
         make_option('--with-touristiccontent-categories', '-c', action='store', dest='content_categories',
                     default=None, help='include touristic contents by trek in global.zip (filtered by category ID ex: --with-touristiccontent-categories="1,2,3")'),
+        make_option('--jobs', '-j', action='store', dest='jobs', type='int',
+                    default=1, help='Number of processes used to sync treks, touristic contents and events'),
+        make_option('--incremental', '-i', action='store_true', dest='incremental',
+                    default=False, help='Only sync treks, touristic contents and events changed since previous sync'),
+        make_option('--link-media', action='store_true', dest='link_media',
+                    default=False, help='Hard link (or reflink) media files instead of copying them'),
+        make_option('--resume', '-r', action='store_true', dest='resume',
+                    default=False, help='Resume an interrupted sync'),
     )
 
+    manifest_name = 'manifest.json'
+    journal_name = 'journal.json'
+    # Per-object sync methods whose outputs can be reused by incremental syncs
+    incremental_methods = ('sync_trek', 'sync_content', 'sync_event')
+
     def mkdirs(self, name):
         dirname = os.path.dirname(name)
         if not os.path.exists(dirname):
-            os.makedirs(dirname)
+            try:
+                os.makedirs(dirname)
+            except OSError:  # Created meanwhile by a pool worker
+                if not os.path.isdir(dirname):
+                    raise
+
+    def global_tiles_coverage(self):
+        coverage = TilesCoverage(self.tiles_store)
+        coverage.add(bbox=settings.LEAFLET_CONFIG['SPATIAL_EXTENT'], zoomlevels=settings.MOBILE_TILES_GLOBAL_ZOOMS)
+        return coverage
+
+    def trek_tiles_coverage(self, trek):
+        """ Tiles around each vertex of the trek geometry.
+        """
+        def _radius2bbox(lng, lat, radius):
+            return (lng - radius, lat - radius,
+                    lng + radius, lat + radius)
+
+        coverage = TilesCoverage(self.tiles_store)
 
+        geom = trek.geom
+        if geom.geom_type == 'MultiLineString':
+            geom = geom[0]  # FIXME
+        geom.transform(4326)
+
+        for (lng, lat) in geom.coords:
+            large = _radius2bbox(lng, lat, settings.MOBILE_TILES_RADIUS_LARGE)
+            small = _radius2bbox(lng, lat, settings.MOBILE_TILES_RADIUS_SMALL)
+            coverage.add(bbox=large, zoomlevels=settings.MOBILE_TILES_LOW_ZOOMS)
+            coverage.add(bbox=small, zoomlevels=settings.MOBILE_TILES_HIGH_ZOOMS)
+        return coverage
+
+    @timed
     def sync_global_tiles(self):
         """ Creates a tiles file on the global extent.
         """
@@ -132,11 +520,11 @@ class Command(BaseCommand):
         def close_zip(zipfile):
             return self.close_zip(zipfile, zipname)
 
-        tiles = ZipTilesBuilder(global_file, close_zip, **self.builder_args)
-        tiles.add_coverage(bbox=global_extent,
-                           zoomlevels=settings.MOBILE_TILES_GLOBAL_ZOOMS)
+        tiles = ZipTilesBuilder(global_file, close_zip, self.tiles_store)
+        tiles.coverage = self.tiles_coverages.get('global') or self.global_tiles_coverage()
         tiles.run()
 
+    @timed
     def sync_trek_tiles(self, trek):
         """ Creates a tiles file for the specified Trek object.
         """
@@ -148,36 +536,20 @@ class Command(BaseCommand):
 
         trek_file = os.path.join(self.tmp_root, zipname)
 
-        def _radius2bbox(lng, lat, radius):
-            return (lng - radius, lat - radius,
-                    lng + radius, lat + radius)
-
         self.mkdirs(trek_file)
 
         def close_zip(zipfile):
             return self.close_zip(zipfile, zipname)
 
-        tiles = ZipTilesBuilder(trek_file, close_zip, **self.builder_args)
-
-        geom = trek.geom
-        if geom.geom_type == 'MultiLineString':
-            geom = geom[0]  # FIXME
-        geom.transform(4326)
-
-        for (lng, lat) in geom.coords:
-            large = _radius2bbox(lng, lat, settings.MOBILE_TILES_RADIUS_LARGE)
-            small = _radius2bbox(lng, lat, settings.MOBILE_TILES_RADIUS_SMALL)
-            tiles.add_coverage(bbox=large, zoomlevels=settings.MOBILE_TILES_LOW_ZOOMS)
-            tiles.add_coverage(bbox=small, zoomlevels=settings.MOBILE_TILES_HIGH_ZOOMS)
-
+        tiles = ZipTilesBuilder(trek_file, close_zip, self.tiles_store)
+        tiles.coverage = self.tiles_coverages.get(trek.pk) or self.trek_tiles_coverage(trek)
         tiles.run()
 
+    @timed
     def sync_view(self, lang, view, name, url='/', params={}, zipfile=None, **kwargs):
         if self.verbosity == 2:
             self.stdout.write(u"\x1b[36m{lang}\x1b[0m \x1b[1m{name}\x1b[0m ...".format(lang=lang, name=name), ending="")
             self.stdout.flush()
-        fullname = os.path.join(self.tmp_root, name)
-        self.mkdirs(fullname)
         request = self.factory.get(url, params, HTTP_HOST=self.host)
         request.LANGUAGE_CODE = lang
         request.user = AnonymousUser()
@@ -195,29 +567,113 @@ class Command(BaseCommand):
             if self.verbosity == 2:
                 self.stdout.write(u"\x1b[3D\x1b[31;1mfailed (HTTP {code})\x1b[0m".format(code=response.status_code))
             return
-        f = open(fullname, 'w')
         if isinstance(response, StreamingHttpResponse):
             content = b''.join(response.streaming_content)
         else:
             content = response.content
-        f.write(content)
-        f.close()
-        if zipfile:
-            zipfile.write(fullname, name)
+        self.write_output(name, content, zipfile)
+        if self.verbosity == 2:
+            self.stdout.write(u"\x1b[3D\x1b[32mgenerated\x1b[0m")
+
+    @timed
+    def sync_viewset(self, lang, viewset, name, params={}, zipfile=None, **kwargs):
+        """ Like ``sync_view()`` for the list action of a viewset, but serializes
+        the queryset directly when the viewset allows it (see ``serialize_list()``).
+        """
+        if not self.is_serializable(viewset):
+            view = viewset.as_view({'get': 'list'})
+            return self.sync_view(lang, view, name, params=params, zipfile=zipfile, **kwargs)
+        if self.verbosity == 2:
+            self.stdout.write(u"\x1b[36m{lang}\x1b[0m \x1b[1m{name}\x1b[0m ...".format(lang=lang, name=name), ending="")
+            self.stdout.flush()
+        try:
+            content = self.serialize_list(lang, viewset, params, **kwargs)
+        except Http404:
+            self.successfull = False
+            if self.verbosity == 2:
+                self.stdout.write(u"\x1b[3D\x1b[31;1mfailed (HTTP 404)\x1b[0m")
+            return
+        except Exception as e:
+            self.successfull = False
+            if self.verbosity == 2:
+                self.stdout.write(u"\x1b[3D\x1b[31mfailed ({})\x1b[0m".format(e))
+            return
+        self.write_output(name, content, zipfile)
         if self.verbosity == 2:
             self.stdout.write(u"\x1b[3D\x1b[32mgenerated\x1b[0m")
 
+    def is_serializable(self, viewset):
+        """ Viewsets with the default, unpaginated, list action.
+        """
+        default_list = viewset.list.__func__ is ListModelMixin.list.__func__
+        return default_list and viewset.pagination_class is None
+
+    def serialize_list(self, lang, viewset, params={}, **kwargs):
+        """ Render the list of a viewset as ``ListModelMixin.list()`` does, without
+        going through the view dispatch and the response. Output is the same.
+        """
+        request = self.factory.get('/', params, HTTP_HOST=self.host)
+        request.LANGUAGE_CODE = lang
+        request.user = AnonymousUser()
+        view = viewset(action='list', action_map={'get': 'list'})
+        view.args = ()
+        view.kwargs = kwargs
+        view.request = view.initialize_request(request, **kwargs)
+        view.format_kwarg = view.get_format_suffix(**kwargs)
+        view.request.version, view.request.versioning_scheme = view.determine_version(view.request, **kwargs)
+        renderer, media_type = view.perform_content_negotiation(view.request)
+        view.request.accepted_renderer, view.request.accepted_media_type = renderer, media_type
+        queryset = view.filter_queryset(view.get_queryset())
+        serializer = view.get_serializer(queryset, many=True)
+        content = renderer.render(serializer.data, media_type, view.get_renderer_context())
+        if isinstance(content, unicode):
+            content = content.encode(renderer.charset or settings.DEFAULT_CHARSET)
+        return content
+
+    def write_output(self, name, content, zipfile=None):
+        """ Write content to the destination file, and to the zip file if any,
+        without reading it back.
+        """
+        fullname = os.path.join(self.tmp_root, name)
+        self.mkdirs(fullname)
+        # Write then rename, so that a file hard linked from previous sync or
+        # media (see ``--incremental`` and ``--link-media``) is never modified,
+        # and pool workers never write the same file at once.
+        tmpname = '{name}.{pid}'.format(name=fullname, pid=os.getpid())
+        with open(tmpname, 'wb') as f:
+            f.write(content)
+        os.rename(tmpname, fullname)
+        self.outputs.append(name)
+        self.report.add_file(name, len(content))
+        if zipfile:
+            self.zip_writestr(zipfile, fullname, name, content)
+
+    def zip_writestr(self, zipfile, fullname, name, content):
+        """ Same zip entry as ``zipfile.write(fullname, name)``, from content.
+        """
+        if isinstance(zipfile, ZipRecorder):
+            zipfile.write(fullname, name)
+            return
+        st = os.stat(fullname)
+        zinfo = ZipInfo(name, time.localtime(st.st_mtime)[0:6])
+        zinfo.external_attr = (st.st_mode & 0xFFFF) << 16L
+        zipfile.writestr(zinfo, content)
+
+    @timed
     def sync_json(self, lang, viewset, name, zipfile=None, params={}, as_view_args=[], **kwargs):
-        view = viewset.as_view(*as_view_args)
         name = os.path.join('api', lang, '{name}.json'.format(name=name))
         if self.source:
             params['source'] = ','.join(self.source)
         if self.portal:
             params['portal'] = ','.join(self.portal)
-        self.sync_view(lang, view, name, params=params, zipfile=zipfile, **kwargs)
+        if as_view_args == [{'get': 'list'}]:
+            self.sync_viewset(lang, viewset, name, params=params, zipfile=zipfile, **kwargs)
+        else:
+            view = viewset.as_view(*as_view_args)
+            self.sync_view(lang, view, name, params=params, zipfile=zipfile, **kwargs)
 
+    @timed
     def sync_geojson(self, lang, viewset, name, zipfile=None, params={}, **kwargs):
-        view = viewset.as_view({'get': 'list'})
         name = os.path.join('api', lang, name)
         params.update({'format': 'geojson'})
 
@@ -234,96 +690,181 @@ class Command(BaseCommand):
         elif 'portal' in params.keys():
             del params['portal']
 
-        self.sync_view(lang, view, name, params=params, zipfile=zipfile, **kwargs)
+        self.sync_viewset(lang, viewset, name, params=params, zipfile=zipfile, **kwargs)
 
+    @timed
     def sync_trek_pois(self, lang, trek, zipfile=None):
         params = {'format': 'geojson'}
+        name = os.path.join('api', lang, 'treks', str(trek.pk), 'pois.geojson')
         if settings.ZIP_TOURISTIC_CONTENTS_AS_POI:
-            view = tourism_views.TrekTouristicContentAndPOIViewSet.as_view({'get': 'list'})
-            name = os.path.join('api', lang, 'treks', str(trek.pk), 'pois.geojson')
-            self.sync_view(lang, view, name, params=params, zipfile=zipfile, pk=trek.pk)
-            view = TrekPOIViewSet.as_view({'get': 'list'})
-            self.sync_view(lang, view, name, params=params, zipfile=None, pk=trek.pk)
+            self.sync_viewset(lang, tourism_views.TrekTouristicContentAndPOIViewSet, name, params=params,
+                              zipfile=zipfile, pk=trek.pk)
+            self.sync_viewset(lang, TrekPOIViewSet, name, params=params, zipfile=None, pk=trek.pk)
         else:
-            view = TrekPOIViewSet.as_view({'get': 'list'})
-            name = os.path.join('api', lang, 'treks', str(trek.pk), 'pois.geojson')
-            self.sync_view(lang, view, name, params=params, zipfile=zipfile, pk=trek.pk)
+            self.sync_viewset(lang, TrekPOIViewSet, name, params=params, zipfile=zipfile, pk=trek.pk)
 
+    @timed
     def sync_trek_services(self, lang, trek, zipfile=None):
-        view = TrekServiceViewSet.as_view({'get': 'list'})
         name = os.path.join('api', lang, 'treks', str(trek.pk), 'services.geojson')
-        self.sync_view(lang, view, name, params={'format': 'geojson'}, zipfile=zipfile, pk=trek.pk)
+        self.sync_viewset(lang, TrekServiceViewSet, name, params={'format': 'geojson'}, zipfile=zipfile, pk=trek.pk)
 
+    @timed
     def sync_object_view(self, lang, obj, view, basename_fmt, zipfile=None, params={}, **kwargs):
         modelname = obj._meta.model_name
         name = os.path.join('api', lang, '{modelname}s'.format(modelname=modelname), str(obj.pk), basename_fmt.format(obj=obj))
         self.sync_view(lang, view, name, params=params, zipfile=zipfile, pk=obj.pk, **kwargs)
 
-    def sync_trek_pdf(self, lang, obj):
-        if self.skip_pdf:
-            return
-        view = TrekDocumentPublic.as_view(model=type(obj))
+    def get_document_view(self, obj):
+        """ Public document view and query parameters of object
+        """
         params = {}
         if self.source:
             params['source'] = self.source[0]
+        if isinstance(obj, tourism_models.TouristicContent):
+            return tourism_views.TouristicContentDocumentPublic, params
+        if isinstance(obj, tourism_models.TouristicEvent):
+            if self.portal:
+                params['portal'] = self.portal[0]
+            return tourism_views.TouristicEventDocumentPublic, params
         if self.portal:
             params['portal'] = ','.join(self.portal)
+        return TrekDocumentPublic, params
+
+    def is_document_up_to_date(self, lang, obj):
+        view_class, params = self.get_document_view(obj)
+        view = view_class(model=type(obj))
+        view.request = self.factory.get('/', params, HTTP_HOST=self.host)
+        view.request.LANGUAGE_CODE = lang
+        view.kwargs = {'pk': obj.pk}
+        return view.is_document_up_to_date(obj)
+
+    @timed
+    def sync_document(self, lang, obj):
+        if self.skip_pdf:
+            return
+        view_class, params = self.get_document_view(obj)
+        view = view_class.as_view(model=type(obj))
         self.sync_object_view(lang, obj, view, '{obj.slug}.pdf', params=params)
 
+    def render_documents(self, lang, objects):
+        """ Render stale documents on the pool of processes (``--jobs``), before
+        syncing objects. Rendered documents are cached in MEDIA_ROOT (see
+        ``DocumentPublic``), thus only copied by ``sync_document()`` afterwards.
+        """
+        if self.skip_pdf or self.jobs <= 1:
+            return
+        stale = [obj for obj in objects if not self.is_document_up_to_date(lang, obj)]
+        self.sync_objects('sync_document', stale, lang)
+
+    @timed
     def sync_profile_json(self, lang, obj, zipfile=None):
         view = ElevationProfile.as_view(model=type(obj))
         self.sync_object_view(lang, obj, view, 'profile.json', zipfile=zipfile)
 
+    @timed
     def sync_profile_png(self, lang, obj, zipfile=None):
         view = serve_elevation_chart
         model_name = type(obj)._meta.model_name
         self.sync_object_view(lang, obj, view, 'profile.png', zipfile=zipfile, model_name=model_name, from_command=True)
 
+    @timed
     def sync_dem(self, lang, obj):
         if self.skip_dem:
             return
         view = ElevationArea.as_view(model=type(obj))
         self.sync_object_view(lang, obj, view, 'dem.json')
 
+    @timed
     def sync_gpx(self, lang, obj):
         self.sync_object_view(lang, obj, TrekGPXDetail.as_view(), '{obj.slug}.gpx')
 
+    @timed
     def sync_kml(self, lang, obj):
         self.sync_object_view(lang, obj, TrekKMLDetail.as_view(), '{obj.slug}.kml')
 
+    @timed
     def sync_file(self, lang, name, src_root, url, zipfile=None):
         url = url.strip('/')
         src = os.path.join(src_root, name)
-        dst = os.path.join(self.tmp_root, url, name)
-        self.mkdirs(dst)
-        shutil.copyfile(src, dst)
-        if zipfile:
-            zipfile.write(dst, os.path.join(url, name))
+        name = os.path.join(url, name)
+        dst = os.path.join(self.tmp_root, name)
+        # Files do not depend on language, and are often shared (pictograms, POIs pictures...)
+        if name in self.synced_files:
+            self.outputs.append(name)
+            if zipfile:
+                zipfile.write(dst, name)
+            return
+        self.synced_files.add(name)
+        if self.link_media:
+            self.link_file(src, name)
+            if zipfile:
+                zipfile.write(dst, name)
+            status = u"linked"
+        else:
+            with open(src, 'rb') as f:
+                content = f.read()
+            self.write_output(name, content, zipfile)
+            status = u"copied"
         if self.verbosity == 2:
-            self.stdout.write(u"\x1b[36m{lang}\x1b[0m \x1b[1m{url}/{name}\x1b[0m \x1b[32mcopied\x1b[0m".format(lang=lang, url=url, name=name))
+            self.stdout.write(u"\x1b[36m{lang}\x1b[0m \x1b[1m{name}\x1b[0m \x1b[32m{status}\x1b[0m".format(
+                lang=lang, name=name, status=status))
 
+    def link_file(self, src, name):
+        """ Hard link source file, or the identical file of previous sync if
+        source is on another file system. Otherwise reflink or copy it.
+        """
+        dst = os.path.join(self.tmp_root, name)
+        previous = os.path.join(self.dst_root, name)
+        self.mkdirs(dst)
+        # Link then rename, so that dst is replaced atomically
+        tmp = '{dst}.{pid}'.format(dst=dst, pid=os.getpid())
+        try:
+            os.link(src, tmp)
+        except OSError:
+            src_stat = os.stat(src)
+            try:
+                previous_stat = os.stat(previous)
+            except OSError:
+                previous_stat = None
+            # Copies keep source modification time, see below
+            unchanged = previous_stat and (previous_stat.st_size, previous_stat.st_mtime) == (src_stat.st_size, src_stat.st_mtime)
+            if unchanged:
+                os.link(previous, tmp)
+            else:
+                if not reflink(src, tmp):
+                    shutil.copyfile(src, tmp)
+                shutil.copystat(src, tmp)
+        os.rename(tmp, dst)
+        self.outputs.append(name)
+        self.report.add_file(name, os.path.getsize(dst))
+
+    @timed
     def sync_static_file(self, lang, name):
         self.sync_file(lang, name, settings.STATIC_ROOT, settings.STATIC_URL)
 
+    @timed
     def sync_media_file(self, lang, field, zipfile=None):
         if field and field.name:
             self.sync_file(lang, field.name, settings.MEDIA_ROOT, settings.MEDIA_URL, zipfile=zipfile)
 
+    @timed
     def sync_pictograms(self, lang, model, zipfile=None):
         for obj in model.objects.all():
             self.sync_media_file(lang, obj.pictogram, zipfile=zipfile)
 
+    @timed
     def sync_poi_media(self, lang, poi):
         if poi.resized_pictures:
             self.sync_media_file(lang, poi.resized_pictures[0][1], zipfile=self.trek_zipfile)
         for picture, resized in poi.resized_pictures[1:]:
             self.sync_media_file(lang, resized)
 
+    @timed
     def sync_trek(self, lang, trek):
         zipname = os.path.join('zip', 'treks', lang, '{pk}.zip'.format(pk=trek.pk))
         zipfullname = os.path.join(self.tmp_root, zipname)
         self.mkdirs(zipfullname)
-        self.trek_zipfile = ZipFile(zipfullname, 'w')
+        self.trek_zipfile = SyncZipFile(zipfullname, 'w')
 
         self.sync_json(lang, ParametersView, 'parameters', zipfile=self.zipfile)
         self.sync_json(lang, ThemeViewSet, 'themes', as_view_args=[{'get': 'list'}], zipfile=self.zipfile)
@@ -331,7 +872,7 @@ class Command(BaseCommand):
         self.sync_trek_services(lang, trek, zipfile=self.zipfile)
         self.sync_gpx(lang, trek)
         self.sync_kml(lang, trek)
-        self.sync_trek_pdf(lang, trek)
+        self.sync_document(lang, trek)
         self.sync_profile_json(lang, trek)
         if not self.skip_profile_png:
             self.sync_profile_png(lang, trek, zipfile=self.zipfile)
@@ -359,6 +900,7 @@ class Command(BaseCommand):
                               ending="")
 
         self.close_zip(self.trek_zipfile, zipname)
+        self.outputs.append(zipname)
 
     def close_zip(self, zipfile, name):
         oldzipfilename = os.path.join(self.dst_root, name)
@@ -378,17 +920,21 @@ class Command(BaseCommand):
             stat = os.stat(oldzipfilename)
             os.utime(zipfilename, (stat.st_atime, stat.st_mtime))
 
+        logger.info("%s: %d bytes zipped into %d bytes" % (name, zipfile.bytes_in, zipfile.bytes_out))
+        self.report.add_file(name, os.path.getsize(zipfilename))
         if self.verbosity == 2:
             if uptodate:
                 self.stdout.write(u"\x1b[3D\x1b[32munchanged\x1b[0m")
             else:
-                self.stdout.write(u"\x1b[3D\x1b[32mzipped\x1b[0m")
+                self.stdout.write(u"\x1b[3D\x1b[32mzipped\x1b[0m ({bytes_in} -> {bytes_out} bytes)".format(
+                    bytes_in=zipfile.bytes_in, bytes_out=zipfile.bytes_out))
 
+    @timed
     def sync_trekking(self, lang):
         zipname = os.path.join('zip', 'treks', lang, 'global.zip')
         zipfullname = os.path.join(self.tmp_root, zipname)
         self.mkdirs(zipfullname)
-        self.zipfile = ZipFile(zipfullname, 'w')
+        self.zipfile = SyncZipFile(zipfullname, 'w')
 
         self.sync_geojson(lang, TrekViewSet, 'treks.geojson', zipfile=self.zipfile)
         self.sync_geojson(lang, POIViewSet, 'pois.geojson')
@@ -411,6 +957,12 @@ class Command(BaseCommand):
         if settings.ZIP_TOURISTIC_CONTENTS_AS_POI:
             self.sync_pictograms('**', tourism_models.TouristicContentCategory, zipfile=self.zipfile)
 
+        if self.incremental:
+            # Files shared by all treks, generated first so that they are not
+            # reused from previous sync along unchanged treks
+            self.sync_json(lang, ParametersView, 'parameters')
+            self.sync_json(lang, ThemeViewSet, 'themes', as_view_args=[{'get': 'list'}])
+
         treks = trekking_models.Trek.objects.existing().order_by('pk')
         treks = treks.filter(
             Q(**{'published_{lang}'.format(lang=lang): True}) |
@@ -423,8 +975,8 @@ class Command(BaseCommand):
         if self.portal:
             treks = treks.filter(portal__name__in=self.portal)
 
-        for trek in treks:
-            self.sync_trek(lang, trek)
+        self.render_documents(lang, treks)
+        self.sync_objects('sync_trek', treks, lang)
 
         self.sync_tourism(lang)
 
@@ -433,32 +985,11 @@ class Command(BaseCommand):
 
         self.close_zip(self.zipfile, zipname)
 
+    @timed
     def sync_tiles(self):
         if not self.skip_tiles:
 
-            if self.celery_task:
-                self.celery_task.update_state(
-                    state='PROGRESS',
-                    meta={
-                        'name': self.celery_task.name,
-                        'current': 10,
-                        'total': 100,
-                        'infos': u"{}".format(_(u"Global tiles syncing ..."))
-                    }
-                )
-
-            self.sync_global_tiles()
-
-            if self.celery_task:
-                self.celery_task.update_state(
-                    state='PROGRESS',
-                    meta={
-                        'name': self.celery_task.name,
-                        'current': 20,
-                        'total': 100,
-                        'infos': u"{}".format(_(u"Trek tiles syncing ..."))
-                    }
-                )
+            self.set_progress(10, 20, _(u"Global tiles syncing ..."))
 
             treks = trekking_models.Trek.objects.existing().order_by('pk')
             if self.source:
@@ -467,46 +998,49 @@ class Command(BaseCommand):
             if self.portal:
                 treks = treks.filter(portal__name__in=self.portal)
 
+            treks = [trek for trek in treks
+                     if trek.any_published or any([parent.any_published for parent in trek.parents])]
+
+            # Merge coverages of all zip files, so that each tile is downloaded only once
+            coverage = TilesCoverage(self.tiles_store)
+            if 'sync_global_tiles' not in self.journal:
+                self.tiles_coverages['global'] = self.global_tiles_coverage()
+                coverage.update(self.tiles_coverages['global'])
             for trek in treks:
-                if trek.any_published or any([parent.any_published for parent in trek.parents]):
-                    self.sync_trek_tiles(trek)
-
-            if self.celery_task:
-                self.celery_task.update_state(
-                    state='PROGRESS',
-                    meta={
-                        'name': self.celery_task.name,
-                        'current': 30,
-                        'total': 100,
-                        'infos': u"{}".format(_(u"Tiles synced ..."))
-                    }
-                )
+                if self.unit_key('sync_trek_tiles', None, trek) in self.journal:
+                    continue
+                if trek.pk not in self.tiles_coverages:
+                    self.tiles_coverages[trek.pk] = self.trek_tiles_coverage(trek)
+                    coverage.update(self.tiles_coverages[trek.pk])
+            logger.info("Fetch %d tiles..." % len(coverage))
+            with self.report.timer('fetch_tiles'):
+                self.tiles_store.fetch(coverage, progress=self.update_progress)
 
-    def sync_content(self, lang, content):
-        if not self.skip_pdf:
-            params = {}
-            if self.source:
-                params['source'] = self.source[0]
+            if 'sync_global_tiles' not in self.journal:
+                self.sync_global_tiles()
+                self.add_journal('sync_global_tiles')
+
+            self.set_progress(20, 30, _(u"Trek tiles syncing ..."))
+
+            self.sync_objects('sync_trek_tiles', treks)
+
+            self.set_progress(30, 30, _(u"Tiles synced ..."))
 
-            view = tourism_views.TouristicContentDocumentPublic.as_view(model=type(content))
-            self.sync_object_view(lang, content, view, '{obj.slug}.pdf', params=params)
+    @timed
+    def sync_content(self, lang, content):
+        self.sync_document(lang, content)
 
         for picture, resized in content.resized_pictures:
             self.sync_media_file(lang, resized)
 
+    @timed
     def sync_event(self, lang, event):
-        if not self.skip_pdf:
-            params = {}
-            if self.source:
-                params['source'] = self.source[0]
-            if self.portal:
-                params['portal'] = self.portal[0]
-            view = tourism_views.TouristicEventDocumentPublic.as_view(model=type(event))
-            self.sync_object_view(lang, event, view, '{obj.slug}.pdf', params=params)
+        self.sync_document(lang, event)
 
         for picture, resized in event.resized_pictures:
             self.sync_media_file(lang, resized)
 
+    @timed
     def sync_tourism(self, lang):
         self.sync_geojson(lang, tourism_views.TouristicContentViewSet, 'touristiccontents.geojson')
         self.sync_geojson(lang, tourism_views.TouristicEventViewSet, 'touristicevents.geojson',
@@ -545,8 +1079,8 @@ class Command(BaseCommand):
         if self.portal:
             contents = contents.filter(portal__name__in=self.portal)
 
-        for content in contents:
-            self.sync_content(lang, content)
+        self.render_documents(lang, contents)
+        self.sync_objects('sync_content', contents, lang)
 
         events = tourism_models.TouristicEvent.objects.existing().order_by('pk')
         events = events.filter(**{'published_{lang}'.format(lang=lang): True})
@@ -557,8 +1091,8 @@ class Command(BaseCommand):
         if self.portal:
             events = events.filter(portal__name__in=self.portal)
 
-        for event in events:
-            self.sync_event(lang, event)
+        self.render_documents(lang, events)
+        self.sync_objects('sync_event', events, lang)
 
         # Information desks
         self.sync_geojson(lang, tourism_views.InformationDeskViewSet, 'information_desks.geojson')
@@ -568,58 +1102,318 @@ class Command(BaseCommand):
         for desk in tourism_models.InformationDesk.objects.all():
             self.sync_media_file(lang, desk.thumbnail)
 
+    @timed
     def sync_trek_touristiccontents(self, lang, trek, zipfile=None):
         params = {'format': 'geojson',
                   'categories': ','.join(category for category in self.categories),
                   'portal': ','.join(portal for portal in self.portal)}
 
-        view = tourism_views.TrekTouristicContentViewSet.as_view({'get': 'list'})
         name = os.path.join('api', lang, 'treks', str(trek.pk), 'touristiccontents.geojson')
-        self.sync_view(lang, view, name, params=params, zipfile=zipfile, pk=trek.pk)
+        self.sync_viewset(lang, tourism_views.TrekTouristicContentViewSet, name, params=params,
+                          zipfile=zipfile, pk=trek.pk)
 
         for content in trek.touristic_contents.all():
             self.sync_touristiccontent_media(lang, content, zipfile=self.trek_zipfile)
 
+    @timed
     def sync_trek_touristicevents(self, lang, trek, zipfile=None):
         params = {'format': 'geojson',
                   'portal': ','.join(portal for portal in self.portal)}
-        view = tourism_views.TrekTouristicEventViewSet.as_view({'get': 'list'})
         name = os.path.join('api', lang, 'treks', str(trek.pk), 'touristicevents.geojson')
-        self.sync_view(lang, view, name, params=params, zipfile=zipfile, pk=trek.pk)
+        self.sync_viewset(lang, tourism_views.TrekTouristicEventViewSet, name, params=params,
+                          zipfile=zipfile, pk=trek.pk)
 
         for event in trek.touristic_events.all():
             self.sync_touristicevent_media(lang, event, zipfile=self.trek_zipfile)
 
+    @timed
     def sync_touristicevent_media(self, lang, event, zipfile=None):
         if event.resized_pictures:
             self.sync_media_file(lang, event.resized_pictures[0][1], zipfile=zipfile)
         for picture, resized in event.resized_pictures[1:]:
             self.sync_media_file(lang, resized)
 
+    @timed
     def sync_touristiccontent_media(self, lang, content, zipfile=None):
         if content.resized_pictures:
             self.sync_media_file(lang, content.resized_pictures[0][1], zipfile=zipfile)
         for picture, resized in content.resized_pictures[1:]:
             self.sync_media_file(lang, resized)
 
+    def get_dependencies(self, obj):
+        """ Values that the sync outputs of object depend on (see ``--incremental``).
+        """
+        dependencies = [obj.date_update, list(obj.attachments.values_list())]
+        if isinstance(obj, trekking_models.Trek):
+            for poi in obj.published_pois:
+                dependencies += [poi.pk, poi.date_update, list(poi.attachments.values_list())]
+            dependencies += [(service.pk, service.date_update) for service in obj.published_services]
+            dependencies += [(trek.pk, trek.date_update) for trek in list(obj.parents) + list(obj.children)]
+            dependencies.append(list(obj.information_desks.values_list()))
+            if settings.ZIP_TOURISTIC_CONTENTS_AS_POI or self.categories:
+                for content in obj.published_touristic_contents:
+                    dependencies += [content.pk, content.date_update, list(content.attachments.values_list())]
+            if self.with_events:
+                for event in obj.published_touristic_events:
+                    dependencies += [event.pk, event.date_update, list(event.attachments.values_list())]
+        return dependencies
+
+    def get_global_dependencies(self):
+        """ Values that the sync outputs of all objects depend on (see ``--incremental``):
+        shared models with pictograms (themes, practices, types...) and the DEM.
+        """
+        dependencies = []
+        for model in sorted(apps.get_models(), key=lambda model: model._meta.db_table):
+            if issubclass(model, PictogramMixin):
+                dependencies.append(list(model.objects.order_by('pk').values_list()))
+        if not self.skip_dem:
+            # The DEM table is created again by each ``loaddem``
+            cursor = connections[DEFAULT_DB_ALIAS].cursor()
+            cursor.execute("SELECT oid FROM pg_class WHERE relname = 'mnt'")
+            dependencies.append(cursor.fetchall())
+            if settings.ALTIMETRIC_DEM_ROOT:
+                try:
+                    dependencies.append(os.path.getmtime(os.path.join(settings.ALTIMETRIC_DEM_ROOT, DEM_META_FILENAME)))
+                except OSError:
+                    dependencies.append(None)
+        return dependencies
+
+    def get_signature(self, values):
+        return hashlib.sha1(json.dumps(values, default=unicode)).hexdigest()
+
+    def load_manifest(self):
+        """ The manifest records, for each synced object, a signature of its
+        dependencies, its output files and its entries in the global zip file.
+        """
+        options = [__version__, self.referer, self.source, self.portal, self.skip_pdf, self.skip_dem,
+                   self.skip_profile_png, self.with_events, self.categories,
+                   settings.ZIP_TOURISTIC_CONTENTS_AS_POI, settings.TREK_WITH_POIS_PICTURES,
+                   self.get_global_dependencies()]
+        self.manifest = {'options': self.get_signature(options), 'units': {}}
+        self.previous_units = {}
+        if not self.incremental:
+            return
+        try:
+            with open(os.path.join(self.dst_root, self.manifest_name), 'r') as f:
+                previous = json.load(f)
+        except (IOError, ValueError):
+            logger.info("No previous sync manifest, sync all objects.")
+            return
+        if previous.get('options') != self.manifest['options']:
+            logger.info("Sync options or shared data changed since previous sync, sync all objects.")
+            return
+        self.previous_units = previous['units']
+
+    def save_manifest(self):
+        if not self.incremental:
+            return
+        with open(os.path.join(self.tmp_root, self.manifest_name), 'w') as f:
+            json.dump(self.manifest, f)
+
+    def load_journal(self):
+        """ The journal, in the temporary directory, records each object synced
+        (one JSON line per unit), so that an interrupted sync can be resumed.
+        """
+        self.journal = {}
+        filename = os.path.join(self.tmp_root, self.journal_name)
+        if self.resume and os.path.exists(filename):
+            with open(filename, 'r') as f:
+                lines = f.read().splitlines()
+            if lines and json.loads(lines[0]).get('options') == self.manifest['options']:
+                for line in lines[1:]:
+                    try:
+                        unit = json.loads(line)
+                    except ValueError:  # Truncated by the interruption
+                        break
+                    self.journal[unit['key']] = unit
+                logger.info("Resume sync, %d objects already synced." % len(self.journal))
+            else:
+                logger.warning("Sync options changed, cannot resume previous sync.")
+                shutil.rmtree(self.tmp_root)
+                os.mkdir(self.tmp_root)
+        self.journal_file = open(filename, 'w')
+        self.journal_file.write(json.dumps({'options': self.manifest['options']}) + '\n')
+        for unit in self.journal.values():
+            self.journal_file.write(json.dumps(unit) + '\n')
+        self.journal_file.flush()
+
+    def add_journal(self, key, signature=None, outputs=[], entries=[]):
+        unit = {'key': key, 'signature': signature, 'outputs': outputs, 'entries': entries}
+        self.journal_file.write(json.dumps(unit) + '\n')
+        self.journal_file.flush()
+
+    def reuse_outputs(self, outputs):
+        """ Hard link (or copy if not possible) output files of previous sync.
+        Files already generated by this sync are kept.
+        """
+        if not all([os.path.exists(os.path.join(self.dst_root, name)) for name in outputs]):
+            return False
+        for name in outputs:
+            src = os.path.join(self.dst_root, name)
+            dst = os.path.join(self.tmp_root, name)
+            if os.path.exists(dst):
+                continue
+            self.mkdirs(dst)
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+        return True
+
+    @timed
+    def sync_unit(self, method, lang, obj):
+        """ Call the per-object sync method on object.
+        Returns its global zip entries, output files, success status and report.
+        """
+        state = getattr(self, 'zipfile', None), self.outputs, self.successfull, self.report
+        self.zipfile, self.outputs, self.successfull, self.report = ZipRecorder(), [], True, SyncReport()
+        try:
+            start = time.time()
+            if lang is None:
+                getattr(self, method)(obj)
+            else:
+                getattr(self, method)(lang, obj)
+            self.report.add_object(self.unit_key(method, lang, obj), time.time() - start)
+            entries = [(os.path.relpath(filename, self.tmp_root), arcname)
+                       for filename, arcname in self.zipfile.entries]
+            return entries, self.outputs, self.successfull, self.report
+        finally:
+            self.zipfile, self.outputs, self.successfull, self.report = state
+
+    def unit_key(self, method, lang, obj):
+        return u"{method}:{lang}:{model}:{pk}".format(method=method, lang=lang or '**',
+                                                      model=obj._meta.model_name, pk=obj.pk)
+
+    def run_units(self, method, lang, objects):
+        """ Yield results of ``sync_unit()`` for each object, in objects order.
+        If several jobs were requested, objects are spread among a pool of processes.
+        """
+        if self.jobs <= 1 or len(objects) <= 1:
+            for obj in objects:
+                yield self.sync_unit(method, lang, obj)
+            return
+
+        tasks = [(method, lang, type(obj), obj.pk) for obj in objects]
+        # Workers must not share the database connection of this process
+        for connection in connections.all():
+            connection.close()
+        pool = Pool(min(self.jobs, len(tasks)), initializer=init_sync_worker, initargs=(self, ))
+        try:
+            # imap() preserves tasks order, thus global zip file content is deterministic
+            for result in pool.imap(sync_worker, tasks):
+                yield result
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    @timed
+    def sync_objects(self, method, objects, lang=None):
+        """ Call the per-object sync method on each object.
+        Objects unchanged since previous sync are not synced again (``--incremental``),
+        others can be spread among a pool of processes (``--jobs``).
+        """
+        # Querysets may return duplicates (e.g. treks with several parents)
+        pks = set()
+        units = []
+        stale = []
+        for obj in objects:
+            if obj.pk in pks:
+                continue
+            pks.add(obj.pk)
+            key = self.unit_key(method, lang, obj)
+            signature = None
+            if method in self.incremental_methods:
+                signature = self.get_signature(self.get_dependencies(obj))
+            if key in self.journal:
+                if self.journal[key]['signature'] == signature:
+                    # Synced before sync was interrupted, unchanged since
+                    units.append((key, signature, self.journal[key]))
+                    continue
+                del self.journal[key]
+            if self.incremental and signature:
+                previous = self.previous_units.get(key)
+                if previous and previous['signature'] == signature and self.reuse_outputs(previous['outputs']):
+                    units.append((key, signature, previous))
+                    continue
+            units.append((key, signature, None))
+            stale.append(obj)
+
+        results = self.run_units(method, lang, stale)
+        self.update_progress(0, len(units))
+        for i, (key, signature, previous) in enumerate(units):
+            if previous is None:
+                entries, outputs, successfull, report = next(results)
+                self.successfull = self.successfull and successfull
+                self.report.update(report)
+                self.synced_files.update(outputs)
+            else:
+                entries, outputs, successfull = previous['entries'], previous['outputs'], True
+                if self.verbosity == 2:
+                    self.stdout.write(u"\x1b[36m{lang}\x1b[0m \x1b[1m{key}\x1b[0m \x1b[32munchanged\x1b[0m".format(
+                        lang=lang or '**', key=key))
+            for filename, arcname in entries:
+                self.zipfile.write(os.path.join(self.tmp_root, filename), arcname)
+            if signature and successfull:
+                self.manifest['units'][key] = {
+                    'signature': signature,
+                    'outputs': outputs,
+                    'entries': entries,
+                }
+            if successfull and key not in self.journal:
+                self.add_journal(key, signature, outputs, entries)
+            self.update_progress(i + 1, len(units))
+        # Let the pool of workers terminate
+        for result in results:
+            pass
+
+    def set_progress(self, start, end, infos):
+        """ Set the range of global progress (in percents) covered by next steps.
+        """
+        self.progress = {'start': start, 'end': end, 'current': start, 'infos': infos, 'updated': 0}
+        self.update_progress(0, 0)
+
+    def update_progress(self, done, total):
+        """ Expose progress of current step in Celery task meta.
+        """
+        if not self.celery_task:
+            return
+        progress = self.progress
+        if total:
+            current = progress['start'] + (progress['end'] - progress['start']) * done / total
+            progress['current'] = max(progress['current'], current)
+            infos = u"{infos} ({done}/{total})".format(infos=progress['infos'], done=done, total=total)
+        else:
+            infos = progress['infos']
+        # Do not flood the result backend
+        if 0 < done < total and time.time() - progress['updated'] < 1:
+            return
+        progress['updated'] = time.time()
+        self.celery_task.update_state(
+            state='PROGRESS',
+            meta={
+                'name': self.celery_task.name,
+                'current': int(progress['current']),
+                'total': 100,
+                'infos': infos,
+                'stage': progress['infos'],
+                'stage_current': done,
+                'stage_total': total,
+            }
+        )
+
+    @timed
     def sync(self):
         self.sync_tiles()
 
-        step_value = int(50 / len(settings.MODELTRANSLATION_LANGUAGES))
+        step_value = 50.0 / len(self.languages)
         current_value = 30
 
         for lang in self.languages:
-            if self.celery_task:
-                self.celery_task.update_state(
-                    state='PROGRESS',
-                    meta={
-                        'name': self.celery_task.name,
-                        'current': current_value + step_value,
-                        'total': 100,
-                        'infos': u"{} : {} ...".format(_(u"Language"), lang)
-                    }
-                )
-                current_value = current_value + step_value
+            self.set_progress(current_value, current_value + step_value, u"{} : {} ...".format(_(u"Language"), lang))
+            current_value = current_value + step_value
 
             translation.activate(lang)
             self.sync_trekking(lang)
@@ -631,11 +1425,29 @@ class Command(BaseCommand):
         self.sync_pictograms('**', tourism_models.TouristicContentType)
         self.sync_pictograms('**', tourism_models.TouristicEventType)
 
+    def save_report(self, duration):
+        """ Write the sync report next to the destination directory.
+        """
+        report = self.report.as_dict()
+        report.update({
+            'date': timezone.now().isoformat(),
+            'time': duration,
+            'successfull': self.successfull,
+            'languages': self.languages,
+            'jobs': self.jobs,
+            'incremental': self.incremental,
+        })
+        filename = os.path.join(os.path.dirname(self.dst_root), 'sync_rando_report.json')
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        if self.verbosity == 2:
+            self.stdout.write(u"Report written to {filename}".format(filename=filename))
+
     def check_dst_root_is_empty(self):
         if not os.path.exists(self.dst_root):
             return
         existing = set([os.path.basename(p) for p in os.listdir(self.dst_root)])
-        remaining = existing - set(('api', 'media', 'static', 'zip'))
+        remaining = existing - set(('api', 'media', 'static', 'zip', self.manifest_name))
         if remaining:
             raise CommandError(u"Destination directory contains extra data")
 
@@ -649,6 +1461,7 @@ class Command(BaseCommand):
             os.rename(self.tmp_root, self.dst_root)
 
     def handle(self, *args, **options):
+        start = time.time()
         self.successfull = True
         self.verbosity = options.get('verbosity', 1)
         if len(args) < 1:
@@ -661,7 +1474,12 @@ class Command(BaseCommand):
         self.host = self.referer[7:]
         self.factory = RequestFactory()
         self.tmp_root = os.path.join(os.path.dirname(self.dst_root), 'tmp_sync_rando')
-        os.mkdir(self.tmp_root)
+        self.resume = options.get('resume', False)
+        if os.path.exists(self.tmp_root) and not self.resume:
+            # Left by an interrupted sync
+            shutil.rmtree(self.tmp_root)
+        if not os.path.exists(self.tmp_root):
+            os.mkdir(self.tmp_root)
         self.skip_pdf = options['skip_pdf']
         self.skip_tiles = options['skip_tiles']
         self.skip_dem = options['skip_dem']
@@ -676,6 +1494,20 @@ class Command(BaseCommand):
         if options.get('content_categories', u""):
             self.categories = options.get('content_categories', u"").split(',')
         self.celery_task = options.get('task', None)
+        self.set_progress(5, 10, _(u"Init sync ..."))
+        self.incremental = options.get('incremental', False)
+        self.outputs = []
+        self.report = SyncReport()
+        self.link_media = options.get('link_media', False)
+        # Shared files already synced. Pool workers inherit it when forked,
+        # and the parent adds to it the outputs of each unit they synced, so
+        # a file is synced at most once per worker of a pool, and never again
+        # by later steps.
+        self.synced_files = set()
+        self.jobs = int(options.get('jobs') or 1)
+        if self.jobs > 1 and current_process().daemon:
+            logger.warning("Daemonic processes are not allowed to have children, sync with a single job.")
+            self.jobs = 1
 
         if self.source is not None:
             self.source = self.source.split(',')
@@ -696,21 +1528,27 @@ class Command(BaseCommand):
             'ignore_errors': True,
             'tiles_dir': os.path.join(settings.DEPLOY_ROOT, 'var', 'tiles'),
         }
+        tiles_root = tempfile.mkdtemp(prefix='tmp_sync_rando_tiles', dir=os.path.dirname(self.dst_root))
+        self.tiles_store = TileStore(tiles_root, **self.builder_args)
+        self.tiles_coverages = {}
+        self.journal_file = None
         try:
+            self.load_manifest()
+            self.load_journal()
             self.sync()
-            if self.celery_task:
-                self.celery_task.update_state(
-                    state='PROGRESS',
-                    meta={
-                        'name': self.celery_task.name,
-                        'current': 100,
-                        'total': 100,
-                        'infos': u"{}".format(_(u"Sync ended"))
-                    }
-                )
+            self.save_manifest()
+            self.set_progress(100, 100, _(u"Sync ended"))
         except:
-            shutil.rmtree(self.tmp_root)
+            # Keep synced data, to be able to resume
+            logger.error("Sync failed, run sync_rando with --resume to resume it.")
             raise
+        finally:
+            if self.journal_file:
+                self.journal_file.close()
+            shutil.rmtree(tiles_root)
+            self.save_report(time.time() - start)
+
+        os.remove(os.path.join(self.tmp_root, self.journal_name))
 
         self.rename_root()
 
@@ -17,7 +17,7 @@ from geotrek.core.models import Path, Topology
 from geotrek.common.utils import intersecting, classproperty
 from geotrek.common.mixins import (PicturesMixin, PublishableMixin,
                                    PictogramMixin, OptionalPictogramMixin)
-from geotrek.common.models import Theme
+from geotrek.common.models import Theme, delete_all_documents_on_change
 from geotrek.maintenance.models import Intervention, Project
 from geotrek.tourism import models as tourism_models
 
@@ -385,12 +385,14 @@ class Trek(StructureRelated, PicturesMixin, PublishableMixin, MapEntityMixin, To
 
 
 Path.add_property('treks', Trek.path_treks, _(u"Treks"))
-Topology.add_property('treks', Trek.topology_treks, _(u"Treks"))
+Topology.add_property('treks', Trek.topology_treks, _(u"Treks"),
+                      prefetch=Topology.overlapping_prefetch(Trek.topology_treks) if settings.TREKKING_TOPOLOGY_ENABLED else None)
 if settings.HIDE_PUBLISHED_TREKS_IN_TOPOLOGIES:
     Topology.add_property('published_treks', lambda self: [], _(u"Published treks"))
 else:
     Topology.add_property('published_treks', lambda self: intersecting(Trek, self).filter(published=True), _(u"Published treks"))
-Intervention.add_property('treks', lambda self: self.topology.treks if self.topology else [], _(u"Treks"))
+Intervention.add_property('treks', lambda self: self.topology.treks if self.topology else [], _(u"Treks"),
+                          prefetch=Intervention.topology_prefetch('treks'))
 Project.add_property('treks', lambda self: self.edges_by_attr('treks'), _(u"Treks"))
 tourism_models.TouristicContent.add_property('treks', lambda self: intersecting(Trek, self), _(u"Treks"))
 tourism_models.TouristicContent.add_property('published_treks', lambda self: intersecting(Trek, self).filter(published=True), _(u"Published treks"))
@@ -673,9 +675,11 @@ class POI(StructureRelated, PicturesMixin, PublishableMixin, MapEntityMixin, Top
 
 
 Path.add_property('pois', POI.path_pois, _(u"POIs"))
-Topology.add_property('pois', POI.topology_pois, _(u"POIs"))
+Topology.add_property('pois', POI.topology_pois, _(u"POIs"),
+                      prefetch=Topology.overlapping_prefetch(POI.topology_pois) if settings.TREKKING_TOPOLOGY_ENABLED else None)
 Topology.add_property('published_pois', POI.published_topology_pois, _(u"Published POIs"))
-Intervention.add_property('pois', lambda self: self.topology.pois if self.topology else [], _(u"POIs"))
+Intervention.add_property('pois', lambda self: self.topology.pois if self.topology else [], _(u"POIs"),
+                          prefetch=Intervention.topology_prefetch('pois'))
 Project.add_property('pois', lambda self: self.edges_by_attr('pois'), _(u"POIs"))
 tourism_models.TouristicContent.add_property('pois', lambda self: intersecting(POI, self), _(u"POIs"))
 tourism_models.TouristicContent.add_property('published_pois', lambda self: intersecting(POI, self).filter(published=True), _(u"Published POIs"))
@@ -798,3 +802,7 @@ tourism_models.TouristicContent.add_property('services', lambda self: intersecti
 tourism_models.TouristicContent.add_property('published_services', lambda self: intersecting(Service, self).filter(published=True), _(u"Published Services"))
 tourism_models.TouristicEvent.add_property('services', lambda self: intersecting(Service, self), _(u"Services"))
 tourism_models.TouristicEvent.add_property('published_services', lambda self: intersecting(Service, self).filter(published=True), _(u"Published Services"))
+
+# No modification date (see ``DocumentPublic.get_document_date_update()``)
+delete_all_documents_on_change(TrekNetwork, Practice, Accessibility, Route, DifficultyLevel, WebLinkCategory,
+                               POIType, ServiceType)
@@ -1,12 +1,25 @@
 import os
 import json
 import mock
-from django.test import TestCase
+import shutil
+import tempfile
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.client import RequestFactory
+from django.contrib.auth.models import AnonymousUser
 from django.core import management
 from django.conf import settings
-from geotrek.common.factories import RecordSourceFactory, TargetPortalFactory
+from geotrek.common.factories import RecordSourceFactory, TargetPortalFactory, ThemeFactory
 from geotrek.trekking.factories import TrekFactory
 from geotrek.trekking import models as trek_models
+from geotrek.trekking.views import TrekViewSet, TrekPOIViewSet
+from geotrek.common.views import ThemeViewSet
+from geotrek.trekking.management.commands.sync_rando import (
+    Command, SyncZipFile, TileFetcher, TileStore, TilesCoverage, ZipTilesBuilder)
 
 
 class SyncTest(TestCase):
@@ -77,3 +90,282 @@ class SyncTest(TestCase):
                                                                   portal__name__in=[self.portal_a.name,
                                                                                     self.portal_b.name, ])
                                                           .distinct('pk').count())
+
+
+class SyncParallelTest(TransactionTestCase):
+    def setUp(self):
+        self.treks = TrekFactory.create_batch(3, published=True)
+
+    def sync_global_zip(self, **options):
+        with mock.patch('geotrek.trekking.models.Trek.prepare_map_image'):
+            management.call_command('sync_rando', settings.SYNC_RANDO_ROOT, url='http://localhost:8000',
+                                    skip_tiles=True, skip_pdf=True, skip_profile_png=True, skip_dem=True,
+                                    languages='en', verbosity='0', **options)
+        with ZipFile(os.path.join(settings.SYNC_RANDO_ROOT, 'zip', 'treks', 'en', 'global.zip'), 'r') as zipf:
+            return zipf.namelist()
+
+    def test_sync_with_jobs(self):
+        serial = self.sync_global_zip()
+        parallel = self.sync_global_zip(jobs=2)
+        # Global zip content and order does not depend on jobs
+        self.assertEqual(serial, parallel)
+        for trek in self.treks:
+            self.assertTrue(os.path.exists(os.path.join(settings.SYNC_RANDO_ROOT, 'zip', 'treks', 'en',
+                                                        '{pk}.zip'.format(pk=trek.pk))))
+
+    def test_sync_report(self):
+        self.sync_global_zip(jobs=2)
+        with open(os.path.join(os.path.dirname(settings.SYNC_RANDO_ROOT), 'sync_rando_report.json')) as f:
+            report = json.load(f)
+        # Reports of workers are merged
+        self.assertEqual(report['methods']['sync_trek']['calls'], 3)
+        self.assertEqual(len(report['slowest']), 3)
+        self.assertIn('sync_trek:en:trek:{pk}'.format(pk=self.treks[0].pk),
+                      [obj['object'] for obj in report['slowest']])
+        self.assertEqual(report['files']['zip']['files'], 4)
+
+
+class SyncIncrementalTest(TestCase):
+    def setUp(self):
+        self.trek_1, self.trek_2 = TrekFactory.create_batch(2, published=True)
+
+    def sync(self):
+        with mock.patch('geotrek.trekking.models.Trek.prepare_map_image'):
+            management.call_command('sync_rando', settings.SYNC_RANDO_ROOT, url='http://localhost:8000',
+                                    skip_tiles=True, skip_pdf=True, skip_profile_png=True, skip_dem=True,
+                                    languages='en', verbosity='0', incremental=True)
+
+    def trek_zip_inode(self, trek):
+        return os.stat(os.path.join(settings.SYNC_RANDO_ROOT, 'zip', 'treks', 'en',
+                                    '{pk}.zip'.format(pk=trek.pk))).st_ino
+
+    def test_sync_incremental(self):
+        self.sync()
+        self.assertTrue(os.path.exists(os.path.join(settings.SYNC_RANDO_ROOT, 'manifest.json')))
+        inode_1, inode_2 = self.trek_zip_inode(self.trek_1), self.trek_zip_inode(self.trek_2)
+        self.trek_2.name = u"Changed"
+        self.trek_2.save()
+        self.sync()
+        # Unchanged trek files are hard linked from previous sync
+        self.assertEqual(self.trek_zip_inode(self.trek_1), inode_1)
+        self.assertNotEqual(self.trek_zip_inode(self.trek_2), inode_2)
+        with ZipFile(os.path.join(settings.SYNC_RANDO_ROOT, 'zip', 'treks', 'en', 'global.zip'), 'r') as zipf:
+            self.assertIn('api/en/treks/{pk}/pois.geojson'.format(pk=self.trek_1.pk), zipf.namelist())
+
+    def test_shared_models_changes_sync_all(self):
+        theme = ThemeFactory.create()
+        self.sync()
+        inode_1, inode_2 = self.trek_zip_inode(self.trek_1), self.trek_zip_inode(self.trek_2)
+        theme.label = u"Changed"
+        theme.save()
+        self.sync()
+        self.assertNotEqual(self.trek_zip_inode(self.trek_1), inode_1)
+        self.assertNotEqual(self.trek_zip_inode(self.trek_2), inode_2)
+
+
+class SyncResumeTest(TestCase):
+    def sync(self, **options):
+        with mock.patch('geotrek.trekking.models.Trek.prepare_map_image'):
+            management.call_command('sync_rando', settings.SYNC_RANDO_ROOT, url='http://localhost:8000',
+                                    skip_tiles=True, skip_pdf=True, skip_profile_png=True, skip_dem=True,
+                                    languages='en', verbosity='0', **options)
+
+    def test_sync_resume(self):
+        trek = TrekFactory.create(published=True)
+        tmp_root = os.path.join(os.path.dirname(settings.SYNC_RANDO_ROOT), 'tmp_sync_rando')
+        with mock.patch.object(Command, 'sync_tourism', side_effect=Exception("Interrupted")):
+            with self.assertRaises(Exception):
+                self.sync()
+        self.assertTrue(os.path.exists(os.path.join(tmp_root, 'zip', 'treks', 'en', '{pk}.zip'.format(pk=trek.pk))))
+        with mock.patch.object(Command, 'sync_trek') as sync_trek:
+            self.sync(resume=True)
+        # Treks synced before interruption are not synced again
+        self.assertFalse(sync_trek.called)
+        self.assertFalse(os.path.exists(tmp_root))
+        self.assertFalse(os.path.exists(os.path.join(settings.SYNC_RANDO_ROOT, 'journal.json')))
+        with ZipFile(os.path.join(settings.SYNC_RANDO_ROOT, 'zip', 'treks', 'en', 'global.zip'), 'r') as zipf:
+            self.assertIn('api/en/treks/{pk}/pois.geojson'.format(pk=trek.pk), zipf.namelist())
+
+    def test_sync_resume_syncs_changed_objects_again(self):
+        trek_1, trek_2 = TrekFactory.create_batch(2, published=True)
+        with mock.patch.object(Command, 'sync_tourism', side_effect=Exception("Interrupted")):
+            with self.assertRaises(Exception):
+                self.sync()
+        trek_2.name = u"Changed"
+        trek_2.save()
+        with mock.patch.object(Command, 'sync_trek', autospec=True, side_effect=Command.sync_trek) as sync_trek:
+            self.sync(resume=True)
+        # Only the trek changed since interruption is synced again
+        self.assertEqual([args[2].pk for args, kwargs in sync_trek.call_args_list], [trek_2.pk])
+
+
+class SyncLinkMediaTest(TestCase):
+    def test_media_are_hard_linked(self):
+        theme = ThemeFactory.create()
+        TrekFactory.create(published=True)
+        with mock.patch('geotrek.trekking.models.Trek.prepare_map_image'):
+            management.call_command('sync_rando', settings.SYNC_RANDO_ROOT, url='http://localhost:8000',
+                                    skip_tiles=True, skip_pdf=True, skip_profile_png=True, skip_dem=True,
+                                    languages='en,fr', verbosity='0', link_media=True)
+        src = os.path.join(settings.MEDIA_ROOT, theme.pictogram.name)
+        dst = os.path.join(settings.SYNC_RANDO_ROOT, 'media', theme.pictogram.name)
+        self.assertEqual(os.stat(dst).st_ino, os.stat(src).st_ino)
+        with ZipFile(os.path.join(settings.SYNC_RANDO_ROOT, 'zip', 'treks', 'fr', 'global.zip'), 'r') as zipf:
+            self.assertIn(os.path.join('media', theme.pictogram.name), zipf.namelist())
+
+
+class TileStoreTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = TileStore(self.root, tiles_url='http://tiles.test/{z}/{x}/{y}.png', tiles_headers={},
+                               ignore_errors=True, tiles_dir=os.path.join(self.root, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_tiles_are_fetched_once(self):
+        with mock.patch.object(self.store.tm, 'tile', return_value='tile') as mocked:
+            self.store.fetch([(1, 0, 0), (1, 1, 0)])
+            self.store.fetch([(1, 0, 0), (1, 1, 0)])
+        self.assertEqual(mocked.call_count, 2)
+        # Identical tiles are stored once
+        self.assertEqual(os.stat(self.store.path((1, 0, 0))).st_ino, os.stat(self.store.path((1, 1, 0))).st_ino)
+
+    def test_coverages_are_merged(self):
+        coverage = TilesCoverage(self.store)
+        coverage.add((3.0, 43.0, 3.1, 43.1), [10])
+        other = TilesCoverage(self.store)
+        other.add((3.0, 43.0, 3.1, 43.1), [10])
+        other.add((3.0, 43.0, 3.1, 43.1), [11])
+        coverage.update(other)
+        self.assertEqual(len(coverage), len(other))
+
+    def test_zip_built_from_store(self):
+        filepath = os.path.join(self.root, 'tiles.zip')
+        builder = ZipTilesBuilder(filepath, lambda zipfile: zipfile.close(), self.store)
+        builder.add_coverage((3.0, 43.0, 3.1, 43.1), [10])
+        with mock.patch.object(self.store.tm, 'tile', return_value='tile'):
+            builder.run()
+        with ZipFile(filepath, 'r') as zipf:
+            self.assertEqual(zipf.namelist(), [self.store.name(tile) for tile in builder.coverage])
+
+
+class TileServer(ThreadingMixIn, HTTPServer):
+    """ Local stand-in tile server, answering each tile after a delay.
+    """
+    daemon_threads = True
+
+    def __init__(self, delay=0.05, errors=0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), TileRequestHandler)
+        self.delay = delay
+        self.errors = errors  # Number of requests to fail before answering
+        self.lock = threading.Lock()
+        self.connections = set()
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.url = 'http://127.0.0.1:{port}/{{z}}/{{x}}/{{y}}.png'.format(port=self.server_address[1])
+
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.connections.add(self.client_address)
+            server.requests += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            failing = server.errors > 0
+            server.errors -= 1
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+        body = self.path
+        self.send_response(503 if failing else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TileFetcherTest(SimpleTestCase):
+    def start_server(self, **kwargs):
+        server = TileServer(**kwargs)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_fetch_retries_server_errors(self):
+        server = self.start_server(delay=0, errors=2)
+        fetcher = TileFetcher(server.url, retries=2, backoff=0)
+        self.assertEqual(fetcher.fetch((1, 0, 1)), '/1/0/1.png')
+        self.assertEqual(server.requests, 3)
+
+    def test_concurrent_fetch_is_bounded(self):
+        server = self.start_server(delay=0.05)
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        store = TileStore(root, tiles_url=server.url, tiles_headers={}, ignore_errors=True,
+                          tiles_dir=os.path.join(root, 'cache'))
+        store.fetcher = TileFetcher(server.url, max_per_host=4)
+        tiles = [(10, x, y) for x in range(8) for y in range(8)]
+        store.fetch(tiles)
+        self.assertTrue(all([os.path.exists(store.path(tile)) for tile in tiles]))
+        self.assertLessEqual(server.max_in_flight, 4)
+        # Connections are reused
+        self.assertLessEqual(len(server.connections), 4)
+
+
+class SyncSerializeTest(TestCase):
+    def setUp(self):
+        self.trek = TrekFactory.create(published=True)
+        self.command = Command()
+        self.command.host = 'localhost:8000'
+        self.command.factory = RequestFactory()
+
+    def assertSameContent(self, viewset, params, **kwargs):
+        self.assertTrue(self.command.is_serializable(viewset))
+        request = self.command.factory.get('/', params, HTTP_HOST=self.command.host)
+        request.LANGUAGE_CODE = 'en'
+        request.user = AnonymousUser()
+        response = viewset.as_view({'get': 'list'})(request, **kwargs)
+        response.render()
+        self.assertEqual(self.command.serialize_list('en', viewset, params, **kwargs), response.content)
+
+    def test_serialize_geojson(self):
+        self.assertSameContent(TrekViewSet, {'format': 'geojson'})
+
+    def test_serialize_trek_pois(self):
+        self.assertSameContent(TrekPOIViewSet, {'format': 'geojson'}, pk=self.trek.pk)
+
+    def test_serialize_json(self):
+        self.assertSameContent(ThemeViewSet, {})
+
+
+class SyncZipFileTest(SimpleTestCase):
+    def test_compression_policy(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        filepath = os.path.join(root, 'test.zip')
+        picture = os.path.join(root, 'picture.jpg')
+        with open(picture, 'wb') as f:
+            f.write(os.urandom(1000))
+        geojson = '{"type": "FeatureCollection"}' * 100
+        zipf = SyncZipFile(filepath, 'w')
+        zipf.write(picture, 'picture.jpg')
+        zipf.writestr('treks.geojson', geojson)
+        zipf.close()
+        self.assertEqual(zipf.bytes_in, 1000 + len(geojson))
+        self.assertLess(zipf.bytes_out, 1000 + 100)
+        with ZipFile(filepath, 'r') as zipf:
+            self.assertIsNone(zipf.testzip())
+            self.assertEqual(zipf.getinfo('picture.jpg').compress_type, ZIP_STORED)
+            self.assertEqual(zipf.getinfo('treks.geojson').compress_type, ZIP_DEFLATED)
@@ -30,6 +30,7 @@ from geotrek.common.factories import (AttachmentFactory, ThemeFactory,
                                       RecordSourceFactory, TargetPortalFactory)
 from geotrek.common.tests import CommonTest, TranslationResetMixin
 from geotrek.common.utils.testdata import get_dummy_uploaded_image
+from geotrek.common.utils import delete_documents
 from geotrek.authent.factories import TrekkingManagerFactory, StructureFactory, UserProfileFactory
 from geotrek.authent.tests.base import AuthentFixturesTest
 from geotrek.core.factories import PathFactory
@@ -368,6 +369,99 @@ class TrekCustomViewTests(TrekkingManagerTest):
         self.assertEqual(len(context['pois']), 1)
 
 
+class TrekDocumentPublicCacheTest(TestCase):
+    def setUp(self):
+        self.trek = TrekWithPOIsFactory.create(published=True)
+        self.view = trekking_views.TrekDocumentPublic()
+        self.view.request = RequestFactory().get('/')
+        self.view.request.LANGUAGE_CODE = 'en'
+        self.path = self.view.get_document_path(self.trek)
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'wb') as f:
+            f.write(b'%PDF cached')
+        self.addCleanup(delete_documents, self.trek)
+        # Images shown in document are generated with it
+        for path in (self.trek.get_map_image_path(), self.trek.get_elevation_chart_path('en')):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def get_view(self, **params):
+        view = trekking_views.TrekDocumentPublic()
+        view.request = RequestFactory().get('/', params)
+        view.request.LANGUAGE_CODE = 'en'
+        return view
+
+    def test_document_path_depends_on_parameters(self):
+        TargetPortalFactory.create(name='portal')
+        view = trekking_views.TrekDocumentPublic()
+        view.request = RequestFactory().get('/', {'portal': 'portal'})
+        view.request.LANGUAGE_CODE = 'en'
+        self.assertNotEqual(view.get_document_path(self.trek), self.path)
+        view.request.LANGUAGE_CODE = 'fr'
+        self.assertNotEqual(view.get_document_path(self.trek), self.path)
+
+    def test_document_path_ignores_other_parameters(self):
+        view = trekking_views.TrekDocumentPublic()
+        view.request = RequestFactory().get('/', {'x': 'random'})
+        view.request.LANGUAGE_CODE = 'en'
+        self.assertEqual(view.get_document_path(self.trek), self.path)
+
+    def test_up_to_date_document_is_served_from_cache(self):
+        self.assertTrue(self.view.is_document_up_to_date(self.trek))
+        url = '/api/en/treks/{pk}/{slug}.pdf'.format(pk=self.trek.pk, slug=self.trek.slug)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response.content, b'%PDF cached')
+
+    def test_document_is_stale_when_poi_changes(self):
+        mtime = (self.trek.date_update - datetime.datetime(1970, 1, 1, tzinfo=utc)).total_seconds() + 1
+        os.utime(self.path, (mtime, mtime))
+        self.assertTrue(self.view.is_document_up_to_date(self.trek))
+        date_update = self.trek.date_update + datetime.timedelta(seconds=2)
+        POI.objects.filter(pk=self.trek.pois[0].pk).update(published=True, date_update=date_update)
+        self.assertFalse(self.view.is_document_up_to_date(self.trek))
+
+    def test_document_is_stale_when_map_image_changes(self):
+        mtime = (self.trek.date_update - datetime.datetime(1970, 1, 1, tzinfo=utc)).total_seconds() + 1
+        os.utime(self.path, (mtime, mtime))
+        with open(self.trek.get_map_image_path(), 'wb') as f:
+            f.write(b'PNG')
+        self.addCleanup(os.remove, self.trek.get_map_image_path())
+        os.utime(self.trek.get_map_image_path(), (mtime + 1, mtime + 1))
+        self.assertFalse(self.view.is_document_up_to_date(self.trek))
+
+    def test_document_is_deleted_when_trek_is_unpublished(self):
+        self.trek.published = False
+        self.trek.save()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_documents_are_deleted_when_a_portal_changes(self):
+        TargetPortalFactory.create()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_documents_are_deleted_when_a_shared_model_changes(self):
+        self.trek.difficulty.difficulty = u"Changed"
+        self.trek.difficulty.save()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_document_path_depends_on_version(self):
+        with mock.patch('geotrek.common.views.__version__', '0.0.0'):
+            self.assertNotEqual(self.get_view().get_document_path(self.trek), self.path)
+
+    def test_document_path_uses_parameter_object(self):
+        source = RecordSourceFactory.create(name=u"Source")
+        view = self.get_view(source=u"Source")
+        self.assertTrue(view.is_document_cacheable())
+        self.assertIn('-source{pk}'.format(pk=source.pk), view.get_document_path(self.trek))
+
+    def test_document_with_unknown_parameter_is_not_cached(self):
+        view = self.get_view(source=u"Unknown")
+        self.assertFalse(view.is_document_cacheable())
+        self.assertEqual(view.get_document_params(), {})
+
+
 class TrekCustomPublicViewTests(TrekkingManagerTest):
     @mock.patch('djappypod.backend.os.path.exists', create=True)
     def test_overriden_public_template(self, exists_patched):
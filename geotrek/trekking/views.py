@@ -24,8 +24,9 @@ from rest_framework import permissions as rest_permissions, viewsets
 from rest_framework_gis.serializers import GeoFeatureModelSerializer
 
 from geotrek.authent.decorators import same_structure_required
-from geotrek.common.models import RecordSource, TargetPortal, Attachment
-from geotrek.common.views import FormsetMixin, PublicOrReadPermMixin, DocumentPublic
+from geotrek.common.models import Attachment
+from geotrek.common.views import FormsetMixin, PublicOrReadPermMixin, DocumentPublic, PrefetchPropertiesMixin
+from geotrek.common.utils import file_date
 from geotrek.core.models import AltimetryMixin
 from geotrek.core.views import CreateFromTopologyMixin
 from geotrek.trekking.forms import SyncRandoForm
@@ -106,7 +107,7 @@ class TrekJsonList(MapEntityJsonList, TrekList):
     pass
 
 
-class TrekFormatList(MapEntityFormat, TrekList):
+class TrekFormatList(PrefetchPropertiesMixin, MapEntityFormat, TrekList):
     columns = [
         'id', 'eid', 'eid2', 'name', 'departure', 'arrival', 'duration',
         'duration_pretty', 'description', 'description_teaser',
@@ -203,20 +204,16 @@ class TrekDocumentPublicBase(DocumentPublic):
             poi.letter = letters[i]
         context['pois'] = pois
         context['object'] = context['trek'] = trek
-        source = self.request.GET.get('source')
-        if source:
-            try:
-                context['source'] = RecordSource.objects.get(name=source)
-            except RecordSource.DoesNotExist:
-                pass
-        portal = self.request.GET.get('portal')
-        if portal:
-            try:
-                context['portal'] = TargetPortal.objects.get(name=portal)
-            except TargetPortal.DoesNotExist:
-                pass
         return context
 
+    def get_document_date_update(self, obj):
+        dates = [super(TrekDocumentPublicBase, self).get_document_date_update(obj),
+                 file_date(obj.get_elevation_chart_path(self.request.LANGUAGE_CODE))]
+        dates += obj.published_pois.values_list('date_update', flat=True)
+        dates += obj.parents.values_list('date_update', flat=True)
+        dates += obj.children.values_list('date_update', flat=True)
+        return max(date for date in dates if date is not None)
+
 
 class TrekDocumentPublic(TrekDocumentPublicBase):
 
@@ -270,7 +267,7 @@ class POIJsonList(MapEntityJsonList, POIList):
     pass
 
 
-class POIFormatList(MapEntityFormat, POIList):
+class POIFormatList(PrefetchPropertiesMixin, MapEntityFormat, POIList):
     columns = [
         'id', 'eid', 'name', 'type', 'description', 'treks',
         'review', 'published', 'publication_date',
@@ -443,7 +440,7 @@ class ServiceJsonList(MapEntityJsonList, ServiceList):
     pass
 
 
-class ServiceFormatList(MapEntityFormat, ServiceList):
+class ServiceFormatList(PrefetchPropertiesMixin, MapEntityFormat, ServiceList):
     columns = [
         'id', 'eid', 'type'
     ] + AltimetryMixin.COLUMNS
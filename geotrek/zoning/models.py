@@ -6,8 +6,9 @@
 """
 from django.conf import settings
 from django.contrib.gis.db import models
+from django.db.models.query import prefetch_related_objects
 from django.utils.translation import ugettext_lazy as _
-from geotrek.common.utils import uniquify, intersecting
+from geotrek.common.utils import uniquify, intersecting, intersecting_prefetch
 from geotrek.maintenance.models import Intervention, Project
 from geotrek.tourism.models import TouristicContent, TouristicEvent
 from operator import attrgetter
@@ -15,6 +16,28 @@ from operator import attrgetter
 from geotrek.core.models import Topology, Path
 
 
+def zones_prefetch(model, edges_name, zone_attr):
+    """ Prefetch zones of objects from their ``edges_name`` property.
+    """
+    def prefetch(objects):
+        objects = model.prefetch_properties(objects, edges_name)
+        return dict((obj.pk, uniquify(map(attrgetter(zone_attr), getattr(obj, edges_name)))) for obj in objects)
+    return prefetch
+
+
+def topology_zones_prefetch(zone_cls, edges_name, zone_attr):
+    """ Prefetch zones of topologies: intersecting for points, from edges otherwise.
+    """
+    def prefetch(topologies):
+        prefetch_related_objects(topologies, ['aggregations'])
+        points = [topology for topology in topologies if topology.ispoint()]
+        result = intersecting_prefetch(zone_cls)(points) if points else {}
+        lines = [topology for topology in topologies if topology.pk not in result]
+        result.update(zones_prefetch(Topology, edges_name, zone_attr)(lines))
+        return result
+    return prefetch
+
+
 class RestrictedAreaType(models.Model):
     name = models.CharField(max_length=200, verbose_name=_(u"Name"), db_column='nom')
 
@@ -81,28 +104,31 @@ class RestrictedAreaEdge(Topology):
 
 
 if settings.TREKKING_TOPOLOGY_ENABLED:
-    Path.add_property('area_edges', RestrictedAreaEdge.path_area_edges, _(u"Restricted area edges"))
+    Path.add_property('area_edges', RestrictedAreaEdge.path_area_edges, _(u"Restricted area edges"),
+                      prefetch=Path.topologies_prefetch(RestrictedAreaEdge, 'restricted_area__area_type'))
     Path.add_property('areas', lambda self: uniquify(map(attrgetter('restricted_area'), self.area_edges)),
-                      _(u"Restricted areas"))
-    Topology.add_property('area_edges', RestrictedAreaEdge.topology_area_edges, _(u"Restricted area edges"))
+                      _(u"Restricted areas"), prefetch=zones_prefetch(Path, 'area_edges', 'restricted_area'))
+    Topology.add_property('area_edges', RestrictedAreaEdge.topology_area_edges, _(u"Restricted area edges"),
+                          prefetch=Topology.overlapping_prefetch(RestrictedAreaEdge.topology_area_edges))
     Topology.add_property('areas', lambda self: uniquify(
         intersecting(RestrictedArea, self)) if self.ispoint() else uniquify(
-        map(attrgetter('restricted_area'), self.area_edges)), _(u"Restricted areas"))
+        map(attrgetter('restricted_area'), self.area_edges)), _(u"Restricted areas"),
+        prefetch=topology_zones_prefetch(RestrictedArea, 'area_edges', 'restricted_area'))
     Intervention.add_property('area_edges', lambda self: self.topology.area_edges if self.topology else [],
-                              _(u"Restricted area edges"))
+                              _(u"Restricted area edges"), prefetch=Intervention.topology_prefetch('area_edges'))
     Intervention.add_property('areas', lambda self: self.topology.areas if self.topology else [],
-                              _(u"Restricted areas"))
+                              _(u"Restricted areas"), prefetch=Intervention.topology_prefetch('areas'))
     Project.add_property('area_edges', lambda self: self.edges_by_attr('area_edges'), _(u"Restricted area edges"))
     Project.add_property('areas', lambda self: uniquify(map(attrgetter('restricted_area'), self.area_edges)),
                          _(u"Restricted areas"))
 else:
     Topology.add_property('areas', lambda self: uniquify(intersecting(RestrictedArea, self, distance=0)),
-                          _(u"Restricted areas"))
+                          _(u"Restricted areas"), prefetch=intersecting_prefetch(RestrictedArea, distance=0))
 
 TouristicContent.add_property('areas', lambda self: intersecting(RestrictedArea, self, distance=0),
-                              _(u"Restricted areas"))
+                              _(u"Restricted areas"), prefetch=intersecting_prefetch(RestrictedArea, distance=0))
 TouristicEvent.add_property('areas', lambda self: intersecting(RestrictedArea, self, distance=0),
-                            _(u"Restricted areas"))
+                            _(u"Restricted areas"), prefetch=intersecting_prefetch(RestrictedArea, distance=0))
 
 
 class City(models.Model):
@@ -150,21 +176,29 @@ class CityEdge(Topology):
 
 
 if settings.TREKKING_TOPOLOGY_ENABLED:
-    Path.add_property('city_edges', CityEdge.path_city_edges, _(u"City edges"))
-    Path.add_property('cities', lambda self: uniquify(map(attrgetter('city'), self.city_edges)), _(u"Cities"))
-    Topology.add_property('city_edges', CityEdge.topology_city_edges, _(u"City edges"))
+    Path.add_property('city_edges', CityEdge.path_city_edges, _(u"City edges"),
+                      prefetch=Path.topologies_prefetch(CityEdge, 'city'))
+    Path.add_property('cities', lambda self: uniquify(map(attrgetter('city'), self.city_edges)), _(u"Cities"),
+                      prefetch=zones_prefetch(Path, 'city_edges', 'city'))
+    Topology.add_property('city_edges', CityEdge.topology_city_edges, _(u"City edges"),
+                          prefetch=Topology.overlapping_prefetch(CityEdge.topology_city_edges))
     Topology.add_property('cities',
-                          lambda self: uniquify(intersecting(City, self, distance=0)), _(u"Cities"))
+                          lambda self: uniquify(intersecting(City, self, distance=0)), _(u"Cities"),
+                          prefetch=intersecting_prefetch(City, distance=0))
     Intervention.add_property('city_edges', lambda self: self.topology.city_edges if self.topology else [],
-                              _(u"City edges"))
-    Intervention.add_property('cities', lambda self: self.topology.cities if self.topology else [], _(u"Cities"))
+                              _(u"City edges"), prefetch=Intervention.topology_prefetch('city_edges'))
+    Intervention.add_property('cities', lambda self: self.topology.cities if self.topology else [], _(u"Cities"),
+                              prefetch=Intervention.topology_prefetch('cities'))
     Project.add_property('city_edges', lambda self: self.edges_by_attr('city_edges'), _(u"City edges"))
     Project.add_property('cities', lambda self: uniquify(map(attrgetter('city'), self.city_edges)), _(u"Cities"))
 else:
-    Topology.add_property('cities', lambda self: uniquify(intersecting(City, self, distance=0)), _(u"Cities"))
+    Topology.add_property('cities', lambda self: uniquify(intersecting(City, self, distance=0)), _(u"Cities"),
+                          prefetch=intersecting_prefetch(City, distance=0))
 
-TouristicContent.add_property('cities', lambda self: intersecting(City, self, distance=0), _(u"Cities"))
-TouristicEvent.add_property('cities', lambda self: intersecting(City, self, distance=0), _(u"Cities"))
+TouristicContent.add_property('cities', lambda self: intersecting(City, self, distance=0), _(u"Cities"),
+                              prefetch=intersecting_prefetch(City, distance=0))
+TouristicEvent.add_property('cities', lambda self: intersecting(City, self, distance=0), _(u"Cities"),
+                            prefetch=intersecting_prefetch(City, distance=0))
 
 
 class District(models.Model):
@@ -210,23 +244,28 @@ class DistrictEdge(Topology):
 
 
 if settings.TREKKING_TOPOLOGY_ENABLED:
-    Path.add_property('district_edges', DistrictEdge.path_district_edges, _(u"District edges"))
+    Path.add_property('district_edges', DistrictEdge.path_district_edges, _(u"District edges"),
+                      prefetch=Path.topologies_prefetch(DistrictEdge, 'district'))
     Path.add_property('districts', lambda self: uniquify(map(attrgetter('district'), self.district_edges)),
-                      _(u"Districts"))
-    Topology.add_property('district_edges', DistrictEdge.topology_district_edges, _(u"District edges"))
+                      _(u"Districts"), prefetch=zones_prefetch(Path, 'district_edges', 'district'))
+    Topology.add_property('district_edges', DistrictEdge.topology_district_edges, _(u"District edges"),
+                          prefetch=Topology.overlapping_prefetch(DistrictEdge.topology_district_edges))
     Topology.add_property('districts', lambda self: uniquify(
         intersecting(District, self)) if self.ispoint() else uniquify(
-        map(attrgetter('district'), self.district_edges)), _(u"Districts"))
+        map(attrgetter('district'), self.district_edges)), _(u"Districts"),
+        prefetch=topology_zones_prefetch(District, 'district_edges', 'district'))
     Intervention.add_property('district_edges', lambda self: self.topology.district_edges if self.topology else [],
-                              _(u"District edges"))
+                              _(u"District edges"), prefetch=Intervention.topology_prefetch('district_edges'))
     Intervention.add_property('districts', lambda self: self.topology.districts if self.topology else [],
-                              _(u"Districts"))
+                              _(u"Districts"), prefetch=Intervention.topology_prefetch('districts'))
     Project.add_property('district_edges', lambda self: self.edges_by_attr('district_edges'), _(u"District edges"))
     Project.add_property('districts', lambda self: uniquify(map(attrgetter('district'), self.district_edges)),
                          _(u"Districts"))
 else:
     Topology.add_property('districts', lambda self: uniquify(intersecting(District, self, distance=0)),
-                          _(u"Districts"))
+                          _(u"Districts"), prefetch=intersecting_prefetch(District, distance=0))
 
-TouristicContent.add_property('districts', lambda self: intersecting(District, self, distance=0), _(u"Districts"))
-TouristicEvent.add_property('districts', lambda self: intersecting(District, self, distance=0), _(u"Districts"))
+TouristicContent.add_property('districts', lambda self: intersecting(District, self, distance=0), _(u"Districts"),
+                              prefetch=intersecting_prefetch(District, distance=0))
+TouristicEvent.add_property('districts', lambda self: intersecting(District, self, distance=0), _(u"Districts"),
+                            prefetch=intersecting_prefetch(District, distance=0))
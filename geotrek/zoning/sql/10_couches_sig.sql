@@ -106,6 +106,11 @@ DECLARE
     tab varchar;
     eid integer;
 BEGIN
+    -- Paths bulk loaded are linked to land layers all at once (see loadpaths command)
+    IF ft_setting_enabled('geotrek.bulk_paths') THEN
+        RETURN NULL;
+    END IF;
+
     -- Remove obsolete evenement
     IF TG_OP = 'UPDATE' THEN
         -- Related evenement/zonage/secteur/commune will be cleared by another trigger
@@ -1,12 +1,14 @@
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
 from django.contrib.gis.geos import LineString, Polygon, MultiPolygon
 
-from geotrek.core.models import Topology
-from geotrek.core.factories import PathFactory
+from geotrek.core.models import Topology, Path
+from geotrek.core.factories import PathFactory, TopologyFactory
 from geotrek.land.tests.test_views import EdgeHelperTest
 from geotrek.zoning.models import City
-from geotrek.zoning.factories import (DistrictEdgeFactory, CityEdgeFactory,
+from geotrek.zoning.factories import (DistrictEdgeFactory, CityEdgeFactory, CityFactory, DistrictFactory,
                                       RestrictedAreaFactory, RestrictedAreaEdgeFactory)
 
 
@@ -168,3 +170,51 @@ class LandLayersUpdateTest(TestCase):
         self.assertEquals(Topology.objects.filter(pk=t_ra1.pk).count(), 0)
         self.assertEquals(ra2.restrictedareaedge_set.count(), 0)
         self.assertEquals(Topology.objects.filter(pk=t_ra2.pk).count(), 0)
+
+
+class PrefetchPropertiesTest(TestCase):
+    names = ('city_edges', 'cities', 'district_edges', 'districts', 'area_edges', 'areas')
+
+    def setUp(self):
+        CityFactory.create(name='West', geom=MultiPolygon(Polygon.from_bbox((-1, -1, 5, 1)), srid=settings.SRID))
+        CityFactory.create(name='East', geom=MultiPolygon(Polygon.from_bbox((5, -1, 11, 1)), srid=settings.SRID))
+        DistrictFactory.create(geom=MultiPolygon(Polygon.from_bbox((3, -1, 11, 1)), srid=settings.SRID))
+        RestrictedAreaFactory.create(geom=MultiPolygon(Polygon.from_bbox((-1, -1, 2, 1)), srid=settings.SRID))
+        self.path = PathFactory.create(geom=LineString((0, 0), (10, 0)))
+        self.pks = []
+        self.add_topologies()
+
+    def add_topologies(self):
+        for start, end in ((0, 0.4), (0.8, 0.2), (0.9, 0.9)):
+            topology = TopologyFactory.create(no_path=True)
+            topology.add_path(self.path, start=start, end=end)
+            self.pks.append(topology.pk)
+
+    def count_queries(self, model, queryset):
+        with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as context:
+            objects = model.prefetch_properties(queryset, *self.names)
+            for obj in objects:
+                for name in self.names:
+                    list(getattr(obj, name))
+        return len(context.captured_queries)
+
+    def test_prefetched_topology_properties_are_equal(self):
+        topologies = Topology.objects.filter(pk__in=self.pks).order_by('pk')
+        expected = [[list(getattr(topology, name)) for name in self.names] for topology in topologies]
+        prefetched = Topology.prefetch_properties(topologies.all(), *self.names)
+        self.assertEqual([[getattr(topology, name) for name in self.names] for topology in prefetched], expected)
+        self.assertEqual([city.name for city in prefetched[1].cities], ['East', 'West'])
+
+    def test_prefetched_path_properties_are_equal(self):
+        expected = [list(getattr(self.path, name)) for name in self.names]
+        path = Path.prefetch_properties(Path.objects.filter(pk=self.path.pk), *self.names)[0]
+        self.assertEqual([getattr(path, name) for name in self.names], expected)
+
+    def test_number_of_queries_does_not_depend_on_number_of_objects(self):
+        count = self.count_queries(Topology, Topology.objects.filter(pk__in=self.pks))
+        self.add_topologies()
+        self.assertEqual(self.count_queries(Topology, Topology.objects.filter(pk__in=self.pks)), count)
+
+    def test_unknown_properties_are_ignored(self):
+        topologies = Topology.prefetch_properties(Topology.objects.filter(pk__in=self.pks), 'kind', 'unknown')
+        self.assertEqual(len(topologies), 3)
@@ -19,10 +19,12 @@ setup(
         'psycopg2',
         'docutils',
         'GDAL',
+        'numpy',
         'Pillow',
         'easy-thumbnails',
         'simplekml',
         'pygal',
+        'cairosvg',
         'django-extended-choices',
         'django-multiselectfield',
         'geojson',